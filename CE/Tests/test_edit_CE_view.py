@@ -7,6 +7,8 @@ from django.urls import reverse
 
 from CE import models
 from CE.Tests.test_base_class import CETestBaseClass
+from CLAHub import tools
+from CLAHub.models import MediaFile
 
 
 class TestEditPage(CETestBaseClass):
@@ -308,6 +310,74 @@ class TestEditPage(CETestBaseClass):
         finally:
             self.cleanup_test_files(self.test_ce1_pk)
 
+    def test_preexisting_pic_ignored_when_renamed(self):
+        try:
+            with open(self.test_pic1_path, 'rb') as file:
+                file = file.read()
+            ce = models.CultureEvent.objects.get(pk=self.test_ce1_pk)
+            models.Picture(ce=ce, picture=SimpleUploadedFile(name='test_pic1.jpg', content=file,
+                                                             content_type='image')).save()
+            # same content under a different name
+            models.Picture(ce=ce, picture=SimpleUploadedFile(name='test_pic2.jpg', content=file,
+                                                             content_type='image')).save()
+            self.assertEqual(len(models.Picture.objects.filter(ce=ce)), 1, 'Duplicated content saved')
+        finally:
+            self.cleanup_test_files(self.test_ce1_pk)
+
+    def test_uploaded_pic_registered(self):
+        try:
+            with open(self.test_pic1_path, 'rb') as file:
+                picture = SimpleUploadedFile(name='test_pic1.jpg', content=file.read(), content_type='image')
+            ce = models.CultureEvent.objects.get(pk=self.test_ce1_pk)
+            new_pic = models.Picture(ce=ce, picture=picture)
+            new_pic.save()
+
+            entry = MediaFile.objects.get(path=str(new_pic.picture))
+            self.assertEqual(entry.name, 'test_pic1.jpg')
+            self.assertEqual(entry.owner, 'CE.Picture.picture')
+            self.assertEqual(entry.size, os.path.getsize(os.path.join(self.test_ce1_upload_path, 'images',
+                                                                      'test_pic1.jpg')))
+            self.assertNotEqual(entry.source_sha256, entry.sha256, 'compressed picture should differ from upload')
+            # an already stored file is found with one lookup, without reading it
+            with self.assertNumQueries(1):
+                self.assertEqual(tools.check_already_imported(new_pic.picture), entry)
+        finally:
+            self.cleanup_test_files(self.test_ce1_pk)
+
+    def test_same_pic_saved_in_another_CE(self):
+        try:
+            with open(self.test_pic1_path, 'rb') as file:
+                file = file.read()
+            for pk in (self.test_ce1_pk, self.test_ce2_pk):
+                ce = models.CultureEvent.objects.get(pk=pk)
+                models.Picture(ce=ce, picture=SimpleUploadedFile(name='test_pic1.jpg', content=file,
+                                                                 content_type='image')).save()
+            self.assertEqual(len(models.Picture.objects.filter(ce=self.test_ce2_pk)), 1,
+                             'picture already in another CE discarded')
+        finally:
+            self.cleanup_test_files(self.test_ce1_pk)
+            self.cleanup_test_files(self.test_ce2_pk)
+
+    def test_deleted_pic_unregistered(self):
+        try:
+            with open(self.test_pic1_path, 'rb') as file:
+                file = file.read()
+            ce = models.CultureEvent.objects.get(pk=self.test_ce1_pk)
+            picture = models.Picture(ce=ce, picture=SimpleUploadedFile(name='test_pic1.jpg', content=file,
+                                                                       content_type='image'))
+            picture.save()
+            entry = MediaFile.objects.get(path=str(picture.picture))
+            self.assertEqual(entry.object_pk, picture.pk)
+
+            picture.delete()
+            self.assertFalse(MediaFile.objects.filter(pk=entry.pk).exists())
+            # so the same picture can be uploaded again
+            models.Picture(ce=ce, picture=SimpleUploadedFile(name='test_pic1.jpg', content=file,
+                                                             content_type='image')).save()
+            self.assertEqual(len(models.Picture.objects.filter(ce=ce)), 1)
+        finally:
+            self.cleanup_test_files(self.test_ce1_pk)
+
     def test_can_edit_question(self):
         post_data = self.standard_post
         post_data['question-0-question'] = 'NewQuestion'
@@ -1,6 +1,14 @@
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import IntegrityError
 from django.test import TestCase
 from django.core import exceptions
 from CE import models, settings, OCM_categories
+from CLAHub import jobs
+from CLAHub.models import Job
+from people.models import Person
 
 
 class CEModelTest(TestCase):
@@ -19,6 +27,22 @@ class CEModelTest(TestCase):
         with self.assertRaises(exceptions.ValidationError):
             ce.save()
 
+    def test_repeated_title_different_case_not_allowed(self):
+        models.CultureEvent(title='Example CE1').save()
+        ce = models.CultureEvent(title='EXAMPLE ce1')
+        with self.assertNumQueries(1):
+            with self.assertRaises(exceptions.ValidationError):
+                ce.check_unique_title()
+        # an existing CE can keep its own title
+        ce = models.CultureEvent.objects.get(title='Example CE1')
+        ce.description_plain_text = 'Edited'
+        ce.save()
+
+    def test_title_unique_ignoring_case_in_database(self):
+        models.CultureEvent(title='Example CE1', slug='example-ce1').save()
+        with self.assertRaises(IntegrityError):
+            models.CultureEvent.objects.bulk_create([models.CultureEvent(title='example ce1', slug='other')])
+
     def test_auto_hyperlink(self):
         settings.auto_cross_reference = True
         # create 1st CE
@@ -122,11 +146,39 @@ class CEModelTest(TestCase):
         desc = 'a ce longer again was before a ce longer, but not a long ce and certainly not a ce.'
         ce.description_plain_text = desc
         ce.save()
-        # test for each link
-        self.assertIn('<a href="a-ce">A CE</a>', ce.description, 'shortest link not present')
-        self.assertIn('<a href="a-ce-long">A CE long</a>', ce.description, 'length 2 link not present')
-        self.assertIn('<a href="a-ce-longer">A CE longer</a>', ce.description, 'length 3 link not present')
-        self.assertIn('<a href="a-ce-longer-again">A CE longer again</a>', ce.description, 'longest link not present')
+        # 'a ce long' only appears inside longer titles so shouldn't be linked
+        self.assertEqual(ce.description, '<a href="a-ce-longer-again">A CE longer again</a> was before '
+                                         '<a href="a-ce-longer">A CE longer</a>, but not a long ce and certainly '
+                                         'not <a href="a-ce">A CE</a>.')
+
+    def test_hyperlink_whole_words_only(self):
+        settings.auto_cross_reference = True
+        models.CultureEvent(title='A CE').save()
+        ce = models.CultureEvent(title='Test', description_plain_text='a cement mixer, not a ce')
+        ce.save()
+        self.assertEqual(ce.description, 'a cement mixer, not <a href="a-ce">A CE</a>')
+
+    def test_no_hyperlink_in_existing_anchor(self):
+        settings.auto_cross_reference = True
+        models.CultureEvent(title='Fishing').save()
+        ce = models.CultureEvent(title='Test',
+                                 description_plain_text='<a href="fishing">Fishing</a> and <strong>fishing</strong>')
+        ce.save()
+        self.assertEqual(ce.description, '<a href="fishing">Fishing</a> and '
+                                         '<strong><a href="fishing">Fishing</a></strong>')
+
+    def test_hyperlink_queries_dont_grow_with_matches(self):
+        settings.auto_cross_reference = True
+        for i in range(10):
+            models.CultureEvent(title='Example %s' % i).save()
+        ce = models.CultureEvent(title='Test', description=' '.join('example %s' % i for i in range(10)))
+        # one query to check the title set version, one to reload the titles
+        with self.assertNumQueries(2):
+            ce.auto_cross_ref()
+        self.assertEqual(ce.description.count('href'), 10)
+        # the titles haven't changed, so the matcher is reused
+        with self.assertNumQueries(1):
+            ce.auto_cross_ref()
 
     def test_repeated_hyperlink(self):
         settings.auto_cross_reference = True
@@ -197,12 +249,112 @@ class CEModelTest(TestCase):
         self.assertIn('<strong>', ce.description, 'Allowable HTML was removed')
 
 
+class CELinkIndexTest(TestCase):
+    def setUp(self):
+        settings.auto_cross_reference = True
+        self.fishing = models.CultureEvent(title='Fishing')
+        self.fishing.save()
+        self.ce = models.CultureEvent(title='Example', description_plain_text='Went fishing with nets')
+        self.ce.save()
+
+    def test_links_recorded(self):
+        self.assertEqual(list(self.ce.links.all()), [self.fishing])
+        self.assertEqual(list(self.fishing.linked_from.all()), [self.ce])
+
+    def test_rename_flags_linking_CEs(self):
+        self.fishing.title = 'Nets'
+        self.fishing.save()
+        self.ce.refresh_from_db()
+        self.assertTrue(self.ce.needs_relink)
+
+        last_modified = self.ce.last_modified
+        self.ce.relink()
+        self.ce.refresh_from_db()
+        self.assertFalse(self.ce.needs_relink)
+        self.assertEqual(self.ce.description, 'Went fishing with <a href="nets">Nets</a>')
+        self.assertEqual(list(self.ce.links.all()), [self.fishing])
+        self.assertEqual(self.ce.last_modified, last_modified, 'relinking counted as an edit')
+
+    def test_new_CE_flags_mentioning_CEs(self):
+        models.CultureEvent(title='Nets').save()
+        self.ce.refresh_from_db()
+        self.assertTrue(self.ce.needs_relink)
+        self.fishing.refresh_from_db()
+        self.assertFalse(self.fishing.needs_relink, 'unrelated CE flagged')
+
+    def test_delete_flags_linking_CEs(self):
+        self.fishing.delete()
+        self.ce.refresh_from_db()
+        self.assertTrue(self.ce.needs_relink)
+        self.ce.relink()
+        self.assertEqual(self.ce.description, 'Went fishing with nets')
+
+    def test_unchanged_title_flags_nothing(self):
+        self.fishing.description_plain_text = 'Catching fish'
+        self.fishing.save()
+        self.ce.refresh_from_db()
+        self.assertFalse(self.ce.needs_relink)
+
+    def test_flagging_queues_relink_job(self):
+        self.fishing.title = 'Nets'
+        self.fishing.save()
+        models.CultureEvent(title='Went').save()
+        # one queued job relinks every flagged CE
+        self.assertEqual(Job.objects.filter(task='relink_ces', status=Job.QUEUED).count(), 1)
+
+        jobs.run_pending()
+        self.ce.refresh_from_db()
+        self.assertFalse(self.ce.needs_relink)
+        self.assertEqual(self.ce.description,
+                         '<a href="went">Went</a> fishing with <a href="nets">Nets</a>')
+
+    def test_unflagged_save_queues_nothing(self):
+        Job.objects.all().delete()
+        models.CultureEvent(title='Hunting').save()
+        self.assertFalse(Job.objects.exists())
+
+    def test_title_matcher_rebuilt_only_for_title_changes(self):
+        models.CultureEvent.get_title_matcher()
+        with mock.patch.object(models.CE.utilities, 'TitleMatcher',
+                               wraps=models.CE.utilities.TitleMatcher) as matcher:
+            self.fishing.description_plain_text = 'Catching fish'
+            self.fishing.save()
+            self.ce.description_plain_text = 'Went fishing'
+            self.ce.save()
+            self.assertEqual(matcher.call_count, 0, 'matcher rebuilt for a description edit')
+
+            self.fishing.title = 'Nets'
+            self.fishing.save()
+            self.ce.save()
+            self.assertEqual(matcher.call_count, 1)
+            self.assertEqual(self.ce.description, 'Went fishing')
+
+    def test_update_CEs_relinks_flagged_CEs(self):
+        self.fishing.title = 'Nets'
+        self.fishing.save()
+        call_command('update_CEs', stdout=StringIO())
+        self.ce.refresh_from_db()
+        self.assertFalse(self.ce.needs_relink)
+        self.assertIn('<a href="nets">Nets</a>', self.ce.description)
+
+
 class TextsModelTest(TestCase):
     def test_string_method(self):
         ce = models.CultureEvent(title='Example CE1')
         text = models.Text(ce=ce, phonetic_text='djaŋɡo', text_title='example text')
         self.assertEqual(str(text), 'example text')
 
+    def test_speaker_hyperlinks(self):
+        ce = models.CultureEvent(title='Example CE1')
+        ce.save()
+        for name in ['Steve'] + ['Person %d' % i for i in range(1, 55)]:
+            Person(name=name).save()
+        text = models.Text(ce=ce, speaker_plain_text='5 and 55, not 99')
+        with self.assertNumQueries(2):  # the profiles and the save
+            text.save()
+        self.assertEqual(text.speaker, '<a href="/clahub/people/5"> Person 4</a> and '
+                                       '<a href="/clahub/people/55"> Person 54</a>, not 99')
+
 
 class TagTests(TestCase):
     def test_ocm_slug_dictionary(self):
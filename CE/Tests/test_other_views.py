@@ -99,6 +99,16 @@ class TestViewPage(TestCase):
         response = self.client.get(reverse('CE:view', args='9'))
         self.assertEqual(response.status_code, 404)
 
+    def test_flagged_CE_not_relinked_on_view(self):
+        ce = models.CultureEvent.objects.get(pk=3)
+        ce.description_plain_text = 'A culture event happened, see culture event'
+        ce.save()
+        models.CultureEvent(title='Culture event').save()
+        # relinking is left to the queued job, viewing doesn't write
+        response = self.client.get(reverse('CE:view', args='3'))
+        self.assertNotContains(response, '<a href="culture-event">Culture event</a>')
+        self.assertTrue(models.CultureEvent.objects.get(pk=3).needs_relink)
+
 
 class QuestionPageTest(TestCase):
     @classmethod
@@ -374,3 +384,31 @@ class TextViewAndGenreTest(TestCase):
         self.assertContains(response, 'Text 1')
         response = self.client.get(reverse('CE:text_search') + '?search=Bad')
         self.assertContains(response, 'No search results')
+
+    def test_text_listings_show_excerpts(self):
+        self.text1.orthographic_text = '**Ortho1** ' + ' '.join(['word'] * 60)
+        self.text1.save()
+        for url in [reverse('CE:texts_home'), reverse('CE:text_genre', args='1'),
+                    reverse('CE:text_search') + '?search=Text 1']:
+            response = self.client.get(url)
+            self.assertContains(response, 'Ortho1 word')
+            self.assertNotContains(response, '<strong>Ortho1</strong>')
+            self.assertContains(response, 'word…')
+            self.assertContains(response, 'Read the full text')
+
+    def test_text_listings_only_format_one_page(self):
+        ce = models.CultureEvent.objects.get(title='Example CE1')
+        models.Text.objects.bulk_create([models.Text(text_title='Bulk text %s' % i, orthographic_text='Bulk',
+                                                     ce=ce) for i in range(40)])
+        response = self.client.get(reverse('CE:texts_home'))
+        self.assertEqual(len(response.context['Texts']), 25)
+        self.assertEqual(sum(t.orthographic_text == 'Bulk' for t in response.context['Texts']), 25)
+        # listings don't render or store the full html
+        self.assertFalse(models.Text.objects.exclude(rendered_text='').exists())
+
+    def test_full_text_rendered_on_CE_page(self):
+        self.text1.orthographic_text = '**Ortho1**'
+        self.text1.save()
+        response = self.client.get(reverse('CE:view', args=[self.text1.ce.pk]))
+        self.assertContains(response, '<strong>')
+        self.assertNotContains(response, 'Read the full text')
@@ -0,0 +1,230 @@
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+
+from CE import models, utilities
+from CLAHub import perf
+from lexicon import models as lexicon_models
+
+# Output recorded from the regex based highlighter (one re.sub per word) that the
+# single pass highlighter replaced. Each case is (orthographic text, highlighted
+# text, known words). WORD_URL and VERB_URL stand in for the lexicon entry links.
+PARITY_CASES = {
+    "mixed_entries": (
+        "hobot yamin yagim gamo",
+        '<a class="no-decoration" href="WORD_URL" target="_blank" rel="noopener noreferrer">hobot</a> <a class="no-decoration" href="VERB_URL" target="_blank" rel="noopener noreferrer">yamin</a> <a class="no-decoration" href="VERB_URL" target="_blank" rel="noopener noreferrer"><span class="green">yagim</span></a> <span class="red">gamo</span>',
+        "50%",
+    ),
+    "repeated_words": (
+        "gamo gamo gamo gamo hobot hobot",
+        '<span class="red">gamo</span> <span class="red">gamo</span> <span class="red">gamo</span> <span class="red">gamo</span> <a class="no-decoration" href="WORD_URL" target="_blank" rel="noopener noreferrer">hobot</a> <a class="no-decoration" href="WORD_URL" target="_blank" rel="noopener noreferrer">hobot</a>',
+        "50%",
+    ),
+    "brackets": (
+        "(hobot) yamin (kuku) hobot",
+        '(<a class="no-decoration" href="WORD_URL" target="_blank" rel="noopener noreferrer">hobot</a>) <a class="no-decoration" href="VERB_URL" target="_blank" rel="noopener noreferrer">yamin</a> (kuku) <a class="no-decoration" href="WORD_URL" target="_blank" rel="noopener noreferrer">hobot</a>',
+        "100%",
+    ),
+    "timestamps": (
+        "0:01:23 hobot yamin 1:02:03 gamo",
+        '0:01:23 <a class="no-decoration" href="WORD_URL" target="_blank" rel="noopener noreferrer">hobot</a> <a class="no-decoration" href="VERB_URL" target="_blank" rel="noopener noreferrer">yamin</a> 1:02:03 <span class="red">gamo</span>',
+        "67%",
+    ),
+    "tag_and_punctuation_boundaries": (
+        "<b>hobot</b> hobot-gamo gamo-hobot #hobot hobot#",
+        '<b>hobot</b> hobot-<span class="red">gamo</span> gamo-<a class="no-decoration" href="WORD_URL" target="_blank" rel="noopener noreferrer">hobot</a> #hobot <a class="no-decoration" href="WORD_URL" target="_blank" rel="noopener noreferrer">hobot</a>#',
+        "33%",
+    ),
+    "numbers_touching_words": (
+        "hobot1 2hobot yamen",
+        '<a class="no-decoration" href="WORD_URL" target="_blank" rel="noopener noreferrer">hobot</a>1 2<a class="no-decoration" href="WORD_URL" target="_blank" rel="noopener noreferrer">hobot</a> <a class="no-decoration" href="VERB_URL" target="_blank" rel="noopener noreferrer">yamen</a>',
+        "100%",
+    ),
+    "mixed_case": (
+        "Hobot YAMIN Gamo",
+        '<a class="no-decoration" href="WORD_URL" target="_blank" rel="noopener noreferrer">hobot</a> <a class="no-decoration" href="VERB_URL" target="_blank" rel="noopener noreferrer">yamin</a> <span class="red">gamo</span>',
+        "67%",
+    ),
+    "markdown": (
+        "* hobot\n* yamin\n\nnew paragraph gamo.",
+        '* <a class="no-decoration" href="WORD_URL" target="_blank" rel="noopener noreferrer">hobot</a>\n* <a class="no-decoration" href="VERB_URL" target="_blank" rel="noopener noreferrer">yamin</a>\n\n<span class="red">new</span> <span class="red">paragraph</span> <span class="red">gamo</span>.',
+        "40%",
+    ),
+    "bracket_inside_word": (
+        "ho(xx)bot hobot",
+        'ho(xx)bot <a class="no-decoration" href="WORD_URL" target="_blank" rel="noopener noreferrer">hobot</a>',
+        "100%",
+    ),
+    "spelling_variations": (
+        "hobet, hobot; yamen! gamo?",
+        '<a class="no-decoration" href="WORD_URL" target="_blank" rel="noopener noreferrer">hobet</a>, <a class="no-decoration" href="WORD_URL" target="_blank" rel="noopener noreferrer">hobot</a>; <a class="no-decoration" href="VERB_URL" target="_blank" rel="noopener noreferrer">yamen</a>! <span class="red">gamo</span>?',
+        "75%",
+    ),
+}
+
+
+class HighlightTestCase(TestCase):
+    """A small lexicon and a CE to add texts to."""
+
+    def setUp(self):
+        cache.clear()
+        self.word = lexicon_models.KovolWord(
+            kgu="hobot", eng="house", tpi="haus", checked=True
+        )
+        self.word.save()
+        lexicon_models.KovolWordSpellingVariation(
+            word=self.word, spelling_variation="hobet"
+        ).save()
+        self.verb = lexicon_models.ImengisVerb(
+            eng="go",
+            tpi="go",
+            future_1s="yamin",
+            future_1s_checked=True,
+            past_1s="yagim",
+        )
+        self.verb.save()
+        lexicon_models.VerbSpellingVariation(
+            verb=self.verb, spelling_variation="yamen", conjugation="1sf"
+        ).save()
+        self.ce = models.CultureEvent(title="Highlighting")
+        self.ce.save()
+
+    def expected(self, html):
+        return html.replace("WORD_URL", self.word.get_absolute_url()).replace(
+            "VERB_URL", self.verb.get_absolute_url()
+        )
+
+    def make_text(self, orthographic_text):
+        text = models.Text(ce=self.ce, orthographic_text=orthographic_text)
+        text.save()
+        return text
+
+
+class HighlightParityTest(HighlightTestCase):
+    def test_parity_with_regex_highlighter(self):
+        for name, (orthographic, highlighted, known_words) in PARITY_CASES.items():
+            with self.subTest(name):
+                text = self.make_text(orthographic)
+                self.assertEqual(
+                    utilities.highlight_non_lexicon_words(text),
+                    self.expected(highlighted),
+                )
+                self.assertEqual(text.known_words, known_words)
+
+    def test_format_text_html_parity(self):
+        text = self.make_text(PARITY_CASES["timestamps"][0])
+        self.assertEqual(
+            utilities.format_text_html(text),
+            self.expected(
+                '<p><a href="#a" onclick="{text_TEXT_ID_audio.currentTime=83.0};">0:01:23</a> <a class="no-decoration" href="WORD_URL" target="_blank" rel="noopener noreferrer">hobot</a> <a class="no-decoration" href="VERB_URL" target="_blank" rel="noopener noreferrer">yamin</a> <a href="#a" onclick="{text_TEXT_ID_audio.currentTime=3723.0};">1:02:03</a> <span class="red">gamo</span></p>'
+            ).replace("TEXT_ID", str(text.pk)),
+        )
+
+        text = self.make_text(PARITY_CASES["markdown"][0])
+        self.assertEqual(
+            utilities.format_text_html(text),
+            self.expected(
+                '<ul>\n<li><a class="no-decoration" href="WORD_URL" target="_blank" rel="noopener noreferrer">hobot</a></li>\n<li><a class="no-decoration" href="VERB_URL" target="_blank" rel="noopener noreferrer">yamin</a></li>\n</ul>\n<p><span class="red">new</span> <span class="red">paragraph</span> <span class="red">gamo</span>.</p>'
+            ),
+        )
+
+    def test_inserted_markup_not_highlighted(self):
+        # the regex highlighter rescanned its own markup, so a word like "blank"
+        # would be highlighted inside target="_blank"
+        text = self.make_text("hobot blank")
+        self.assertEqual(
+            utilities.highlight_non_lexicon_words(text),
+            self.expected(
+                '<a class="no-decoration" href="WORD_URL" target="_blank" '
+                'rel="noopener noreferrer">hobot</a> <span class="red">blank</span>'
+            ),
+        )
+
+
+class RenderTextTest(HighlightTestCase):
+    def test_render_stored(self):
+        text = self.make_text("hobot gamo")
+        html = utilities.render_text(text)
+        self.assertEqual(html, utilities.format_text_html(text))
+
+        stored = models.Text.objects.get(pk=text.pk)
+        self.assertEqual(stored.rendered_text, html)
+        self.assertEqual(stored.rendered_known_words, "50%")
+        self.assertEqual(stored.last_modified, text.last_modified)
+
+    def test_stored_render_reused(self):
+        text = self.make_text("hobot gamo")
+        utilities.render_text(text)
+        text = models.Text.objects.get(pk=text.pk)
+        # a current render is a lookup: only the lexicon version is queried
+        with self.assertNumQueries(1):
+            html = utilities.render_text(text)
+        self.assertIn('<span class="red">gamo</span>', html)
+        self.assertEqual(text.known_words, "50%")
+
+    def test_rerendered_when_lexicon_changes(self):
+        text = self.make_text("hobot gamo")
+        utilities.render_text(text)
+        lexicon_models.KovolWord(kgu="gamo", eng="pig", tpi="pik", checked=True).save()
+
+        text = models.Text.objects.get(pk=text.pk)
+        html = utilities.render_text(text)
+        self.assertNotIn('<span class="red">gamo</span>', html)
+        self.assertEqual(text.known_words, "100%")
+
+    def test_rerendered_when_variation_added(self):
+        text = self.make_text("hobot gamo")
+        utilities.render_text(text)
+        lexicon_models.KovolWordSpellingVariation(
+            word=self.word, spelling_variation="gamo"
+        ).save()
+
+        text = models.Text.objects.get(pk=text.pk)
+        self.assertEqual(utilities.render_text(text), utilities.format_text_html(text))
+        self.assertNotIn('<span class="red">gamo</span>', text.rendered_text)
+
+    def test_rerendered_when_entry_deleted(self):
+        text = self.make_text("hobot gamo")
+        utilities.render_text(text)
+        self.word.delete()
+
+        text = models.Text.objects.get(pk=text.pk)
+        self.assertIn('<span class="red">hobot</span>', utilities.render_text(text))
+        self.assertEqual(text.known_words, "0%")
+
+    def test_rerendered_when_text_changes(self):
+        text = self.make_text("hobot gamo")
+        utilities.render_text(text)
+        text.orthographic_text = "hobot"
+        text.save()
+
+        self.assertNotIn("gamo", utilities.render_text(text))
+
+
+class TextProfilingTest(HighlightTestCase):
+    def test_stages_timed(self):
+        text = self.make_text(PARITY_CASES["timestamps"][0])
+        timings = []
+        perf.hooks.append(lambda stage, seconds: timings.append(stage))
+        try:
+            utilities.format_text_html(text)
+        finally:
+            perf.hooks.clear()
+        self.assertEqual(
+            [stage for stage in timings if stage in utilities.TEXT_STAGES],
+            list(utilities.TEXT_STAGES),
+        )
+        self.assertIn("lexicon_index", timings)
+
+    def test_profile_texts_command(self):
+        slow = self.make_text("hobot gamo " * 200)
+        self.make_text("hobot")
+        output = StringIO()
+        call_command("profile_texts", limit=1, stdout=output)
+        output = output.getvalue()
+        self.assertIn("markdown", output)
+        self.assertRegex(output, rf"\n +{slow.pk} ")
+        self.assertIn(f"{models.Text.objects.count()} texts profiled", output)
+        self.assertEqual(perf.hooks, [])
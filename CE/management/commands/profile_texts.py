@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from CE.models import Text
+from CE.utilities import TEXT_STAGES, format_text_html
+from CLAHub import perf
+from lexicon.utilities import get_lexicon_index
+
+
+class Command(BaseCommand):
+    help = '''Renders every text without saving it, timing each stage of the render (lexicon highlighting, timestamp
+    links, bleach and markdown), and lists the slowest texts with the time each stage took.
+    Trigger via: source venv/bin/activate && python manage.py profile_texts'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=20, help='How many of the slowest texts to list')
+
+    def handle(self, **options):
+        # the lexicon index is fetched once then cached, time it apart from the texts
+        start = time.perf_counter()
+        get_lexicon_index()
+        self.stdout.write('Lexicon index fetched in %.1fms' % ((time.perf_counter() - start) * 1000))
+
+        stages = {}
+
+        def record(stage, seconds):
+            stages[stage] = stages.get(stage, 0) + seconds
+
+        profiles = []
+        totals = dict.fromkeys(TEXT_STAGES, 0)
+        perf.hooks.append(record)
+        try:
+            for text in Text.objects.iterator():
+                stages.clear()
+                start = time.perf_counter()
+                format_text_html(text)
+                profiles.append((time.perf_counter() - start, text, dict(stages)))
+                for stage in TEXT_STAGES:
+                    totals[stage] += stages.get(stage, 0)
+        finally:
+            perf.hooks.remove(record)
+
+        profiles.sort(key=lambda profile: profile[0], reverse=True)
+        self.stdout.write('%6s %-30s %6s %9s ' % ('pk', 'title', 'words', 'total ms')
+                          + ' '.join('%10s' % stage for stage in TEXT_STAGES))
+        for total, text, text_stages in profiles[:options['limit']]:
+            self.stdout.write('%6s %-30.30s %6s %9.2f ' % (text.pk, text.text_title, len(text.orthographic_text.split()),
+                                                          total * 1000)
+                              + ' '.join('%10.2f' % (text_stages.get(stage, 0) * 1000) for stage in TEXT_STAGES))
+
+        self.stdout.write('All texts: ' + ', '.join('%s %.1fms' % (stage, seconds * 1000)
+                                                    for stage, seconds in totals.items()))
+        self.stdout.write(self.style.SUCCESS('%s texts profiled' % len(profiles)))
@@ -0,0 +1,32 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from CE.models import Text
+from CE.utilities import get_lexicon_version, render_is_current, render_text
+
+logger = logging.getLogger('root')
+
+
+class Command(BaseCommand):
+    help = '''Texts are rendered to html (lexicon highlighting, timestamps and markdown) the first time they are
+    viewed after the text or the lexicon changes. Run this to render any out of date texts ahead of time, or with
+    --rebuild to render every text again. Trigger via: source venv/bin/activate && python manage.py render_texts'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Render every text, even if the stored render is up to date')
+
+    def handle(self, **options):
+        """Render every text whose stored html is out of date."""
+        lexicon_version = get_lexicon_version()
+        texts = Text.objects.all()
+        if options['rebuild']:
+            texts.update(rendered_last_modified=None)
+        rendered = 0
+        for text in texts:
+            if not render_is_current(text, lexicon_version):
+                render_text(text, lexicon_version)
+                rendered += 1
+        self.stdout.write(self.style.SUCCESS('%s of %s texts rendered' % (rendered, len(texts))))
+        logger.info('%s texts rendered via management command' % rendered)
@@ -2,20 +2,23 @@ import logging
 
 from django.core.management.base import BaseCommand
 
-from CE.models import CultureEvent
+from CE.models import CultureEvent, relink_flagged
 
 logger = logging.getLogger('root')
 
 
 class Command(BaseCommand):
-    help = '''If a CE\'s name is changed that change won't be reflected in the any automatic hyperlinks added to the
-    description field. The solution is to schedule CLAHub to trigger the save function for all events periodically.
-    Trigger via crontab using: source venv/bin/activate && python manage.py update_events'''
+    help = '''When a CE is created, renamed or deleted the CEs whose descriptions mention it are flagged for relinking.
+    They are relinked by a job run by run_jobs, run this to relink all flagged CEs without the job worker. Use --all
+    to relink every CE. Trigger via crontab using: source venv/bin/activate && python manage.py update_CEs'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Relink every CE, not just the flagged ones')
 
     def handle(self, **options):
-        """Updates the profiles by running the save command. This will update hyperlinks in the family field
-        to reflect name changes"""
-        for event in CultureEvent.objects.all():
-            event.save()
-        self.stdout.write(self.style.SUCCESS('All Culture events updated'))
-        logger.info('All Culture events updated via management command')
+        """Relink the descriptions of flagged CEs so hyperlinks reflect CE name changes"""
+        if options['all']:
+            CultureEvent.objects.update(needs_relink=True)
+        relinked = relink_flagged()
+        self.stdout.write(self.style.SUCCESS('%s Culture events relinked' % relinked))
+        logger.info('%s Culture events relinked via management command' % relinked)
@@ -3,17 +3,39 @@
 # inserts 2 example CEs, 2 Questions, 1 Text,
 # inserts
 
+# The historical models are used so later changes to the CE models don't break this
+# migration. The processing the models' save methods would do (cleaning and cross
+# referencing descriptions, slugs, tags and picture compression) is done here by hand.
+
 from django.db import migrations
 from django.core.files.uploadedfile import SimpleUploadedFile
-from CE import models
-from CLAHub import base_settings
+from django.utils.text import slugify
+import bleach
+
+from CLAHub import base_settings, tools
 
 import os
 
 example_data_folder = os.path.join(base_settings.BASE_DIR, 'CLAHub/assets/example_data')
 
+
+def save_ce(ce):
+    ce.description = bleach.clean(ce.description_plain_text)
+    ce.slug = slugify(ce.title)
+    ce.save()
+
+
 def insert_example_CEs(apps, schema_editor):
-    example_ce_1 = models.CultureEvent(
+    CultureEvent = apps.get_model('CE', 'CultureEvent')
+    Text = apps.get_model('CE', 'Text')
+    Picture = apps.get_model('CE', 'Picture')
+    Visit = apps.get_model('CE', 'Visit')
+    Question = apps.get_model('CE', 'Question')
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    Tag = apps.get_model('taggit', 'Tag')
+    TaggedItem = apps.get_model('taggit', 'TaggedItem')
+
+    example_ce_1 = CultureEvent(
         title="Example CE",
         last_modified_by='CLAHubDev',
         description_plain_text='''We arranged with a family beforehand that we'd come with the and see how laundry is done.
@@ -27,12 +49,12 @@ The wet clothes were put in another bucket again and hung up at the washing line
     interpretation='''There were no men present at all suggesting that laundry is women's work.''',
     differences='I\'ve seen people washing at a nearby stream too'
     )
-    example_ce_1.save()
+    save_ce(example_ce_1)
     with open(os.path.join(example_data_folder, 'example_audio1.mp3'), 'rb') as file:
         file = file.read()
         audio = SimpleUploadedFile(name='example_audio1.mp3', content=file, content_type='audio')
 
-        example_text_1 = models.Text(
+        example_text_1 = Text(
             ce=example_ce_1,
             text_title='Maryanne talking about doing laundry',
             phonetic_text='''oke fəst mipla ɡo pulapim wara kam kapsaⁱtim insaⁱt lo bakɛt sɛrim wara biloŋ 
@@ -47,35 +69,39 @@ The wet clothes were put in another bucket again and hung up at the washing line
             audio=audio
             )
         example_text_1.save()
-        example_ce_1.tags.add('Example')
+        tag = Tag.objects.create(name='Example', slug='example')
+        TaggedItem.objects.create(
+            tag=tag,
+            object_id=example_ce_1.pk,
+            content_type=ContentType.objects.get_or_create(app_label='CE', model='cultureevent')[0])
 
     for i in range(1, 5):
         with open(os.path.join(example_data_folder, 'example_CE_pic%s.jpg' % str(i)), 'rb') as file:
             file = file.read()
             picture = SimpleUploadedFile(name='example_CE_pic%s.jpg' % str(i), content=file, content_type='image')
-            example_pic = models.Picture(picture=picture,
-                                          ce=example_ce_1)
+            example_pic = Picture(picture=tools.compress_picture(picture, (1200, 1200)),
+                                  ce=example_ce_1)
             example_pic.save()
 
-    visit = models.Visit(ce=example_ce_1,
-                         team_present='Gerdine, Becky',
-                         nationals_present='Maryanne and family',
-                         date='2016-02-06')
+    visit = Visit(ce=example_ce_1,
+                  team_present='Gerdine, Becky',
+                  nationals_present='Maryanne and family',
+                  date='2016-02-06')
     visit.save()
-    question1 = models.Question(ce=example_ce_1,
-                                asked_by='CLAHubDev',
-                                last_modified_by='CLAHubDev',
-                                question='Do some families struggle to afford soap, or does everyone have it?')
+    question1 = Question(ce=example_ce_1,
+                         asked_by='CLAHubDev',
+                         last_modified_by='CLAHubDev',
+                         question='Do some families struggle to afford soap, or does everyone have it?')
     question1.save()
-    question2 = models.Question(ce=example_ce_1,
-                                asked_by='CLAHubDev',
-                                last_modified_by='CLAHubDev',
-                                question='How dirty do people let their clothes get before washing?',
-                                answer='Pretty dirty :), but they do take more care to not get them so dirty in the first place compared to us.'
-                                )
+    question2 = Question(ce=example_ce_1,
+                         asked_by='CLAHubDev',
+                         last_modified_by='CLAHubDev',
+                         question='How dirty do people let their clothes get before washing?',
+                         answer='Pretty dirty :), but they do take more care to not get them so dirty in the first place compared to us.'
+                         )
     question2.save()
 
-    example_ce_2 = models.CultureEvent(
+    example_ce_2 = CultureEvent(
         title='Explanation of CLAHub features',
         last_modified_by='CLAHubDev',
         description_plain_text='''This area is for describing the Culture Event (CE) in general. The
@@ -107,11 +133,17 @@ The wet clothes were put in another bucket again and hung up at the washing line
                     'to include information about times the CE deviated from the regular pattern, or to'
                     'add specific information from their participation'
     )
+    save_ce(example_ce_2)
+    # the description cross references the first example CE
+    example_ce_2.description = example_ce_2.description.replace(
+        'example ce for example', '<a href="example-ce">Example CE</a> for example')
     example_ce_2.save()
 
+
 class Migration(migrations.Migration):
     dependencies = [
         ('CE', '0001_initial'),
+        ('contenttypes', '0002_remove_content_type_name'),
     ]
 
     operations = [
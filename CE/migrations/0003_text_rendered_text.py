@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('CE', '0002_example_CE_data'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='text',
+            name='rendered_known_words',
+            field=models.CharField(blank=True, editable=False, max_length=4),
+        ),
+        migrations.AddField(
+            model_name='text',
+            name='rendered_last_modified',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='text',
+            name='rendered_lexicon_version',
+            field=models.DecimalField(decimal_places=3, editable=False, max_digits=5, null=True),
+        ),
+        migrations.AddField(
+            model_name='text',
+            name='rendered_text',
+            field=models.TextField(blank=True, editable=False),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:07
+
+from django.db import migrations, models
+
+
+def flag_for_relink(apps, schema_editor):
+    # links are recorded when a description is relinked, so relink everything once
+    CultureEvent = apps.get_model('CE', 'CultureEvent')
+    CultureEvent.objects.update(needs_relink=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('CE', '0003_text_rendered_text'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cultureevent',
+            name='links',
+            field=models.ManyToManyField(blank=True, editable=False, related_name='linked_from', to='CE.cultureevent'),
+        ),
+        migrations.AddField(
+            model_name='cultureevent',
+            name='needs_relink',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(flag_for_relink, migrations.RunPython.noop),
+    ]
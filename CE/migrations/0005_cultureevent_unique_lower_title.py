@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:17
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+def check_title_conflicts(apps, schema_editor):
+    # the constraint can't be added while titles only differing by case exist, list them so they can be renamed
+    CultureEvent = apps.get_model('CE', 'CultureEvent')
+    titles = {}
+    for pk, title in CultureEvent.objects.values_list('pk', 'title'):
+        titles.setdefault(title.lower(), []).append('%s (pk %s)' % (title, pk))
+    conflicts = [', '.join(ces) for ces in titles.values() if len(ces) > 1]
+    if conflicts:
+        raise RuntimeError('CE titles must be unique ignoring case. Rename these CEs then migrate again:\n'
+                           + '\n'.join(conflicts))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('CE', '0004_cultureevent_links'),
+        ('taggit', '0006_rename_taggeditem_content_type_object_id_taggit_tagg_content_8fc721_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_title_conflicts, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cultureevent',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower('title'), name='unique_lower_ce_title'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+import re
+
+import bleach
+from django.db import migrations
+
+import CE.settings
+from CE.utilities import TitleMatcher
+
+
+def relink_descriptions(apps, schema_editor):
+    # 0004 flagged every CE for relinking so their links get recorded. Relinking isn't done on view any more, so
+    # relink them here, rather than leave stale links until the relink job or update_CEs runs
+    CultureEvent = apps.get_model('CE', 'CultureEvent')
+    events = list(CultureEvent.objects.filter(needs_relink=True))
+    if not events:
+        return
+    pks = dict(CultureEvent.objects.values_list('slug', 'pk'))
+    matcher = TitleMatcher(dict(CultureEvent.objects.values_list('title', 'slug')))
+    for event in events:
+        # descriptions using {} tags are left as they are and only have their links recorded
+        if CE.settings.auto_cross_reference:
+            event.description = matcher.link(bleach.clean(event.description_plain_text))
+        slugs = set(re.findall(r'<a href="([-\w]+)">', event.description))
+        event.links.set([pks[slug] for slug in slugs if slug in pks and pks[slug] != event.pk])
+        event.needs_relink = False
+    CultureEvent.objects.bulk_update(events, ['description', 'needs_relink'])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('CE', '0005_cultureevent_unique_lower_title'),
+    ]
+
+    operations = [migrations.RunPython(relink_descriptions, migrations.RunPython.noop)]
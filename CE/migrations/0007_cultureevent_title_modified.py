@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('CE', '0006_relink_descriptions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cultureevent',
+            name='title_modified',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+    ]
@@ -2,29 +2,25 @@ import re
 
 import bleach
 from django.core import exceptions
-from django.core.exceptions import ObjectDoesNotExist
 from django.db import models
+from django.db.models import Value
+from django.db.models.functions import Lower
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
 from django.utils.text import slugify
 from taggit.managers import TaggableManager
 
 import CE.settings
-import people.models
-from CLAHub import tools
+import CE.utilities
+import people.utilities
+from CLAHub import jobs, perf, tools
+from CLAHub.models import Job
 
-integer_regex = re.compile("\d+")
-anchor_regex = re.compile("<a.*?</a>")
-
-
-def check_if_index_within_html_anchor(string, index):
-    # Returns true if the index provided sits within an <a></a> tag in the provided string
-    num_anchors = len(re.findall(anchor_regex, string))
-    for anchor in range(num_anchors):
-        match = re.search(anchor_regex, string)
-        if index >= match.start():
-            if index <= match.end():
-                return True
-        string = string[match.end() :]
-        index = index - match.end()
+# links to other CEs in a processed description
+ce_link_regex = re.compile(r'<a href="([-\w]+)">')
+# (title set version, TitleMatcher), see CultureEvent.get_title_matcher
+title_matcher = None
 
 
 class CultureEvent(models.Model):
@@ -43,9 +39,46 @@ class CultureEvent(models.Model):
         unique=True
     )  # set in save function, form doesn't need to validate it
     tags = TaggableManager()
+    # the CEs this CE's description links to, kept up to date on save. Used to find the descriptions that
+    # need relinking when a CE is renamed or deleted
+    links = models.ManyToManyField(
+        "self",
+        symmetrical=False,
+        related_name="linked_from",
+        blank=True,
+        editable=False,
+    )
+    # set when a CE this description may link to is created, renamed or deleted, see relink()
+    needs_relink = models.BooleanField(default=False, editable=False)
+    # when the CE was created or last renamed, so get_title_matcher can tell when titles have changed
+    title_modified = models.DateTimeField(null=True, editable=False)
+
+    class Meta:
+        constraints = [
+            # titles are unique ignoring case, check_unique_title uses this index
+            models.UniqueConstraint(Lower("title"), name="unique_lower_ce_title"),
+        ]
+
+    def __init__(self, *args, **kwargs):
+        super(CultureEvent, self).__init__(*args, **kwargs)
+        self.original_title = self.title
 
     def save(self, *args, **kwargs):
         self.check_unique_title()
+        created = self.pk is None
+        self.process_description()
+        self.slug = slugify(self.title)
+        self.needs_relink = False
+        renamed = created or self.title != self.original_title
+        if renamed:
+            self.title_modified = timezone.now()
+        super().save(*args, **kwargs)
+        self.update_links()
+        if renamed:
+            self.flag_mentions()
+        self.original_title = self.title
+
+    def process_description(self):
         # copy the user's input from plain text to description to be processed
         # uses bleach to remove potentially harmful HTML code
         self.description = bleach.clean(self.description_plain_text)
@@ -54,12 +87,42 @@ class CultureEvent(models.Model):
             self.auto_cross_ref()
         else:
             self.find_tag()
-        self.slug = slugify(self.title)
-        super().save(*args, **kwargs)
+
+    def relink(self):
+        """Redo the links in the description and nothing else, so last_modified
+        is kept."""
+        self.process_description()
+        self.needs_relink = False
+        CultureEvent.objects.filter(pk=self.pk).update(
+            description=self.description, needs_relink=False
+        )
+        self.update_links()
+
+    def update_links(self):
+        slugs = set(ce_link_regex.findall(self.description))
+        self.links.set(CultureEvent.objects.filter(slug__in=slugs).exclude(pk=self.pk))
+
+    def flag_mentions(self):
+        """Flag the CEs whose descriptions link to or mention this CE for
+        relinking, after it's been created or renamed."""
+        mentions = CultureEvent.objects.filter(
+            models.Q(links=self)
+            | models.Q(description_plain_text__icontains=self.title)
+        ).exclude(pk=self.pk)
+        flagged = CultureEvent.objects.filter(pk__in=mentions.values("pk")).update(
+            needs_relink=True
+        )
+        if flagged:
+            queue_relink()
 
     def check_unique_title(self):
-        ces = CultureEvent.objects.exclude(pk=self.pk)
-        if self.title.lower() in [ce.title.lower() for ce in ces]:
+        title_taken = (
+            CultureEvent.objects.alias(lower_title=Lower("title"))
+            .filter(lower_title=Lower(Value(self.title)))
+            .exclude(pk=self.pk)
+            .exists()
+        )
+        if title_taken:
             raise exceptions.ValidationError("CE already exists", code="invalid")
 
     def find_tag(self):
@@ -84,47 +147,27 @@ class CultureEvent(models.Model):
                 elif i == len(ce_slugs) - 1:
                     self.description = self.description.replace(tag, content)
 
+    @perf.timed("auto_cross_ref")
     def auto_cross_ref(self):
-        # search the plain text description for slugs and replace them with hyperlinks if found
+        # search the description for CE titles and replace them with hyperlinks if found
         # only triggers if auto_cross_reference is True
-
-        # turn user entered data into a slug and search it for slugs that represent CEs
-        slugged_description = slugify(self.description_plain_text)
-        ce_slugs = self.list_slugs()
-        ce_slugs.sort(key=len)
-        ce_slugs.reverse()  # order longest to shortest = greedy matching
-        # check the slugged description for each ce title starting longest, going to shortest
-        for title_slug in ce_slugs:
-            if title_slug in slugged_description:
-                # Loop variables to track when to move on
-                i = 0
-                start_next_search = 0
-                # progressively work through text to find all occurrences of slug
-                while i < slugged_description.count(title_slug):
-                    i += 1
-                    # retrieve the title so a string can be returned that matches the case
-                    ce_title = CultureEvent.objects.get(slug=title_slug).title
-                    slug_href = (
-                        '<a href="' + title_slug + '">' + ce_title + "</a>"
-                    )  # anchor to insert
-
-                    # find the index of the match. Set start point for next loop
-                    position = self.description.lower().find(
-                        ce_title.lower(), start_next_search
-                    )
-                    start_next_search = position + len(slug_href)
-
-                    # if the match is in a preexisting anchor move the loop on
-                    if check_if_index_within_html_anchor(self.description, position):
-                        continue
-
-                    # insert the anchor at the desired position, replacing the found match
-                    # Can't just use replace as it will replace things within anchors we already inserted
-                    # Can't modify self.description outside of the link position - must maintain user formatting.
-                    part1 = self.description[:position]
-                    part2 = self.description[position + len(ce_title) :]
-                    self.description = slug_href.join([part1, part2])
-                    # start the next loop searching after the anchor we just inserted
+        self.description = self.get_title_matcher().link(self.description)
+
+    @staticmethod
+    def get_title_matcher():
+        """Return a CE.utilities.TitleMatcher for every CE title.
+
+        The matcher is kept between saves and only rebuilt when a CE has been
+        added, renamed or deleted since it was built, edits to anything but the
+        title leave it alone."""
+        global title_matcher
+        title_set_version = CultureEvent.objects.aggregate(
+            count=models.Count("pk"), title_modified=models.Max("title_modified")
+        )
+        if title_matcher is None or title_matcher[0] != title_set_version:
+            titles = dict(CultureEvent.objects.values_list("title", "slug"))
+            title_matcher = (title_set_version, CE.utilities.TitleMatcher(titles))
+        return title_matcher[1]
 
     def list_slugs(self):
         ce_objects = CultureEvent.objects.all()
@@ -135,6 +178,33 @@ class CultureEvent(models.Model):
         return str(self.title)
 
 
+@receiver(pre_delete, sender=CultureEvent)
+def flag_links_to_deleted_ce(sender, instance, **kwargs):
+    # descriptions linking to a deleted CE need the dead link removing
+    if instance.linked_from.all().update(needs_relink=True):
+        queue_relink()
+
+
+def relink_flagged():
+    """Relink every CE flagged for relinking, returning how many were relinked."""
+    events = CultureEvent.objects.filter(needs_relink=True)
+    for event in events:
+        event.relink()
+    return len(events)
+
+
+@jobs.task
+def relink_ces(job):
+    """Relink the flagged CEs as a job, queued whenever CEs are flagged."""
+    return relink_flagged()
+
+
+def queue_relink():
+    # a queued job relinks every CE flagged by the time it runs, so one is enough
+    if not Job.objects.filter(task="relink_ces", status=Job.QUEUED).exists():
+        jobs.submit("relink_ces")
+
+
 class Visit(models.Model):
     ce = models.ForeignKey("CultureEvent", on_delete=models.CASCADE)
     team_present = models.CharField(blank=True, max_length=60)
@@ -166,7 +236,10 @@ class Picture(models.Model):
 
     def save(self):
         if self.picture:
-            if tools.check_already_imported(self.picture):
+            # the same picture in another CE is still saved
+            if tools.check_already_imported(
+                self.picture, Picture.objects.filter(ce=self.ce_id)
+            ):
                 return None  # exit function, don't save anything
             self.picture = tools.compress_picture(self.picture, (1200, 1200))
         super(Picture, self).save()
@@ -201,6 +274,14 @@ class Text(models.Model):
     last_modified_by = models.CharField(max_length=20, blank=True)
     speaker_plain_text = models.CharField(max_length=50, blank=True)
     speaker = models.CharField(max_length=80, blank=True)
+    # orthographic_text rendered to html (see CE.utilities.render_text). The render
+    # is reused until the text or the lexicon changes
+    rendered_text = models.TextField(blank=True, editable=False)
+    rendered_known_words = models.CharField(max_length=4, blank=True, editable=False)
+    rendered_last_modified = models.DateTimeField(null=True, editable=False)
+    rendered_lexicon_version = models.DecimalField(
+        null=True, decimal_places=3, max_digits=5, editable=False
+    )
 
     def save(self):
         if self.audio:
@@ -209,17 +290,11 @@ class Text(models.Model):
                 self.audio.upload_to = "temp"  # todo duplicates still added
         # search for integers in speaker field and provide link to profile if found
         if self.speaker_plain_text:
-            integers = re.findall(integer_regex, self.speaker_plain_text)
-            self.speaker = bleach.clean(self.speaker_plain_text)
-            for match in integers:
-                try:
-                    link = people.models.Person.objects.get(pk=match)
-                    self.speaker = self.speaker.replace(
-                        match,
-                        '<a href="/clahub/people/' + match + '"> ' + link.name + "</a>",
-                    )
-                except ObjectDoesNotExist:
-                    pass
+            self.speaker, _ = people.utilities.link_person_references(
+                self.speaker_plain_text,
+                people.utilities.speaker_reference_regex,
+                '<a href="/clahub/people/{pk}"> {name}</a>',
+            )
 
         super(Text, self).save()
 
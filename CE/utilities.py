@@ -5,9 +5,16 @@ import time
 import bleach
 import markdown
 from django.contrib.auth.decorators import login_required
+from django.core.paginator import Paginator
+from django.utils.text import Truncator
 
 import CLAHub.base_settings
-from lexicon.utilities import get_lexicon_words_from_cache
+from CLAHub import perf
+from lexicon.utilities import get_lexicon_index, get_lexicon_version
+
+word_regex = re.compile(r"[a-z]+")
+# the timed stages of format_text_html, in the order they run
+TEXT_STAGES = ("highlight", "timestamps", "bleach", "markdown")
 
 
 def conditional_login(func):
@@ -72,51 +79,33 @@ def highlight_non_lexicon_words(text_obj):
     """Compare each word to the csv word list from lexicon, highlighting any in
     red not found."""
     words = find_words_in_text(text_obj.orthographic_text.lower())
-    # go through whole text and highlight any words notin lexicon
     text = text_obj.orthographic_text.lower()
     correct_words = 0
     total_words = 0
 
-    lexicon = get_lexicon_words_from_cache()
-    lexicon_words = [w for w in lexicon if w.type == "word"]
-    lexicon_verbs = [v for v in lexicon if v.type == "verb"]
+    lexicon_index = get_lexicon_index()
 
-    # loop through words found in text and highlight
+    # decide how each word found in the text is displayed
+    highlights = {}
     for w in words:
-        # find lexicon entry
-        matched_words = [
-            word for word in lexicon_words if w == word.kgu or w in word.variations
-        ]
-        matched_verbs = [verb for verb in lexicon_verbs if w in verb.conjugations]
+        lex = lexicon_index.get(w)
 
         # no entry, highlight red
-        if not matched_words and not matched_verbs:
-            text = highlight_word(w, text, colour="red")
-            total_words += 1
-            continue
-        else:
-            # pick whether it's a verb or a word, preferring words if both
-            if matched_words:
-                lex = matched_words[0]
-            elif matched_verbs:
-                lex = matched_verbs[0]
-                lex.kgu = lex.future_1s
-                try:
-                    lex.checked = lex.identify_conjugation(w)["checked"]
-                except TypeError:
-                    # This would mean a spelling variation was identified
-                    lex.checked = True
+        if lex is None:
+            highlights[w] = highlight_word(w, colour="red")
 
         # checked entry, black with link
-        if lex.checked:
-            text = highlight_word(w, text, colour="none", lexicon=lex)
+        elif lex.checked:
+            highlights[w] = highlight_word(w, colour="none", link=lex.url)
             correct_words += 1
-            total_words += 1
 
         # unchecked entry, green with link
         else:
-            text = highlight_word(w, text, colour="green", lexicon=lex)
-            total_words += 1
+            highlights[w] = highlight_word(w, colour="green", link=lex.url)
+        total_words += 1
+
+    # go through whole text once, swapping each word for its highlighted version
+    text = highlight_words(text, highlights)
 
     # report accuracy of transcription
     if total_words > 0:
@@ -124,38 +113,35 @@ def highlight_non_lexicon_words(text_obj):
     return text
 
 
-def highlight_word(word, text, colour="red", lexicon=None):
-    """Replace the given word in a text with the same word withn a span tag to
-    colour it."""
-    f = re.compile(
-        f"(^|[^a-z<>#])({word})($|[^a-z<>-])"
-    )  # attempt to avoid highlighting parts of words
-    highlight = f'<span class="{colour}">'
-
-    # regex is non overlapping, so we run it twice. Excluding < and > mean we don't hit
-    # the same match
-    for i in range(2):
-        if colour == "red":  # no hyperlink
-            text = re.sub(
-                f, r"\1{highlight}\2</span>\3".format(highlight=highlight), text
-            )
-        elif colour == "green":
-            text = re.sub(
-                f,
-                r'\1<a class="no-decoration" href="{link}" target="_blank" rel="noopener noreferrer">{highlight}\2</span></a>\3'.format(
-                    highlight=highlight, word=word, link=lexicon.get_absolute_url()
-                ),
-                text,
-            )
-        elif colour == "none":
-            text = re.sub(
-                f,
-                r'\1<a class="no-decoration" href="{link}" target="_blank" rel="noopener noreferrer">\2</a>\3'.format(
-                    word=word, link=lexicon.get_absolute_url()
-                ),
-                text,
-            )
-    return text
+def highlight_words(text, highlights):
+    """Replace words in the text with their value in the highlights dict.
+
+    Words touching < or > (html tags), words following # and words followed by
+    - are left alone to avoid highlighting parts of words or markup."""
+
+    def replace(match):
+        start, end = match.span()
+        if start > 0 and text[start - 1] in "<>#":
+            return match.group()
+        if end < len(text) and text[end] in "<>-":
+            return match.group()
+        return highlights.get(match.group(), match.group())
+
+    return word_regex.sub(replace, text)
+
+
+def highlight_word(word, colour="red", link=None):
+    """Return the given word within a span tag to colour it, and a link to its
+    lexicon entry if there is one."""
+    if colour == "red":  # no hyperlink
+        return f'<span class="{colour}">{word}</span>'
+    elif colour == "green":
+        return (
+            f'<a class="no-decoration" href="{link}" target="_blank" rel="noopener noreferrer">'
+            f'<span class="{colour}">{word}</span></a>'
+        )
+    elif colour == "none":
+        return f'<a class="no-decoration" href="{link}" target="_blank" rel="noopener noreferrer">{word}</a>'
 
 
 def find_words_in_text(text):
@@ -172,20 +158,173 @@ def find_words_in_text(text):
     # remove punctuation
 
     # find all the Kovol words written, having excluded brackets
-    words = re.findall(
-        re.compile(r"[a-z]+"), text
-    )  # search for a-z only, ignore numbers
+    words = re.findall(word_regex, text)  # search for a-z only, ignore numbers
     words = list(set(words))
     words.sort(key=lambda x: len(x), reverse=True)
     return words
 
 
 def format_text_html(text_obj):
-    """Apply markdown, timestamp links and lexicon spelling info and return."""
-    text = highlight_non_lexicon_words(text_obj)
-    text = hyperlink_timestamps(text_obj.id, text)
+    """Apply markdown, timestamp links and lexicon spelling info and return.
+
+    Each stage is timed as one of TEXT_STAGES, see CLAHub.perf.timed."""
+    with perf.timed("highlight"):
+        text = highlight_non_lexicon_words(text_obj)
+    with perf.timed("timestamps"):
+        text = hyperlink_timestamps(text_obj.id, text)
 
     allowed_attributes, allowed_tags = set_text_tags_attributes()
-    return markdown.markdown(
-        bleach.clean(text, tags=allowed_tags, attributes=allowed_attributes)
+    with perf.timed("bleach"):
+        text = bleach.clean(text, tags=allowed_tags, attributes=allowed_attributes)
+    with perf.timed("markdown"):
+        return markdown.markdown(text)
+
+
+def render_is_current(text_obj, lexicon_version):
+    """Return True if a text's stored render matches the text and lexicon."""
+    return (
+        text_obj.rendered_last_modified == text_obj.last_modified
+        and text_obj.rendered_lexicon_version == lexicon_version
+    )
+
+
+def render_text(text_obj, lexicon_version=None):
+    """Return the formatted html for a text, using the stored render if possible.
+
+    The render is stored on the text along with the text's last_modified and the
+    lexicon version it was made with. It's only redone when either has changed.
+    Pass lexicon_version in when rendering several texts to save looking it up
+    each time."""
+    if lexicon_version is None:
+        lexicon_version = get_lexicon_version()
+
+    if render_is_current(text_obj, lexicon_version):
+        text_obj.known_words = text_obj.rendered_known_words
+        return text_obj.rendered_text
+
+    text_obj.known_words = ""
+    text_obj.rendered_text = format_text_html(text_obj)
+    text_obj.rendered_known_words = text_obj.known_words
+    text_obj.rendered_last_modified = text_obj.last_modified
+    text_obj.rendered_lexicon_version = lexicon_version
+    # update rather than save so last_modified isn't changed
+    type(text_obj).objects.filter(pk=text_obj.pk).update(
+        rendered_text=text_obj.rendered_text,
+        rendered_known_words=text_obj.rendered_known_words,
+        rendered_last_modified=text_obj.rendered_last_modified,
+        rendered_lexicon_version=text_obj.rendered_lexicon_version,
     )
+    return text_obj.rendered_text
+
+
+def text_excerpt(text_obj, words=40):
+    """Return the start of a text's orthographic text as plain text, for text
+    listings where the full render isn't needed."""
+    text = bleach.clean(
+        markdown.markdown(text_obj.orthographic_text), tags=[], strip=True
+    )
+    return Truncator(" ".join(text.split())).words(words)
+
+
+def paginate_texts(request, texts, excerpt=True, per_page=25):
+    """Return the requested page of a Text queryset, formatting only the texts
+    on that page.
+
+    With excerpt=True (listings) each text's orthographic_text is replaced with
+    a short plain text excerpt, otherwise it's replaced with the full render."""
+    page = Paginator(texts.select_related("ce"), per_page).get_page(
+        request.GET.get("page")
+    )
+    if excerpt:
+        for t in page:
+            t.orthographic_text = text_excerpt(t)
+    else:
+        lexicon_version = get_lexicon_version()
+        for t in page:
+            t.orthographic_text = render_text(t, lexicon_version)
+    return page
+
+
+# html tags and existing anchors in a description, cross reference links aren't
+# inserted inside these
+html_anchor_or_tag_regex = re.compile(r"<a\b.*?</a>|<[^>]*>", re.IGNORECASE | re.DOTALL)
+
+
+class TitleMatcher:
+    """An Aho-Corasick automaton over CE titles.
+
+    Built once from {title: slug}, it finds every title in a description in a
+    single pass however many CEs there are. Matching is case insensitive and only
+    whole words match."""
+
+    def __init__(self, titles):
+        self.titles = {title.lower(): (title, slug) for title, slug in titles.items()}
+        self.goto = [{}]
+        self.fail = [0]
+        # the lower case titles that end at each state
+        self.output = [[]]
+        for key in self.titles:
+            state = 0
+            for char in key:
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.output[state].append(key)
+
+        # breadth first so each state's fail link is set before its children's
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for char, child in self.goto[state].items():
+                fail = self.fail[state]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[child] = self.goto[fail].get(char, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+                queue.append(child)
+
+    def find(self, text):
+        """Return (start, end, lower case title) for every whole word title
+        match in text, overlapping matches included."""
+        lower_text = text.lower()
+        matches = []
+        state = 0
+        for i, char in enumerate(lower_text):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for key in self.output[state]:
+                start, end = i + 1 - len(key), i + 1
+                if start > 0 and lower_text[start - 1].isalnum():
+                    continue
+                if end < len(lower_text) and lower_text[end].isalnum():
+                    continue
+                matches.append((start, end, key))
+        return matches
+
+    def link(self, description):
+        """Return the description with CE titles replaced by links to the CE.
+
+        Where titles overlap the leftmost, then longest, wins. Titles within html
+        tags or existing anchors are left alone."""
+        protected = [m.span() for m in html_anchor_or_tag_regex.finditer(description)]
+        matches = sorted(self.find(description), key=lambda m: (m[0], -m[1]))
+
+        parts = []
+        position = 0
+        span = 0
+        for start, end, key in matches:
+            if start < position:
+                continue
+            while span < len(protected) and protected[span][1] <= start:
+                span += 1
+            if span < len(protected) and protected[span][0] < end:
+                continue
+            title, slug = self.titles[key]
+            parts.append(description[position:start])
+            parts.append('<a href="' + slug + '">' + title + "</a>")
+            position = end
+        parts.append(description[position:])
+        return "".join(parts)
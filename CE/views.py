@@ -50,8 +50,9 @@ def alphabetical(request):
 def view(request, pk):
     ce = get_object_or_404(CultureEvent, pk=pk)
     texts = Text.objects.filter(ce=pk)
+    lexicon_version = CE.utilities.get_lexicon_version()
     for t in texts:
-        t.orthographic_text = CE.utilities.format_text_html(t)
+        t.orthographic_text = CE.utilities.render_text(t, lexicon_version)
     pictures = Picture.objects.filter(ce=pk)
     visits = Visit.objects.filter(ce=ce)
     questions = Question.objects.filter(ce=ce)
@@ -363,13 +364,11 @@ def search_CE(request):
 def texts_home(request):
     template = "CE/texts.html"
     texts = Text.objects.all().order_by("-last_modified")
-    for t in texts:
-        t.orthographic_text = CE.utilities.format_text_html(t)
-    paginator = Paginator(texts, 25)
-    texts = paginator.get_page(request.GET.get("page"))
+    texts = CE.utilities.paginate_texts(request, texts)
     context = {
         "Texts": texts,
         "paginator": texts,
+        "excerpt": True,
         "title": "Texts",
         "search_context": "texts",
     }
@@ -387,15 +386,12 @@ def text_genre(request, genre):
     else:
         return render(request, "404.html")
 
-    for t in texts:
-        t.orthographic_text = CE.utilities.format_text_html(t)
-
-    paginator = Paginator(texts, 25)
-    texts = paginator.get_page(request.GET.get("page"))
+    texts = CE.utilities.paginate_texts(request, texts)
 
     context = {
         "Texts": texts,
         "paginator": texts,
+        "excerpt": True,
         "Genre": genre,
         "title": genre + " texts",
     }
@@ -409,14 +405,12 @@ def text_search(request):
     results = Text.objects.filter(Q(text_title__icontains=search)).order_by(
         "-last_modified"
     )
-    for t in results:
-        t.orthographic_text = CE.utilities.format_text_html(t)
-    paginator = Paginator(results, 25)
-    results = paginator.get_page(request.GET.get("page"))
+    results = CE.utilities.paginate_texts(request, results)
     context = {
         "search": search,
         "Texts": results,
-        "pagniator": results,
+        "paginator": results,
+        "excerpt": True,
         "title": "Text search",
         "search_context": "texts",
     }
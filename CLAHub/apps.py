@@ -0,0 +1,19 @@
+from django.apps import AppConfig, apps
+from django.db import models
+from django.db.models.signals import post_delete, post_save
+
+
+class CLAHubConfig(AppConfig):
+    name = "CLAHub"
+
+    def ready(self):
+        from CLAHub.models import register_media_files, unregister_media_files
+
+        # register the tasks that can be run as jobs
+        import CLAHub.tools  # noqa: F401
+
+        # keep the MediaFile registry up to date for every model that stores files
+        for model in apps.get_models():
+            if any(isinstance(field, models.FileField) for field in model._meta.fields):
+                post_save.connect(register_media_files, sender=model)
+                post_delete.connect(unregister_media_files, sender=model)
@@ -27,6 +27,7 @@ INSTALLED_APPS = [
     "django.contrib.messages",
     "whitenoise.runserver_nostatic",
     "django.contrib.staticfiles",
+    "CLAHub",
     "CE",
     "people",
     "lexicon",
@@ -38,6 +39,7 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
+    "CLAHub.perf.PerfMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -54,6 +56,25 @@ CACHES = {
     }
 }
 
+# LocMemCache is private to each process. When running more than one worker set
+# CLAHUB_CACHE=file so every worker shares one cache kept in data/cache, and a
+# lexicon change invalidates the lexicon for all of them.
+if os.environ.get("CLAHUB_CACHE") == "file":
+    CACHES["default"] = {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.path.join(BASE_DIR, "data", "cache"),
+        "TIMEOUT": 300,
+        "OPTIONS": {"MAX_ENTRIES": 1000},
+    }
+
+# Set CLAHUB_PERF=1 to log the time, queries, lexicon cache use and template time of every
+# request to PERF_LOG, summarised at tools/perf. When it's off PerfMiddleware removes itself.
+# Every gunicorn worker appends to the log, so none of them rotates it: run_jobs moves it to
+# perf_log.txt.1 once it's over PERF_LOG_MAX_BYTES and the workers reopen it, see perf.rotate_log.
+CLAHUB_PERF = os.environ.get("CLAHUB_PERF") == "1"
+PERF_LOG = os.path.join(BASE_DIR, "Logs", "perf_log.txt")
+PERF_LOG_MAX_BYTES = 5 * 1024 * 1024
+
 ROOT_URLCONF = "CLAHub.urls"
 
 TEMPLATES = [
@@ -181,6 +202,13 @@ LOGGING = {
             "filename": os.path.join(BASE_DIR, "Logs", "request_log.txt"),
             "formatter": "complex",
         },
+        "perf_log": {
+            "level": "INFO",
+            "class": "logging.handlers.WatchedFileHandler",
+            "filename": PERF_LOG,
+            "delay": True,
+            "formatter": "simple",
+        },
     },
     "loggers": {
         "root": {
@@ -201,5 +229,10 @@ LOGGING = {
             "propagate": True,
             "formatter": "complex",
         },
+        "perf": {
+            "handlers": ["perf_log"],
+            "level": "INFO",
+            "propagate": False,
+        },
     },
 }
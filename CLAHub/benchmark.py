@@ -0,0 +1,182 @@
+"""Measure the queries, latency and memory of every page, see the bench management command.
+
+The routes are read from the url resolver so new pages are benchmarked without being
+listed here, only their url arguments need a sample in sample_arguments.
+"""
+
+import statistics
+import time
+import tracemalloc
+from urllib.parse import urlencode
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver, get_resolver, reverse
+from taggit.models import Tag
+
+from CE.models import CultureEvent
+from CLAHub.models import Job
+from CLAHub.perf import percentile
+from lexicon import models as lexicon_models
+from people.models import MedicalAssessment
+
+# the url namespaces benchmarked, and the module of the project level views
+NAMESPACES = ("CE", "people", "lexicon")
+PROJECT_VIEWS = "CLAHub.views"
+# latency and memory changes smaller than these are noise, not regressions
+LATENCY_FLOOR_MS = 2
+MEMORY_FLOOR_KB = 64
+# the query string to give the search pages, a common syllable so there are many results
+SEARCHES = {
+    name: {"search": "ga"}
+    for name in ("CE:search_CE", "CE:text_search", "CE:tags_search", "people:search")
+}
+
+
+def collect_routes():
+    """Return a list of (name, argument names) for every benchmarked url."""
+    routes = []
+    for pattern in get_resolver().url_patterns:
+        if isinstance(pattern, URLResolver) and pattern.namespace in NAMESPACES:
+            routes += [
+                (f"{pattern.namespace}:{p.name}", list(p.pattern.converters))
+                for p in pattern.url_patterns
+                if isinstance(p, URLPattern) and p.name
+            ]
+        elif (
+            isinstance(pattern, URLPattern)
+            and pattern.name
+            and pattern.callback.__module__ == PROJECT_VIEWS
+        ):
+            routes.append((pattern.name, list(pattern.pattern.converters)))
+    return routes
+
+
+def sample_arguments():
+    """Return the url kwargs to use for each route that takes arguments, from the
+    objects in the database."""
+    ce = CultureEvent.objects.order_by("pk").first()
+    assessment = MedicalAssessment.objects.order_by("pk").first()
+    person = assessment.person
+    phrase = lexicon_models.PhraseEntry.objects.order_by("pk").first()
+    verb = lexicon_models.ImengisVerb.objects.order_by("pk").first()
+    matat = lexicon_models.MatatVerb.objects.order_by("pk").first()
+    word = lexicon_models.KovolWord.objects.order_by("pk").first()
+    ignore = lexicon_models.IgnoreWord.objects.order_by("pk").first()
+
+    arguments = {
+        "CE:edit": {"pk": ce.pk},
+        "CE:view": {"pk": ce.pk},
+        "CE:view_slug": {"slug": ce.slug},
+        "CE:text_genre": {"genre": 1},
+        "CE:view_tag": {"slug": Tag.objects.order_by("pk").first().slug},
+        "people:edit_assessment": {"pk": person.pk, "event_pk": assessment.pk},
+        "people:village": {"village": person.village.village_name},
+        "lexicon:verb-update-matat": {"pk": matat.pk},
+        "lexicon:verb-delete-matat": {"pk": matat.pk},
+        "lexicon:ignore-update": {"pk": ignore.pk},
+        "lexicon:ignore-delete": {"pk": ignore.pk},
+        "job": {"pk": Job.objects.order_by("pk").first().pk},
+    }
+    for name in ("detail", "medical", "new_assessment", "edit_medical_notes", "edit"):
+        arguments[f"people:{name}"] = {"pk": person.pk}
+    for prefix, entry in (("phrase", phrase), ("verb", verb), ("word", word)):
+        for name in ("detail", "update", "delete", "add-sense", "add-spelling"):
+            arguments[f"lexicon:{prefix}-{name}"] = {"pk": entry.pk}
+    arguments["lexicon:verb-create-matat"] = {"pk": verb.pk}
+    return arguments
+
+
+def route_urls(routes, arguments):
+    """Return {name: url} for the routes, with a query string for the search pages,
+    and the names of those with no sample arguments."""
+    urls = {}
+    skipped = []
+    for name, argument_names in routes:
+        if not argument_names:
+            urls[name] = reverse(name)
+        elif name in arguments:
+            urls[name] = reverse(name, kwargs=arguments[name])
+        else:
+            skipped.append(name)
+            continue
+        if name in SEARCHES:
+            urls[name] += "?" + urlencode(SEARCHES[name])
+    return urls, skipped
+
+
+def get(client, url):
+    """Request url and read the whole response. A streamed response, such as an
+    export, is built as it's read, so its body is consumed before returning."""
+    response = client.get(url)
+    if response.streaming:
+        for _ in response.streaming_content:
+            pass
+        response.close()
+    return response
+
+
+def measure(client, urls, repeat=5):
+    """Request each url and return {name: results}.
+
+    The first request is made cold, tracing memory allocations for its peak. It is
+    then requested repeat more times for the latency percentiles and the warm query
+    count, which is what the pages cost once the caches are full. The client should
+    not raise request exceptions, a page that errors is recorded with its 500 status.
+    """
+    results = {}
+    for name, url in urls.items():
+        tracemalloc.start()
+        with CaptureQueriesContext(connection) as cold:
+            response = get(client, url)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        times = []
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as warm:
+                start = time.perf_counter()
+                get(client, url)
+                times.append((time.perf_counter() - start) * 1000)
+
+        results[name] = {
+            "url": url,
+            "status": response.status_code,
+            "cold_queries": len(cold),
+            "queries": len(warm),
+            "p50_ms": round(statistics.median(times), 2),
+            "p95_ms": round(percentile(times, 95), 2),
+            "peak_memory_kb": round(peak / 1024, 1),
+        }
+    return results
+
+
+def compare(results, baseline, threshold=25, query_threshold=0):
+    """Return a list of regressions in results against baseline.
+
+    A route regresses if its p95 latency or peak memory grow by more than threshold
+    percent, or it makes more than query_threshold extra queries. Routes missing from
+    the baseline are new and can't regress.
+    """
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+
+        extra_queries = result["queries"] - previous["queries"]
+        if extra_queries > query_threshold:
+            regressions.append(
+                f"{name}: {result['queries']} queries, was {previous['queries']}"
+            )
+
+        for key, unit, floor in (
+            ("p95_ms", "ms", LATENCY_FLOOR_MS),
+            ("peak_memory_kb", "KB", MEMORY_FLOOR_KB),
+        ):
+            limit = previous[key] * (1 + threshold / 100)
+            if result[key] > limit and result[key] - previous[key] > floor:
+                regressions.append(
+                    f"{name}: {key} {result[key]}{unit}, was {previous[key]}{unit}"
+                )
+    return regressions
@@ -0,0 +1,125 @@
+"""A small job queue kept in the database, for work too slow to do in a request.
+
+Tasks are functions registered with @task. jobs.submit() queues a Job and returns
+it straight away, the run_jobs management command claims queued jobs and runs them.
+Tasks are called with the Job as their first argument, so they can report progress
+with job.set_progress(), and the value they return is stored as the job's result.
+Arguments and results are stored as JSON."""
+
+import datetime
+import logging
+import threading
+import traceback
+
+from django.db import connection
+from django.db.models import F
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from CLAHub.models import Job
+
+logger = logging.getLogger("root")
+
+tasks = {}
+
+# how often a worker touches the heartbeat of the job it's running
+HEARTBEAT = datetime.timedelta(minutes=1)
+# a running job whose heartbeat is this old is taken to have been stopped with its worker
+STALE_AFTER = datetime.timedelta(minutes=10)
+# a stopped job is queued again until it has been started this many times, then failed
+MAX_ATTEMPTS = 3
+
+
+def task(function):
+    """Register a function so it can be run as a job under its name."""
+    tasks[function.__name__] = function
+    return function
+
+
+def submit(name, user="", **arguments):
+    """Queue the task called name to be run with arguments and return the Job."""
+    if name not in tasks:
+        raise KeyError("No task called %s" % name)
+    job = Job.objects.create(task=name, arguments=arguments, created_by=user)
+    logger.info("job %s queued: %s" % (job.pk, name))
+    return job
+
+
+def claim_next():
+    """Mark the oldest queued job as running and return it, or None if the queue is
+    empty. A job can only be claimed by one worker."""
+    for pk in Job.objects.filter(status=Job.QUEUED).values_list("pk", flat=True)[:10]:
+        claimed = Job.objects.filter(pk=pk, status=Job.QUEUED).update(
+            status=Job.RUNNING,
+            date_started=timezone.now(),
+            date_updated=timezone.now(),
+            attempts=F("attempts") + 1,
+        )
+        if claimed:
+            return Job.objects.get(pk=pk)
+    return None
+
+
+def recover_stale(stale_after=STALE_AFTER):
+    """Requeue the jobs left running by a worker that crashed or was restarted, or
+    fail them once they've been started MAX_ATTEMPTS times. A job is only taken to
+    have lost its worker when its heartbeat is older than stale_after, however long
+    it has been running. Returns how many jobs were recovered."""
+    stale = Job.objects.alias(
+        heartbeat=Coalesce("date_updated", "date_started")
+    ).filter(status=Job.RUNNING, heartbeat__lt=timezone.now() - stale_after)
+    failed = stale.filter(attempts__gte=MAX_ATTEMPTS).update(
+        status=Job.FAILED,
+        error="The worker running the job stopped %s times" % MAX_ATTEMPTS,
+        date_finished=timezone.now(),
+    )
+    requeued = stale.update(status=Job.QUEUED, date_started=None)
+    if failed or requeued:
+        logger.warning("%s stale jobs requeued, %s failed" % (requeued, failed))
+    return failed + requeued
+
+
+def beat(job, stop, interval=HEARTBEAT):
+    """Touch the job's heartbeat every interval until stop is set, run in a thread
+    alongside the job."""
+    try:
+        while not stop.wait(interval.total_seconds()):
+            Job.objects.filter(pk=job.pk, status=Job.RUNNING).update(
+                date_updated=timezone.now()
+            )
+    finally:
+        connection.close()
+
+
+def run(job):
+    """Run a claimed job, storing its result or the error it raised. The job's
+    heartbeat is kept up while it runs, see recover_stale."""
+    logger.info("job %s started: %s" % (job.pk, job.task))
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=beat, args=(job, stop), daemon=True)
+    heartbeat.start()
+    try:
+        job.result = tasks[job.task](job, **job.arguments)
+        job.status = Job.DONE
+    except Exception:
+        job.error = traceback.format_exc()
+        job.status = Job.FAILED
+        logger.error("job %s failed\n%s" % (job.pk, job.error))
+    finally:
+        stop.set()
+        heartbeat.join()
+    job.date_finished = timezone.now()
+    job.save(update_fields=["result", "status", "error", "date_finished"])
+    logger.info("job %s %s" % (job.pk, job.status))
+    return job
+
+
+def run_pending():
+    """Run queued jobs until there are none left, returning how many ran."""
+    ran = 0
+    job = claim_next()
+    while job:
+        run(job)
+        ran += 1
+        job = claim_next()
+    return ran
@@ -0,0 +1,159 @@
+import json
+import tempfile
+import time
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from CLAHub import benchmark, synthetic
+from lexicon import utilities as lexicon_utilities
+
+# a private cache, so the benchmark neither reads nor clears the site's cache
+BENCH_CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "bench",
+    }
+}
+
+
+class Command(BaseCommand):
+    help = """Seeds a test database with synthetic data and requests every page of CE, people, lexicon
+    and the tools, recording the query count, p50/p95 latency and peak memory of each. The real
+    database is untouched. Use --save-baseline to record the results, later runs with --baseline fail
+    if a page has regressed beyond the thresholds.
+    Trigger via: source venv/bin/activate && python manage.py bench --baseline data/bench.json"""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--size",
+            type=int,
+            default=synthetic.PRESETS["medium"],
+            help="The number of culture events and profiles to seed, other data is in proportion",
+        )
+        parser.add_argument("--seed", type=int, default=0, help="The random seed")
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=10,
+            help="How many times to request each page after the first, cold, request",
+        )
+        parser.add_argument(
+            "--route",
+            action="append",
+            help="Only benchmark the routes containing this, e.g. lexicon: or CE:view",
+        )
+        parser.add_argument("--output", help="Write the results to this json file")
+        parser.add_argument(
+            "--baseline", help="A json file of earlier results to compare against"
+        )
+        parser.add_argument(
+            "--save-baseline",
+            action="store_true",
+            help="Write the results to the --baseline file instead of comparing",
+        )
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=25,
+            help="The percentage p95 latency or peak memory may grow by before failing",
+        )
+        parser.add_argument(
+            "--query-threshold",
+            type=int,
+            default=0,
+            help="The number of extra queries a page may make before failing",
+        )
+
+    def handle(self, **options):
+        if options["save_baseline"] and not options["baseline"]:
+            raise CommandError("--save-baseline needs a --baseline file to write")
+
+        setup_test_environment()
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        try:
+            with tempfile.TemporaryDirectory() as export_dir, mock.patch.object(
+                lexicon_utilities, "EXPORT_DIR", export_dir
+            ), override_settings(CACHES=BENCH_CACHES):
+                report = self.run_benchmark(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        for name, result in report["routes"].items():
+            self.stdout.write(
+                f"{name:<32} {result['status']} {result['queries']:>4} queries "
+                f"({result['cold_queries']} cold) p50 {result['p50_ms']:>8.2f}ms "
+                f"p95 {result['p95_ms']:>8.2f}ms peak {result['peak_memory_kb']:>9.1f}KB"
+            )
+        if report["skipped"]:
+            self.stdout.write(
+                "No sample arguments for: %s" % ", ".join(report["skipped"])
+            )
+
+        if options["output"]:
+            self.write_json(options["output"], report)
+        if options["save_baseline"]:
+            self.write_json(options["baseline"], report)
+            self.stdout.write(
+                self.style.SUCCESS(f"Baseline saved to {options['baseline']}")
+            )
+            return
+
+        if options["baseline"]:
+            with open(options["baseline"]) as file:
+                baseline = json.load(file)
+            regressions = benchmark.compare(
+                report["routes"],
+                baseline["routes"],
+                options["threshold"],
+                options["query_threshold"],
+            )
+            if regressions:
+                raise CommandError(
+                    "%s regressions against %s:\n%s"
+                    % (len(regressions), options["baseline"], "\n".join(regressions))
+                )
+        self.stdout.write(
+            self.style.SUCCESS(f"{len(report['routes'])} pages benchmarked")
+        )
+
+    def run_benchmark(self, options):
+        start = time.perf_counter()
+        counts = synthetic.generate(options["size"], options["seed"])
+        self.stdout.write(
+            "Seeded %s in %.1fs"
+            % (
+                ", ".join(f"{n} {model}" for model, n in counts.items()),
+                time.perf_counter() - start,
+            )
+        )
+
+        client = Client(raise_request_exception=False)
+        client.force_login(User.objects.create_user("bench"))
+        routes = benchmark.collect_routes()
+        if options["route"]:
+            routes = [
+                route
+                for route in routes
+                if any(part in route[0] for part in options["route"])
+            ]
+        urls, skipped = benchmark.route_urls(routes, benchmark.sample_arguments())
+        return {
+            "size": options["size"],
+            "seed": options["seed"],
+            "repeat": options["repeat"],
+            "routes": benchmark.measure(client, urls, options["repeat"]),
+            "skipped": skipped,
+        }
+
+    def write_json(self, path, report):
+        with open(path, "w") as file:
+            json.dump(report, file, indent=2)
@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from CLAHub import synthetic
+from lexicon.models import LexiconEntry
+from people.models import Person
+
+
+class Command(BaseCommand):
+    help = """Fills an empty database with synthetic culture events, texts, profiles and lexicon entries
+    for testing how the site scales. The same preset and seed always make the same data. Point
+    CLAHub at a scratch database first, the data is not meant to be mixed with real entries.
+    Trigger via: source venv/bin/activate && python manage.py generate_data --preset medium"""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--preset",
+            choices=synthetic.PRESETS,
+            default="small",
+            help="small, medium or large, about 1,400, 14,000 and 100,000 rows",
+        )
+        parser.add_argument(
+            "--size",
+            type=int,
+            help="The number of culture events and profiles, instead of a preset",
+        )
+        parser.add_argument("--seed", type=int, default=0, help="The random seed")
+
+    def handle(self, **options):
+        # the example CEs added by the migrations are left alone
+        for model in (Person, LexiconEntry):
+            if model.objects.exists():
+                raise CommandError(
+                    "The database already has %s entries, generate into an empty database"
+                    % model._meta.verbose_name
+                )
+
+        size = options["size"] or synthetic.PRESETS[options["preset"]]
+        start = time.perf_counter()
+        counts = synthetic.generate(size, options["seed"], user="generator")
+        seconds = time.perf_counter() - start
+        for table, count in counts.items():
+            self.stdout.write(f"{table}: {count}")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{sum(counts.values())} rows generated in {seconds:.1f}s"
+            )
+        )
@@ -0,0 +1,51 @@
+import datetime
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from CLAHub import jobs, perf
+
+logger = logging.getLogger("root")
+
+
+class Command(BaseCommand):
+    help = """Runs the jobs queued by CLAHub, such as profile imports, one at a time. Leave it running
+    alongside the web server, or use --once to run the jobs waiting now and exit. Jobs left running by a
+    worker that stopped are queued again. The worker also rotates the perf log, which the web
+    server's workers can't safely do themselves.
+    Trigger via: source venv/bin/activate && python manage.py run_jobs"""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Run the queued jobs then exit instead of waiting for more",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=2,
+            help="Seconds to wait before checking an empty queue again",
+        )
+        parser.add_argument(
+            "--stale-after",
+            type=float,
+            default=jobs.STALE_AFTER.total_seconds() / 60,
+            help="Minutes without a heartbeat after which a running job is taken to "
+            "have been stopped with its worker, and queued again",
+        )
+
+    def handle(self, **options):
+        logger.info("job worker started")
+        stale_after = datetime.timedelta(minutes=options["stale_after"])
+        jobs.recover_stale(stale_after)
+        ran = jobs.run_pending()
+        while not options["once"]:
+            time.sleep(options["interval"])
+            # another worker may have stopped since
+            jobs.recover_stale(stale_after)
+            perf.rotate_log(settings.PERF_LOG, settings.PERF_LOG_MAX_BYTES)
+            ran += jobs.run_pending()
+        self.stdout.write(self.style.SUCCESS("%s jobs run" % ran))
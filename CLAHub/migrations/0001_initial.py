@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaFile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=255, unique=True)),
+                ('name', models.CharField(db_index=True, max_length=255)),
+                ('sha256', models.CharField(db_index=True, max_length=64)),
+                ('source_sha256', models.CharField(blank=True, db_index=True, max_length=64)),
+                ('size', models.PositiveIntegerField()),
+                ('owner', models.CharField(max_length=100)),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,42 @@
+import hashlib
+import os
+
+from django.core.files.storage import default_storage
+from django.db import migrations
+
+file_fields = {
+    ('CE', 'Picture'): ['picture'],
+    ('CE', 'Text'): ['audio'],
+    ('people', 'Person'): ['picture', 'thumbnail'],
+    ('people', 'MedicalAssessment'): ['image'],
+}
+
+
+def register_existing_media(apps, schema_editor):
+    MediaFile = apps.get_model('CLAHub', 'MediaFile')
+    registered = set()
+    for (app_label, model_name), fields in file_fields.items():
+        model = apps.get_model(app_label, model_name)
+        for field in fields:
+            for path in model.objects.exclude(**{field: ''}).values_list(field, flat=True):
+                if path in registered or not default_storage.exists(path):
+                    continue
+                sha256 = hashlib.sha256()
+                with default_storage.open(path, 'rb') as file:
+                    for chunk in iter(lambda: file.read(1024 * 1024), b''):
+                        sha256.update(chunk)
+                MediaFile.objects.create(path=path, name=os.path.basename(path), sha256=sha256.hexdigest(),
+                                         size=default_storage.size(path),
+                                         owner='%s.%s.%s' % (app_label, model_name, field))
+                registered.add(path)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('CLAHub', '0001_initial'),
+        ('CE', '0005_cultureevent_unique_lower_title'),
+        ('people', '0014_person_relatives'),
+    ]
+
+    operations = [migrations.RunPython(register_existing_media, migrations.RunPython.noop)
+                  ]
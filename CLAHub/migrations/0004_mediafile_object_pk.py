@@ -0,0 +1,32 @@
+from django.db import migrations, models
+
+
+def record_object_pks(apps, schema_editor):
+    # link the registered files to the objects they belong to, and forget files whose object has been deleted
+    MediaFile = apps.get_model('CLAHub', 'MediaFile')
+    for entry in MediaFile.objects.all():
+        app_label, model_name, field = entry.owner.split('.')
+        model = apps.get_model(app_label, model_name)
+        pk = model.objects.filter(**{field: entry.path}).values_list('pk', flat=True).first()
+        if pk is None:
+            entry.delete()
+        else:
+            entry.object_pk = pk
+            entry.save(update_fields=['object_pk'])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('CLAHub', '0003_job'),
+        ('CE', '0005_cultureevent_unique_lower_title'),
+        ('people', '0014_person_relatives'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediafile',
+            name='object_pk',
+            field=models.PositiveIntegerField(db_index=True, null=True),
+        ),
+        migrations.RunPython(record_object_pks, migrations.RunPython.noop),
+    ]
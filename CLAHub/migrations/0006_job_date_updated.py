@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("CLAHub", "0005_job_attempts"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="job",
+            name="date_updated",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,122 @@
+import os
+
+from django.db import models
+from django.utils import timezone
+
+
+class MediaFile(models.Model):
+    """A file stored in uploads, recorded when the model it belongs to is saved.
+
+    Used by tools.check_already_imported to find files that are already stored
+    without walking the upload folders."""
+
+    # the name the file is stored under, relative to MEDIA_ROOT
+    path = models.CharField(max_length=255, unique=True)
+    name = models.CharField(max_length=255, db_index=True)
+    sha256 = models.CharField(max_length=64, db_index=True)
+    # hash of the upload the stored file was made from, if it was compressed
+    source_sha256 = models.CharField(max_length=64, blank=True, db_index=True)
+    size = models.PositiveIntegerField()
+    # app_label.Model.field
+    owner = models.CharField(max_length=100)
+    # the pk of the object the file belongs to, the registry entry is deleted with it
+    object_pk = models.PositiveIntegerField(null=True, db_index=True)
+    date_created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.path
+
+
+def register_media_files(sender, instance, **kwargs):
+    # record any newly stored files of a saved model, connected to models with file fields in CLAHubConfig.ready
+    from CLAHub import tools
+
+    for field in sender._meta.fields:
+        if not isinstance(field, models.FileField):
+            continue
+        file = getattr(instance, field.attname)
+        if not file or MediaFile.objects.filter(path=file.name).exists():
+            continue
+        if not file.storage.exists(file.name):
+            continue
+        with file.storage.open(file.name, "rb") as stored:
+            sha256 = tools.file_hash(stored)
+        source_hashes = getattr(instance, "upload_source_hashes", {})
+        MediaFile.objects.create(
+            path=file.name,
+            name=os.path.basename(file.name),
+            sha256=sha256,
+            source_sha256=source_hashes.get(field.name, ""),
+            size=file.storage.size(file.name),
+            owner="%s.%s" % (sender._meta.label, field.name),
+            object_pk=instance.pk,
+        )
+
+
+def unregister_media_files(sender, instance, **kwargs):
+    # forget the files of a deleted model, connected alongside register_media_files
+    MediaFile.objects.filter(
+        owner__startswith="%s." % sender._meta.label, object_pk=instance.pk
+    ).delete()
+
+
+class Job(models.Model):
+    """A task queued to run outside the request by the run_jobs command.
+
+    The queue is this table, so jobs survive a restart and any number of workers can
+    share it. See CLAHub.jobs for submitting jobs and registering tasks."""
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    statuses = (
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    )
+
+    task = models.CharField(max_length=100)
+    arguments = models.JSONField(default=dict)
+    status = models.CharField(
+        max_length=10, choices=statuses, default=QUEUED, db_index=True
+    )
+    progress = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    # how many times a worker has started the job, see jobs.recover_stale
+    attempts = models.PositiveIntegerField(default=0)
+    # whatever the task returned, or the traceback if it failed
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_by = models.CharField(max_length=150, blank=True)
+    date_created = models.DateTimeField(auto_now_add=True)
+    date_started = models.DateTimeField(null=True, blank=True)
+    date_finished = models.DateTimeField(null=True, blank=True)
+    # touched while the job runs, a running job whose heartbeat stops has lost its worker
+    date_updated = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["pk"]
+
+    def __str__(self):
+        return "%s %s (%s)" % (self.task, self.pk, self.status)
+
+    @property
+    def finished(self):
+        return self.status in (self.DONE, self.FAILED)
+
+    @property
+    def percent(self):
+        if not self.total:
+            return 100 if self.finished else 0
+        return int(100 * self.progress / self.total)
+
+    def set_progress(self, progress, total=None):
+        """Record how far through a running job is, without saving other fields."""
+        self.progress = progress
+        fields = {"progress": progress, "date_updated": timezone.now()}
+        if total is not None:
+            self.total = total
+            fields["total"] = total
+        Job.objects.filter(pk=self.pk).update(**fields)
@@ -0,0 +1,281 @@
+"""Opt-in instrumentation of every request, turned on with CLAHUB_PERF=1.
+
+PerfMiddleware records each request's view, total time, SQL query count and time,
+lexicon cache hits and misses, template render time and the time of each stage marked
+with timed, and logs them as a json line to the perf logger. The tools/perf page
+summarises the log. When CLAHUB_PERF is off the middleware removes itself and the
+hooks return as soon as they find no request is being recorded.
+"""
+
+import bisect
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.template.base import Template
+from django.utils import timezone
+
+logger = logging.getLogger("perf")
+
+# a query run this many times in one request is reported as a likely N+1
+REPEATED_QUERY_LIMIT = 5
+# the upper bounds, in ms, of the stage histogram buckets
+HISTOGRAM_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+# the stats of the request being handled by this thread
+_current = threading.local()
+# functions called with (stage, seconds) after every timed stage, e.g. by profile_texts
+hooks = []
+
+
+class RequestStats:
+    """The measurements of one request. Called as a database execute wrapper to time
+    and count the queries."""
+
+    def __init__(self):
+        self.queries = Counter()
+        self.sql_time = 0
+        self.cache_hits = 0
+        self.cache_misses = []
+        self.template_time = 0
+        self.rendering = False
+        # {stage: [ms of each time it ran]}
+        self.stages = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - start
+            self.queries[sql] += 1
+
+    def as_record(self, request, response, total_time):
+        match = request.resolver_match
+        return {
+            "time": timezone.now().isoformat(timespec="seconds"),
+            "method": request.method,
+            "path": request.path,
+            "view": match.view_name if match else "",
+            "status": response.status_code,
+            "total_ms": round(total_time * 1000, 2),
+            "queries": sum(self.queries.values()),
+            "sql_ms": round(self.sql_time * 1000, 2),
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "template_ms": round(self.template_time * 1000, 2),
+            "stages": self.stages,
+            "repeated_queries": [
+                {"sql": sql, "count": count}
+                for sql, count in self.queries.most_common(3)
+                if count >= REPEATED_QUERY_LIMIT
+            ],
+        }
+
+
+def current():
+    """Return the RequestStats of the request being recorded, or None."""
+    return getattr(_current, "stats", None)
+
+
+def record_cache(name, hit):
+    """Count a cache lookup towards the request being recorded."""
+    stats = current()
+    if stats is None:
+        return
+    if hit:
+        stats.cache_hits += 1
+    else:
+        stats.cache_misses.append(name)
+
+
+@contextmanager
+def timed(stage):
+    """Time a block, or every call of a function it decorates, as the named stage.
+
+    The time is added to the request being recorded and passed to each of hooks, with
+    neither it only checks and runs the block."""
+    stats = current()
+    if stats is None and not hooks:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        if stats is not None:
+            stats.stages.setdefault(stage, []).append(round(seconds * 1000, 3))
+        for hook in hooks:
+            hook(stage, seconds)
+
+
+def instrument_templates():
+    """Time template rendering. Included templates are rendered within their parent, so
+    only the outermost render is timed."""
+    if getattr(Template.render, "instrumented", False):
+        return
+    render = Template.render
+
+    @functools.wraps(render)
+    def timed_render(self, context):
+        stats = current()
+        if stats is None or stats.rendering:
+            return render(self, context)
+        stats.rendering = True
+        start = time.perf_counter()
+        try:
+            return render(self, context)
+        finally:
+            stats.template_time += time.perf_counter() - start
+            stats.rendering = False
+
+    timed_render.instrumented = True
+    Template.render = timed_render
+
+
+class PerfMiddleware:
+    """Log the measurements of every request, when settings.CLAHUB_PERF is on."""
+
+    def __init__(self, get_response):
+        if not settings.CLAHUB_PERF:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        instrument_templates()
+
+    def __call__(self, request):
+        stats = RequestStats()
+        _current.stats = stats
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(stats):
+                response = self.get_response(request)
+        finally:
+            _current.stats = None
+        record = stats.as_record(request, response, time.perf_counter() - start)
+        logger.info(json.dumps(record))
+        return response
+
+
+def rotate_log(path, max_bytes):
+    """Move the log at path to path.1 if it's over max_bytes, replacing the last one.
+
+    Only one process should rotate the log. The processes writing it use a
+    WatchedFileHandler, which reopens the log when it finds it has been moved."""
+    try:
+        if os.path.getsize(path) <= max_bytes:
+            return False
+    except FileNotFoundError:
+        return False
+    os.replace(path, path + ".1")
+    return True
+
+
+def read_log(path, limit=5000):
+    """Return the last limit records in the perf log, skipping lines that aren't json."""
+    try:
+        with open(path) as file:
+            lines = deque(file, maxlen=limit)
+    except FileNotFoundError:
+        return []
+    records = []
+    for line in lines:
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            continue
+    return records
+
+
+def percentile(values, percent):
+    """Return the nearest rank percentile of values."""
+    values = sorted(values)
+    rank = max(round(percent / 100 * len(values)), 1)
+    return values[rank - 1]
+
+
+def summarise_views(records):
+    """Return the time, queries and cache use of each view, slowest p95 first."""
+    views = {}
+    for record in records:
+        views.setdefault(record["view"] or record["path"], []).append(record)
+    summary = []
+    for view, view_records in views.items():
+        times = [r["total_ms"] for r in view_records]
+        count = len(view_records)
+        summary.append(
+            {
+                "view": view,
+                "requests": count,
+                "p50_ms": percentile(times, 50),
+                "p95_ms": percentile(times, 95),
+                "max_ms": max(times),
+                "queries": round(sum(r["queries"] for r in view_records) / count, 1),
+                "sql_ms": round(sum(r["sql_ms"] for r in view_records) / count, 2),
+                "template_ms": round(
+                    sum(r["template_ms"] for r in view_records) / count, 2
+                ),
+                "cache_hits": sum(r["cache_hits"] for r in view_records),
+                "cache_misses": sum(len(r["cache_misses"]) for r in view_records),
+            }
+        )
+    return sorted(summary, key=lambda view: view["p95_ms"], reverse=True)
+
+
+def repeated_queries(records, limit=20):
+    """Return the queries run most often within a single request, the likely N+1s,
+    with the view and the most times each was run in one request."""
+    worst = {}
+    for record in records:
+        view = record["view"] or record["path"]
+        for query in record["repeated_queries"]:
+            key = (view, query["sql"])
+            worst[key] = max(worst.get(key, 0), query["count"])
+    return [
+        {"view": view, "sql": sql, "count": count}
+        for (view, sql), count in sorted(
+            worst.items(), key=lambda item: item[1], reverse=True
+        )[:limit]
+    ]
+
+
+def stage_histograms(records):
+    """Return each stage's timings in the records as a histogram of HISTOGRAM_BUCKETS,
+    with its call count and percentiles."""
+    timings = {}
+    for record in records:
+        for stage, times in record.get("stages", {}).items():
+            timings.setdefault(stage, []).extend(times)
+
+    bounds = HISTOGRAM_BUCKETS
+    labels = [f"< {bounds[0]}"]
+    labels += [f"{low}-{high}" for low, high in zip(bounds, bounds[1:])]
+    labels.append(f"{bounds[-1]}+")
+    histograms = []
+    for stage, times in sorted(timings.items()):
+        counts = Counter(bisect.bisect_right(bounds, t) for t in times)
+        histograms.append(
+            {
+                "stage": stage,
+                "calls": len(times),
+                "p50_ms": percentile(times, 50),
+                "p95_ms": percentile(times, 95),
+                "total_ms": round(sum(times), 2),
+                "buckets": [
+                    {
+                        "label": label,
+                        "count": counts[i],
+                        "percent": round(counts[i] / len(times) * 100),
+                    }
+                    for i, label in enumerate(labels)
+                ],
+            }
+        )
+    return histograms
@@ -0,0 +1,68 @@
+"""Picture compression that needs only PIL.
+
+Kept apart from CLAHub.tools, which imports Django models, so the process pool
+workers that compress imported pictures can import it under any start method,
+including spawn and forkserver where the workers don't inherit a set up Django."""
+
+import logging
+import os
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+logger = logging.getLogger("root")
+
+
+def compress_image(im, compressed_sizes, description=""):
+    """Return the bytes of a PIL image as a jpeg at each of compressed_sizes."""
+    # get correct orientation
+    # PIL has an error, skip operation if error arises
+    try:
+        im = ImageOps.exif_transpose(im)
+    except TypeError:
+        logger.error("PIL error %s - image rotated manually" % description)
+        im = im.rotate(270, expand=True)
+    except IndexError:
+        logger.error(
+            "PIL IndexError - {image} not rotated. May need to check it manually".format(
+                image=description
+            )
+        )
+        im = im.rotate(180, expand=True)
+    if im.mode not in ("RGB", "L"):
+        im = im.convert("RGB")
+
+    compressed = []
+    for compressed_size in compressed_sizes:
+        logger.info(
+            "Compressing picture, target size %sx%s"
+            % (compressed_size[0], compressed_size[1])
+        )
+        im.thumbnail(compressed_size)
+        output = BytesIO()
+        im.save(output, format="JPEG", quality=90)
+        logger.info("Picture compressed to %s Mb\n" % (output.tell() / 1000000))
+        compressed.append(output.getvalue())
+    return compressed
+
+
+def compress_picture_file(path, compressed_sizes):
+    """Compress the picture at path to each size, for running in a process pool.
+
+    Returns a list of jpeg bytes, which can be sent back from a worker process, or
+    None for an invalid image."""
+    try:
+        with Image.open(path) as im:
+            im.load()
+            return compress_image(im, compressed_sizes, path)
+    except IOError:
+        logger.error("An invalid image was submitted: %s" % path)
+        return None
+
+
+def available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        # not available on every platform
+        return os.cpu_count() or 1
@@ -0,0 +1,441 @@
+"""Generate a synthetic but realistic dataset, for benchmarking and profiling the site.
+
+Everything is drawn from a seeded random.Random so the same size and seed always give
+the same data. The tables are filled with bulk inserts in one transaction, with the
+processing the models' save methods would do (CE cross references, family links) done
+in memory. The medium preset takes a few seconds and the large one, about 100,000 rows,
+around 20. The lexicon version is bumped once.
+"""
+
+import datetime
+import random
+
+import bleach
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils.html import escape
+from django.utils.text import slugify
+from taggit.models import Tag, TaggedItem
+
+from CE.models import CultureEvent, Question, Text, ce_link_regex
+from CE.utilities import TitleMatcher
+from CLAHub.models import Job
+from lexicon import models as lexicon_models
+from people.models import MedicalAssessment, Person, Village
+from people.utilities import family_reference_regex
+
+# the number of culture events and profiles made by each preset, with the other tables
+# in proportion a size makes about 14 rows per CE, so large is about 100,000 rows
+PRESETS = {"small": 100, "medium": 1000, "large": 7000}
+
+CONSONANTS = "typlkhgdsbnmw"
+VOWELS = "ieauo"
+ENGLISH = (
+    "garden house river pig sago bridge fire rain road bird "
+    "dog tree stone canoe taro banana net song feast bow"
+).split()
+TOK_PISIN = "gaden haus wara pik saksak bris paia ren rot".split()
+VILLAGES = "Imengis Matat Bangis Gol Keku Sorang Waim Asiwa".split()
+RELATIONS = "father mother brother sister son daughter uncle wife husband".split()
+GENDERS = ["M", "F"]
+# a suffix for each conjugation in LexiconVerbEntry.verb_text_fields
+PARADIGM = (
+    "om ol ot omun olun otun "
+    "im il it imun ilun itun "
+    "em el et emun elun etun "
+    "o ubo a ag ab ib ub in ogot"
+).split()
+# the VerbSpellingVariation codes are in the same order as the conjugation fields
+CONJUGATION_CODES = dict(
+    zip(
+        lexicon_models.LexiconVerbEntry.verb_text_fields,
+        [
+            code
+            for code, _ in lexicon_models.VerbSpellingVariation.conjugation.field.choices
+        ],
+    )
+)
+
+
+def kovol_word(rng, syllables=None):
+    """Return a word in Kovol orthography, made of consonant vowel syllables."""
+    syllables = syllables or rng.randint(1, 4)
+    return "".join(
+        rng.choice(CONSONANTS) + rng.choice(VOWELS) for _ in range(syllables)
+    )
+
+
+def unique_words(rng, count, taken=()):
+    """Return count different Kovol words, none of them in taken."""
+    words = set()
+    taken = set(taken)
+    while len(words) < count:
+        word = kovol_word(rng)
+        if word not in taken:
+            words.add(word)
+    return sorted(words)
+
+
+def spelling_variation(rng, word):
+    """Return word with one vowel changed, a typical spelling variation."""
+    positions = [i for i, letter in enumerate(word) if letter in VOWELS]
+    i = rng.choice(positions)
+    vowel = rng.choice([v for v in VOWELS if v != word[i]])
+    return word[:i] + vowel + word[i + 1 :]
+
+
+def sentence(rng, words, length=None):
+    """Return a sentence of Kovol words drawn from words."""
+    length = length or rng.randint(4, 12)
+    return " ".join(rng.choice(words) for _ in range(length)).capitalize() + "."
+
+
+def english(rng, length=8):
+    return " ".join(rng.choice(ENGLISH) for _ in range(length)).capitalize() + "."
+
+
+def bulk_create_entries(entries):
+    """Bulk insert lexicon entries of one model.
+
+    bulk_create can't insert multi-table inherited models, so the LexiconEntry rows
+    are bulk created for their pks, then each child table, from the top down, is
+    inserted with executemany with the pks set."""
+    model = type(entries[0])
+    parents = model._meta.get_parent_list()
+    root = parents[-1]
+    rows = root.objects.bulk_create(
+        root(
+            **{
+                field.attname: getattr(entry, field.attname)
+                for field in root._meta.concrete_fields
+                if not field.primary_key
+            }
+        )
+        for entry in entries
+    )
+    for entry, row in zip(entries, rows):
+        for level in [model, *parents]:
+            setattr(entry, level._meta.pk.attname, row.pk)
+        entry._state.adding = False
+
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        for level in [*reversed(parents[:-1]), model]:
+            fields = level._meta.local_concrete_fields
+            cursor.executemany(
+                "INSERT INTO %s (%s) VALUES (%s)"
+                % (
+                    quote(level._meta.db_table),
+                    ", ".join(quote(field.column) for field in fields),
+                    ", ".join(["%s"] * len(fields)),
+                ),
+                [
+                    [
+                        field.get_db_prep_save(
+                            getattr(entry, field.attname), connection
+                        )
+                        for field in fields
+                    ]
+                    for entry in entries
+                ],
+            )
+    return entries
+
+
+def make_people(rng, size, user):
+    """Bulk create villages, people with family referencing other profiles, and
+    medical assessments."""
+    villages = Village.objects.bulk_create(
+        Village(village_name=name) for name in VILLAGES
+    )
+    # the pks are given so family can refer to profiles before they are inserted
+    first_pk = (Person.objects.aggregate(Max("pk"))["pk__max"] or 0) + 1
+    people = [
+        Person(
+            pk=pk,
+            name=f"{kovol_word(rng, 2).capitalize()} {kovol_word(rng, 3).capitalize()}",
+            village=rng.choice(villages),
+            clan=kovol_word(rng, 2).capitalize(),
+            gender=rng.choice(GENDERS),
+            born=datetime.date(rng.randint(1940, 2015), rng.randint(1, 12), 1),
+            last_modified_by=user,
+        )
+        for pk in range(first_pk, first_pk + size)
+    ]
+
+    # family refers to profiles by ' pk', linked as Person.process_family would
+    names = {person.pk: person.name for person in people}
+    relatives = []
+    for person in people:
+        family = rng.sample(people, min(rng.randint(0, 3), len(people)))
+        person.family_plain_text = ", ".join(
+            f"{rng.choice(RELATIONS).capitalize()} {relative.pk}" for relative in family
+        )
+        person.family = family_reference_regex.sub(
+            lambda match: f'<a href="{match.group(1)}"> '
+            f"{escape(names[int(match.group(1))])}</a>",
+            person.family_plain_text,
+        )
+        relatives += [
+            Person.relatives.through(from_person=person, to_person=relative)
+            for relative in family
+        ]
+    Person.objects.bulk_create(people)
+    Person.relatives.through.objects.bulk_create(relatives)
+
+    assessments = MedicalAssessment.objects.bulk_create(
+        MedicalAssessment(
+            person=rng.choice(people),
+            subjective=english(rng),
+            objective=english(rng),
+            assessment=english(rng, 4),
+            plan=english(rng, 6),
+            short=english(rng, 2)[:25],
+            date=datetime.date(2020, 1, 1)
+            + datetime.timedelta(days=rng.randint(0, 1000)),
+        )
+        for _ in range(size)
+    )
+    return {
+        "villages": len(villages),
+        "people": len(people),
+        "relatives": len(relatives),
+        "medical assessments": len(assessments),
+    }, people
+
+
+def make_lexicon(rng, size, user):
+    """Create words, verbs with full paradigms, Matat verbs, phrases, their senses
+    and spelling variations, and ignore words. Returns the counts and the Kovol words
+    texts can be written with."""
+    counts = {}
+    words = [
+        lexicon_models.KovolWord(
+            kgu=kgu,
+            eng=rng.choice(ENGLISH),
+            tpi=rng.choice(TOK_PISIN),
+            pos=rng.choice(["n", "adj", "adv", "uk"]),
+            matat=spelling_variation(rng, kgu) if rng.random() < 0.3 else None,
+            checked=rng.random() < 0.5,
+            modified_by=user,
+        )
+        for kgu in unique_words(rng, size * 2)
+    ]
+    bulk_create_entries(words)
+    counts["words"] = len(words)
+    counts["word senses"] = len(
+        lexicon_models.KovolWordSense.objects.bulk_create(
+            lexicon_models.KovolWordSense(word=word, sense=rng.choice(ENGLISH))
+            for word in rng.sample(words, len(words) // 4)
+        )
+    )
+    counts["word spelling variations"] = len(
+        lexicon_models.KovolWordSpellingVariation.objects.bulk_create(
+            lexicon_models.KovolWordSpellingVariation(
+                word=word, spelling_variation=spelling_variation(rng, word.kgu)
+            )
+            for word in rng.sample(words, len(words) // 8)
+        )
+    )
+
+    stems = unique_words(rng, max(size // 4, 1), [word.kgu for word in words])
+    verbs = []
+    for stem in stems:
+        verb = lexicon_models.ImengisVerb(
+            eng=f"to {rng.choice(ENGLISH)}",
+            tpi=rng.choice(TOK_PISIN),
+            modified_by=user,
+        )
+        for field, suffix in zip(verb.verb_text_fields, PARADIGM):
+            setattr(verb, field, stem + suffix)
+            setattr(verb, f"{field}_checked", rng.random() < 0.5)
+        verbs.append(verb)
+    bulk_create_entries(verbs)
+    counts["verbs"] = len(verbs)
+    counts["verb senses"] = len(
+        lexicon_models.VerbSense.objects.bulk_create(
+            lexicon_models.VerbSense(verb=verb, sense=rng.choice(ENGLISH))
+            for verb in rng.sample(verbs, len(verbs) // 2)
+        )
+    )
+    variations = []
+    for verb in rng.sample(verbs, len(verbs) // 2):
+        field = rng.choice(list(CONJUGATION_CODES))
+        variations.append(
+            lexicon_models.VerbSpellingVariation(
+                verb=verb,
+                spelling_variation=spelling_variation(rng, getattr(verb, field)),
+                conjugation=CONJUGATION_CODES[field],
+            )
+        )
+    counts["verb spelling variations"] = len(
+        lexicon_models.VerbSpellingVariation.objects.bulk_create(variations)
+    )
+
+    matat_verbs = []
+    for verb in verbs[: max(len(verbs) // 3, 1)]:
+        matat = lexicon_models.MatatVerb(
+            imengis_verb=verb, eng=verb.eng, tpi=verb.tpi, modified_by=user
+        )
+        for field in verb.verb_text_fields:
+            setattr(matat, field, spelling_variation(rng, getattr(verb, field)))
+        matat_verbs.append(matat)
+    bulk_create_entries(matat_verbs)
+    counts["matat verbs"] = len(matat_verbs)
+
+    phrase_texts = set()
+    while len(phrase_texts) < max(size // 4, 1):
+        phrase_texts.add(f"{rng.choice(words).kgu} {rng.choice(words).kgu}")
+    phrases = [
+        lexicon_models.PhraseEntry(
+            kgu=kgu,
+            eng=english(rng, 3)[:-1].lower(),
+            tpi=rng.choice(TOK_PISIN),
+            linked_word=rng.choice(words),
+            modified_by=user,
+        )
+        for kgu in sorted(phrase_texts)
+    ]
+    bulk_create_entries(phrases)
+    counts["phrases"] = len(phrases)
+    counts["phrase spelling variations"] = len(
+        lexicon_models.PhraseSpellingVariation.objects.bulk_create(
+            lexicon_models.PhraseSpellingVariation(
+                phrase=phrase, spelling_variation=spelling_variation(rng, phrase.kgu)
+            )
+            for phrase in rng.sample(phrases, len(phrases) // 4)
+        )
+    )
+
+    ignored = unique_words(
+        rng, max(size // 10, 1), [word.kgu for word in words] + stems
+    )
+    counts["ignore words"] = len(
+        lexicon_models.IgnoreWord.objects.bulk_create(
+            lexicon_models.IgnoreWord(word=word, type="pn", eng=rng.choice(ENGLISH))
+            for word in ignored
+        )
+    )
+    lexicon_models.lexicon_changed()
+
+    vocabulary = [word.kgu for word in words]
+    vocabulary += [
+        getattr(verb, field) for verb in verbs[:200] for field in verb.verb_text_fields
+    ]
+    return counts, vocabulary
+
+
+def make_culture_events(rng, size, people, vocabulary, user):
+    """Bulk create culture events whose descriptions mention each other, linked as
+    CultureEvent.auto_cross_ref would, and their tags, texts and questions."""
+    counts = {}
+    titles = [
+        f"{rng.choice(ENGLISH).capitalize()} {rng.choice(ENGLISH)} {i}"
+        for i in range(size)
+    ]
+    matcher = TitleMatcher({title: slugify(title) for title in titles})
+    ces = []
+    for title in titles:
+        mentions = rng.sample(titles, min(rng.randint(0, 3), size))
+        plain_text = " ".join(
+            [english(rng, 12)] + [f"See {mention} as well." for mention in mentions]
+        )
+        ces.append(
+            CultureEvent(
+                title=title,
+                slug=slugify(title),
+                description_plain_text=plain_text,
+                description=matcher.link(bleach.clean(plain_text)),
+                last_modified_by=user,
+            )
+        )
+    ces = CultureEvent.objects.bulk_create(ces)
+    counts["culture events"] = len(ces)
+
+    pks = {ce.slug: ce.pk for ce in ces}
+    links = [
+        CultureEvent.links.through(from_cultureevent_id=ce.pk, to_cultureevent_id=pk)
+        for ce in ces
+        for pk in {pks[slug] for slug in ce_link_regex.findall(ce.description)}
+        if pk != ce.pk
+    ]
+    counts["links"] = len(CultureEvent.links.through.objects.bulk_create(links))
+
+    tags = [
+        Tag.objects.get_or_create(name=name, defaults={"slug": name})[0]
+        for name in ENGLISH
+    ]
+    content_type = ContentType.objects.get_for_model(CultureEvent)
+    counts["tags"] = len(
+        TaggedItem.objects.bulk_create(
+            TaggedItem(content_type=content_type, object_id=ce.pk, tag=tag)
+            for ce in rng.sample(ces, len(ces) // 2)
+            for tag in rng.sample(tags, 2)
+        )
+    )
+
+    texts = []
+    for _ in range(size * 2):
+        lines = [sentence(rng, vocabulary) for _ in range(rng.randint(3, 10))]
+        if rng.random() < 0.2:
+            # a word missing from the lexicon, to be highlighted
+            lines.append(sentence(rng, [kovol_word(rng, 5)], 1))
+        if rng.random() < 0.2:
+            lines = [
+                f"0:{i:02d}:{rng.randint(10, 59)} {line}"
+                for i, line in enumerate(lines)
+            ]
+        speaker = rng.choice(people) if rng.random() < 0.3 else None
+        texts.append(
+            Text(
+                ce=rng.choice(ces),
+                text_title=english(rng, 3),
+                orthographic_text="\n".join(lines),
+                discourse_type=rng.choice(Text.genres)[0],
+                speaker_plain_text=str(speaker.pk) if speaker else "",
+                speaker=(
+                    f'<a href="/clahub/people/{speaker.pk}"> {escape(speaker.name)}</a>'
+                    if speaker
+                    else ""
+                ),
+                last_modified_by=user,
+            )
+        )
+    counts["texts"] = len(Text.objects.bulk_create(texts))
+
+    counts["questions"] = len(
+        Question.objects.bulk_create(
+            Question(
+                ce=rng.choice(ces),
+                question=english(rng, 6)[:-1] + "?",
+                answer=english(rng) if rng.random() < 0.5 else "",
+                asked_by=user,
+                last_modified_by=user,
+                answered_by=user,
+            )
+            for _ in range(size)
+        )
+    )
+    return counts
+
+
+def generate(size=PRESETS["small"], seed=0, user="bench"):
+    """Create a dataset scaled by size and return the number of rows made per table.
+
+    size is the number of culture events and profiles, texts, lexicon entries and the
+    rest are made in proportion. The database should have no profiles or lexicon
+    entries, or words may clash.
+    """
+    rng = random.Random(seed)
+    # the lexicon version is bumped once, after the data is committed
+    with lexicon_models.lexicon_batch(), transaction.atomic():
+        counts, people = make_people(rng, size, user)
+        lexicon_counts, vocabulary = make_lexicon(rng, size, user)
+        counts.update(lexicon_counts)
+        counts.update(make_culture_events(rng, size, people, vocabulary, user))
+        Job.objects.create(
+            task="import_profiles", status=Job.DONE, result=0, created_by=user
+        )
+        counts["jobs"] = 1
+    return counts
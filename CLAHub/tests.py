@@ -0,0 +1,436 @@
+import datetime
+import json
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from unittest import mock
+
+from PIL import Image
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from CLAHub import benchmark, jobs, perf, pictures, synthetic, tools
+from CLAHub.base_settings import BASE_DIR
+from CLAHub.models import Job
+from CE.models import CultureEvent, Question, Text
+from lexicon import models as lexicon_models
+from lexicon import utilities as lexicon_utilities
+from people.models import Person, Village
+
+
+@jobs.task
+def add(job, a, b):
+    job.set_progress(1, 1)
+    return a + b
+
+
+@jobs.task
+def fail(job):
+    raise ValueError("task failed")
+
+
+class JobQueueTest(TestCase):
+    def test_run_job(self):
+        job = jobs.submit("add", a=1, b=2)
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertEqual(jobs.run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.DONE)
+        self.assertEqual(job.result, 3)
+        self.assertEqual(job.percent, 100)
+        self.assertIsNotNone(job.date_finished)
+
+    def test_failed_job(self):
+        job = jobs.submit("fail")
+        jobs.run_pending()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn("ValueError: task failed", job.error)
+
+    def test_jobs_claimed_once_in_order(self):
+        first = jobs.submit("add", a=1, b=2)
+        second = jobs.submit("add", a=3, b=4)
+        self.assertEqual(jobs.claim_next(), first)
+        self.assertEqual(jobs.claim_next(), second)
+        self.assertIsNone(jobs.claim_next())
+
+    def test_stale_jobs_recovered(self):
+        started = timezone.now() - jobs.STALE_AFTER - datetime.timedelta(minutes=1)
+        stopped = jobs.submit("add", a=1, b=2)
+        given_up = jobs.submit("add", a=3, b=4)
+        running = jobs.submit("add", a=5, b=6)
+        Job.objects.filter(pk__in=[stopped.pk, given_up.pk, running.pk]).update(
+            status=Job.RUNNING, date_started=started, date_updated=started, attempts=1
+        )
+        Job.objects.filter(pk=given_up.pk).update(attempts=jobs.MAX_ATTEMPTS)
+        # a long job whose worker is still beating isn't stale
+        Job.objects.filter(pk=running.pk).update(date_updated=timezone.now())
+
+        self.assertEqual(jobs.recover_stale(), 2)
+        statuses = dict(Job.objects.values_list("pk", "status"))
+        self.assertEqual(statuses[stopped.pk], Job.QUEUED)
+        self.assertEqual(statuses[given_up.pk], Job.FAILED)
+        self.assertEqual(statuses[running.pk], Job.RUNNING)
+
+        self.assertEqual(jobs.claim_next(), stopped)
+        stopped.refresh_from_db()
+        self.assertEqual(stopped.attempts, 2)
+
+    def test_heartbeat(self):
+        jobs.submit("add", a=1, b=2)
+        job = jobs.claim_next()
+        Job.objects.filter(pk=job.pk).update(date_updated=None)
+        stop = mock.Mock()
+        # beat once, then stop
+        stop.wait.side_effect = [False, True]
+        jobs.beat(job, stop)
+        job.refresh_from_db()
+        self.assertIsNotNone(job.date_updated)
+
+        Job.objects.filter(pk=job.pk).update(date_updated=None)
+        job.set_progress(1, 2)
+        job.refresh_from_db()
+        self.assertIsNotNone(job.date_updated)
+
+    def test_unknown_task(self):
+        with self.assertRaises(KeyError):
+            jobs.submit("not_a_task")
+
+
+class ImportProfilesViewTest(TestCase):
+    def setUp(self):
+        user = User(username="Tester")
+        user.set_password("secure_password")
+        user.save()
+        self.client.login(username="Tester", password="secure_password")
+        Village(village_name="Kovol").save()
+
+    def test_import_queued(self):
+        upload = SimpleUploadedFile("profiles.csv", b"missing.jpg,Kovol,Tester\n")
+        response = self.client.post(reverse("import_profiles"), {"file": upload})
+        job = Job.objects.get()
+        self.assertRedirects(response, reverse("job", args=[job.pk]))
+        self.assertEqual(job.task, "import_profiles")
+        self.assertEqual(job.created_by, "Tester")
+
+        response = self.client.get(reverse("job", args=[job.pk]), {"format": "json"})
+        self.assertEqual(response.json()["status"], Job.QUEUED)
+
+        jobs.run_pending()
+        response = self.client.get(reverse("job", args=[job.pk]))
+        self.assertContains(response, "Done")
+        self.assertContains(response, "missing.jpg not found in imports folder")
+
+
+class CompressPictureTest(TestCase):
+    def picture(self, name="picture.png", size=(2400, 1600)):
+        output = BytesIO()
+        Image.new("RGBA", size, "red").save(output, format="PNG")
+        return SimpleUploadedFile(name, output.getvalue())
+
+    def test_sizes_from_one_picture(self):
+        picture, thumbnail = tools.compress_picture_sizes(
+            self.picture(), [(1200, 1200), (300, 300)]
+        )
+        self.assertEqual(picture.name, "picture.jpg")
+        self.assertEqual(Image.open(picture).size, (1200, 800))
+        self.assertEqual(Image.open(thumbnail).size, (300, 200))
+
+    def test_invalid_picture(self):
+        invalid = SimpleUploadedFile("picture.jpg", b"not a picture")
+        self.assertIsNone(tools.compress_picture(invalid, (1200, 1200)))
+
+
+class ImportProfilesTest(TestCase):
+    def setUp(self):
+        Village(village_name="Kovol").save()
+        import_dir = os.path.join(BASE_DIR, "uploads", "import")
+        if not os.path.exists(import_dir):
+            os.makedirs(import_dir)
+            self.addCleanup(os.removedirs, import_dir)
+        self.rows = []
+        for i in range(3):
+            name = "import_test_%s.png" % i
+            Image.new("RGB", (1600, 2400), (0, 0, 100 * i)).save(
+                os.path.join(import_dir, name)
+            )
+            self.addCleanup(os.remove, os.path.join(import_dir, name))
+            self.rows.append("%s,Kovol,Person %s" % (name, i))
+
+    def test_import(self):
+        upload = SimpleUploadedFile("profiles.csv", "\n".join(self.rows).encode())
+        self.assertEqual(tools.import_profiles_from_csv(upload), 3)
+        for person in Person.objects.all():
+            self.assertEqual(person.picture.width, 800)
+            self.assertEqual(person.thumbnail.height, 300)
+            self.addCleanup(person.picture.delete, save=False)
+            self.addCleanup(person.thumbnail.delete, save=False)
+        self.assertEqual(Person.objects.count(), 3)
+
+    def test_workers_start_without_django(self):
+        # spawn and forkserver workers import the compression functions afresh
+        path = os.path.join(BASE_DIR, "uploads", "import", "import_test_0.png")
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            compressed = pool.submit(
+                pictures.compress_picture_file, path, [(300, 300)]
+            ).result()
+        self.assertEqual(Image.open(BytesIO(compressed[0])).size, (200, 300))
+
+
+class BenchmarkTest(TestCase):
+    def setUp(self):
+        synthetic.generate(size=10)
+        user = User(username="Tester")
+        user.set_password("secure_password")
+        user.save()
+        self.client.login(username="Tester", password="secure_password")
+
+    def test_every_route_has_arguments(self):
+        routes = benchmark.collect_routes()
+        names = [name for name, _ in routes]
+        self.assertIn("CE:view", names)
+        self.assertIn("people:edit_assessment", names)
+        self.assertIn("lexicon:main", names)
+        self.assertIn("tools", names)
+        self.assertNotIn("admin:index", names)
+        urls, skipped = benchmark.route_urls(routes, benchmark.sample_arguments())
+        self.assertEqual(skipped, [])
+        self.assertEqual(urls["CE:search_CE"], reverse("CE:search_CE") + "?search=ga")
+
+    def test_measure(self):
+        urls = {"CE:home_page": reverse("CE:home_page"), "tools": reverse("tools")}
+        results = benchmark.measure(self.client, urls, repeat=3)
+        self.assertEqual(results["CE:home_page"]["status"], 200)
+        self.assertGreater(results["tools"]["queries"], 0)
+        self.assertGreater(results["tools"]["peak_memory_kb"], 0)
+        self.assertLessEqual(results["tools"]["p50_ms"], results["tools"]["p95_ms"])
+
+    def test_streamed_body_measured(self):
+        def export():
+            yield b"header"
+            # queries made while the body is built count towards the page
+            list(CultureEvent.objects.all())
+            yield b"body"
+
+        client = mock.Mock()
+        client.get.side_effect = lambda url: StreamingHttpResponse(export())
+        results = benchmark.measure(client, {"export": "/export"}, repeat=2)
+        self.assertEqual(results["export"]["cold_queries"], 1)
+        self.assertEqual(results["export"]["queries"], 1)
+
+    def test_compare(self):
+        baseline = {
+            "CE:view": {"queries": 5, "p95_ms": 20, "peak_memory_kb": 500},
+            "CE:new": {"queries": 2, "p95_ms": 10, "peak_memory_kb": 100},
+        }
+        results = {
+            "CE:view": {"queries": 7, "p95_ms": 30, "peak_memory_kb": 510},
+            "CE:new": {"queries": 2, "p95_ms": 11, "peak_memory_kb": 100},
+            "CE:edit": {"queries": 50, "p95_ms": 100, "peak_memory_kb": 1000},
+        }
+        regressions = benchmark.compare(results, baseline, threshold=25)
+        self.assertEqual(
+            regressions,
+            ["CE:view: 7 queries, was 5", "CE:view: p95_ms 30ms, was 20ms"],
+        )
+        self.assertEqual(
+            benchmark.compare(results, baseline, threshold=60, query_threshold=2), []
+        )
+
+
+class SyntheticDataTest(TestCase):
+    def snapshot(self):
+        return (
+            list(CultureEvent.objects.values_list("title", "description")),
+            list(Text.objects.values_list("orthographic_text", "speaker")),
+            list(Person.objects.values_list("name", "family")),
+            list(lexicon_models.LexiconEntry.objects.values_list("eng", "tpi")),
+        )
+
+    def test_same_seed_same_data(self):
+        with transaction.atomic():
+            counts = synthetic.generate(size=20, seed=1)
+            first = self.snapshot()
+            transaction.set_rollback(True)
+        self.assertEqual(synthetic.generate(size=20, seed=1), counts)
+        self.assertEqual(self.snapshot(), first)
+
+    def test_generated_data(self):
+        synthetic.generate(size=20)
+        for text in Text.objects.filter(last_modified_by="bench"):
+            for word in re.findall(r"[a-z]+", text.orthographic_text.lower()):
+                lexicon_models.kovol_text_validator(word)
+
+        verb = lexicon_models.ImengisVerb.objects.first()
+        self.assertEqual(
+            len(verb.get_conjugations()),
+            len(lexicon_models.LexiconVerbEntry.verb_text_fields),
+        )
+        self.assertTrue(verb.matat.exists())
+        self.assertTrue(lexicon_models.VerbSpellingVariation.objects.exists())
+
+        linked = CultureEvent.objects.filter(links__isnull=False).first()
+        for ce in linked.links.all():
+            self.assertIn(f'<a href="{ce.slug}">{ce.title}</a>', linked.description)
+
+        person = Person.objects.filter(relatives__isnull=False).first()
+        for relative in person.relatives.all():
+            self.assertIn(f"{relative.pk}", person.family_plain_text)
+            self.assertIn(relative.name, person.family)
+
+
+class PerfTest(TestCase):
+    def setUp(self):
+        # the CE and people tests disable logging when they're imported
+        self.addCleanup(logging.disable, logging.root.manager.disable)
+        logging.disable(logging.NOTSET)
+        cache.clear()
+        lexicon_utilities._local_cache.clear()
+        user = User(username="Tester")
+        user.set_password("secure_password")
+        user.save()
+
+    def client_with_perf(self):
+        client = Client()
+        client.login(username="Tester", password="secure_password")
+        return client
+
+    def test_off_by_default(self):
+        with self.assertNoLogs("perf"):
+            self.client.get(reverse("home"))
+
+    @override_settings(CLAHUB_PERF=True)
+    def test_request_recorded(self):
+        client = self.client_with_perf()
+        with self.assertLogs("perf") as logs:
+            client.get(reverse("lexicon:main"))
+            client.get(reverse("lexicon:main"))
+        cold, warm = [json.loads(record.getMessage()) for record in logs.records]
+        self.assertEqual(cold["view"], "lexicon:main")
+        self.assertEqual(cold["status"], 200)
+        self.assertGreater(cold["queries"], 0)
+        self.assertGreater(cold["template_ms"], 0)
+        self.assertIn("imengis:lexicon", cold["cache_misses"])
+        self.assertEqual(warm["cache_misses"], [])
+        self.assertGreater(warm["cache_hits"], 0)
+
+    @override_settings(CLAHUB_PERF=True)
+    def test_repeated_queries_recorded(self):
+        for i in range(perf.REPEATED_QUERY_LIMIT):
+            ce = CultureEvent.objects.create(title=f"CE {i}", last_modified_by="Tester")
+            Question.objects.create(ce=ce, question="Why?", asked_by="Tester")
+        client = self.client_with_perf()
+        with self.assertLogs("perf") as logs:
+            client.get(reverse("CE:questions_chron"))
+        record = json.loads(logs.records[0].getMessage())
+        self.assertGreaterEqual(
+            record["repeated_queries"][0]["count"], perf.REPEATED_QUERY_LIMIT
+        )
+
+    @override_settings(CLAHUB_PERF=True)
+    def test_stages_recorded(self):
+        ce = CultureEvent.objects.create(title="Stages", last_modified_by="Tester")
+        Text(ce=ce, orthographic_text="hobot gamo").save()
+        client = self.client_with_perf()
+        with self.assertLogs("perf") as logs:
+            client.get(reverse("CE:view", args=[ce.pk]))
+        stages = json.loads(logs.records[0].getMessage())["stages"]
+        for stage in ("highlight", "timestamps", "bleach", "markdown", "lexicon_index"):
+            self.assertEqual(len(stages[stage]), 1)
+
+    def test_timed(self):
+        timings = []
+        perf.hooks.append(lambda stage, seconds: timings.append(stage))
+        self.addCleanup(perf.hooks.clear)
+
+        @perf.timed("decorated")
+        def function():
+            return 1
+
+        self.assertEqual(function(), 1)
+        with perf.timed("block"):
+            pass
+        self.assertEqual(timings, ["decorated", "block"])
+
+    def test_perf_page(self):
+        records = [
+            {
+                "view": view,
+                "path": "/",
+                "total_ms": total_ms,
+                "queries": 12,
+                "sql_ms": 4,
+                "template_ms": 3,
+                "cache_hits": 1,
+                "cache_misses": [],
+                "repeated_queries": repeated,
+                "stages": {"markdown": [total_ms / 10, 0.5]},
+            }
+            for view, total_ms, repeated in [
+                ("CE:view", 10, []),
+                ("CE:view", 30, [{"sql": "SELECT 1", "count": 8}]),
+                ("home", 5, [{"sql": "SELECT 2", "count": 6}]),
+            ]
+        ]
+        with tempfile.NamedTemporaryFile("w", suffix=".txt") as log:
+            log.write("\n".join(json.dumps(record) for record in records))
+            log.write("\nnot json\n")
+            log.flush()
+            self.assertEqual(len(perf.read_log(log.name)), 3)
+
+            self.client.login(username="Tester", password="secure_password")
+            with override_settings(PERF_LOG=log.name):
+                response = self.client.get(reverse("perf"))
+        views = response.context["views"]
+        self.assertEqual([view["view"] for view in views], ["CE:view", "home"])
+        self.assertEqual(views[0]["requests"], 2)
+        self.assertEqual(views[0]["p95_ms"], 30)
+        markdown = response.context["histograms"][0]
+        self.assertEqual(markdown["stage"], "markdown")
+        self.assertEqual(markdown["calls"], 6)
+        self.assertEqual(
+            [bucket["count"] for bucket in markdown["buckets"][:4]], [4, 1, 1, 0]
+        )
+        self.assertEqual(
+            response.context["repeated"],
+            [
+                {"view": "CE:view", "sql": "SELECT 1", "count": 8},
+                {"view": "home", "sql": "SELECT 2", "count": 6},
+            ],
+        )
+
+    def test_rotate_log(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "perf_log.txt")
+        # two handlers on one file, as in two gunicorn workers
+        handlers = [logging.handlers.WatchedFileHandler(path) for _ in range(2)]
+        for handler in handlers:
+            self.addCleanup(handler.close)
+
+        def log(message):
+            for handler in handlers:
+                handler.emit(logging.makeLogRecord({"msg": message}))
+
+        log("first")
+        self.assertFalse(perf.rotate_log(path, 100))
+        self.assertTrue(perf.rotate_log(path, 5))
+        log("second")
+        with open(path + ".1") as file:
+            self.assertEqual(file.read(), "first\nfirst\n")
+        with open(path) as file:
+            self.assertEqual(file.read(), "second\nsecond\n")
+        self.assertFalse(perf.rotate_log(os.path.join(directory, "missing.txt"), 5))
@@ -1,20 +1,30 @@
 import csv
+import hashlib
 import logging
 import os
-import sys
+from concurrent.futures import ProcessPoolExecutor
 from io import BytesIO
 
-from PIL import Image, ImageOps
+from PIL import Image
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
 from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.db.models import Q
 
-from CLAHub import base_settings
+from CLAHub import jobs
 from CLAHub.base_settings import BASE_DIR
+from CLAHub.models import MediaFile
+from CLAHub.pictures import available_cores, compress_image, compress_picture_file
 from people import models
 
 logger = logging.getLogger("root")
 
 
-def import_profiles_from_csv(file_upload):
+def import_profiles_from_csv(file_upload, progress=None):
+    """Create a profile for each row of a csv file of picture, village and name.
+
+    progress is called with the number of profiles saved and the total after each
+    one. Returns the number of profiles created, or an error code."""
     logger.info("import_profiles_from_csv initiated")
     if type(file_upload) == str:
         file = open(file_upload)
@@ -34,55 +44,70 @@ def import_profiles_from_csv(file_upload):
     elif check.startswith("missing_file_error"):
         logger.error(
             "No data imported, %s not found in import folder"
-            % check.lstrip("missing_file_error")
+            % check.removeprefix("missing_file_error")
         )
         return check
 
     else:
         logger.info("All data cleared for import")
-        for i, profile in enumerate(data, 1):
-            picture = os.path.join(
-                BASE_DIR, "uploads", "import", profile[columns["picture"]]
-            )
-            villages = models.Person.villages
-            village = [
-                item[0] for item in villages if item[1] == profile[columns["village"]]
-            ][0]
-            new_profile = models.Person(
-                village=village,
-                name=profile[columns["name"]],
-                # need to insert CLAHubs install dir before the filename
-                picture=picture,
-                last_modified_by="Batch importer",
+        villages = {v.village_name: v for v in models.Village.objects.all()}
+        paths = [
+            os.path.join(BASE_DIR, "uploads", "import", profile[columns["picture"]])
+            for profile in data
+        ]
+        # pictures are compressed across the available cores, the profiles are saved here as each one is ready
+        processes = max(1, min(available_cores(), len(data)))
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            compressed = pool.map(
+                compress_picture_file,
+                paths,
+                [models.Person.picture_sizes] * len(paths),
             )
-            new_profile.save()
-            logger.info("Saved profile %s of %s" % (i, len(data)))
-            # todo clean up imports folder
-            # todo write instructions into template
-            # todo add other if conditions: if encoding error
-            # todo write tests
+            for i, (profile, path, pictures) in enumerate(
+                zip(data, paths, compressed), 1
+            ):
+                new_profile = models.Person(
+                    village=villages[profile[columns["village"]]],
+                    name=profile[columns["name"]],
+                    last_modified_by="Batch importer",
+                )
+                if pictures:
+                    name = "%s.jpg" % os.path.basename(path).split(".")[0]
+                    new_profile.picture, new_profile.thumbnail = [
+                        jpeg_file(picture, name) for picture in pictures
+                    ]
+                    new_profile.picture_compressed = True
+                new_profile.save()
+                logger.info("Saved profile %s of %s" % (i, len(data)))
+                if progress:
+                    progress(i, len(data))
+                # todo clean up imports folder
+                # todo write instructions into template
+                # todo add other if conditions: if encoding error
         logger.info(
             "import_profiles_from_csv_finished %s profiles created\n\n" % len(data)
         )
         return len(data)
 
 
+@jobs.task
+def import_profiles(job, csv_text):
+    """Run import_profiles_from_csv as a job, on the text of the uploaded file."""
+    return import_profiles_from_csv(
+        ContentFile(csv_text.encode("utf-8")), progress=job.set_progress
+    )
+
+
 def check_csv(csv_data, columns):
     logger.info("Checking integrity of .csv file")
     logger.debug("%s rows of data in .csv" % len(csv_data))
+    villages = set(models.Village.objects.values_list("village_name", flat=True))
     for i, profile in enumerate(csv_data, 1):
         logger.debug("checking row %s" % i)
-        for column in csv_data:
-            if "" in column:
-                return "missing_data_error"
-        # csv file has the value, not the key to villages. Need to loop though and find the
-        # key that matches the value
-        try:
-            villages = models.Person.villages
-            village = [
-                item[0] for item in villages if item[1] == profile[columns["village"]]
-            ][0]
-        except IndexError:
+        if "" in profile:
+            return "missing_data_error"
+        # csv file has the village's name
+        if profile[columns["village"]] not in villages:
             return "village_spelling_error"
         pic_path = os.path.join(
             BASE_DIR, "uploads", "import", profile[columns["picture"]]
@@ -99,78 +124,75 @@ def check_csv(csv_data, columns):
 
 
 def compress_picture(picture, compressed_size):
+    pictures = compress_picture_sizes(picture, [compressed_size])
+    return pictures[0] if pictures else None
+
+
+def compress_picture_sizes(picture, compressed_sizes):
+    """Compress a picture to each of compressed_sizes, returning a list of jpeg files.
+
+    The picture is only decoded and rotated once, each size is shrunk from the one
+    before it so give the sizes largest first. Returns None for an invalid image."""
     try:
         im = Image.open(picture)
     except IOError:
         logger.error("An invalid image was submitted")
         return None
-    logger.info(
-        "Compressing picture, target size %sx%s"
-        % (compressed_size[0], compressed_size[1])
-    )
-    # get correct orientation
-    # PIL has an error, skip operation if error arises
-    try:
-        im = ImageOps.exif_transpose(im)
-    except TypeError:
-        logger.error("PIL error %s - image rotated manually" % str(picture))
-        im = im.rotate(270, expand=True)
-    except IndexError:
-        logger.error(
-            "PIL IndexError - {image} not rotated. May need to check it manually".format(
-                image=str(picture)
-            )
-        )
-        im = im.rotate(180, expand=True)
-
-    output = BytesIO()
-    im.thumbnail(compressed_size)
-    im.save(output, format="JPEG", quality=90)
-    output.seek(0)
-    picture = InMemoryUploadedFile(
-        output,
-        "PictureField",
-        "%s.jpg" % picture.name.split(".")[0],
-        "image/jpeg",
-        sys.getsizeof(output),
-        None,
-    )
-    size = sys.getsizeof(output) / 1000000
-    logger.info("Picture compressed to %s Mb\n" % size)
-    return picture
+    name = "%s.jpg" % os.path.basename(picture.name).split(".")[0]
+    return [
+        jpeg_file(data, name)
+        for data in compress_image(im, compressed_sizes, str(picture))
+    ]
 
 
-def check_already_imported(picture):
-    # look in CE and people uploads for files user has already uploaded
+def jpeg_file(data, name):
+    """Wrap compressed jpeg bytes as an uploaded file that can be saved to a model."""
+    return InMemoryUploadedFile(
+        BytesIO(data), "PictureField", name, "image/jpeg", len(data), None
+    )
 
-    # todo It's possible this could misbehave if a file has the same name and the user intends that
-    # to upload it. An uncompressed image would go through. If it went into a different upload folder
-    # it wouldn't clash with the name previously.
 
-    imported_files = list_all_files(
-        os.path.join(base_settings.MEDIA_ROOT, "CultureEventFiles")
-    ) + list_all_files(
-        os.path.join(base_settings.MEDIA_ROOT, "people", "profile_pictures")
-    )
+def file_hash(file):
+    """Return the sha256 hex digest of a file's content, leaving the file at the start."""
+    sha256 = hashlib.sha256()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(1024 * 1024), b""):
+        sha256.update(chunk)
+    file.seek(0)
+    return sha256.hexdigest()
+
 
-    if os.path.basename(str(picture)) in imported_files:
-        logger.info("This file already exists: " + os.path.basename(str(picture)))
-        return True
+def check_already_imported(file, owners=None):
+    """Return the MediaFile registry entry if the file, or a file with the same content, is already stored in
+    uploads. Otherwise return None.
 
+    owners is a queryset of the objects whose files count as duplicates, e.g. the pictures of one CE, so the same
+    content uploaded elsewhere is still stored. By default any stored file counts."""
+    # a file that's already stored, e.g. an unchanged picture when a profile is edited
+    if getattr(file, "_committed", False):
+        entry = MediaFile.objects.filter(path=file.name).first()
+        if entry:
+            return entry
 
-def list_all_files(path):
-    # create a list of all file names recursively in a directory
     try:
-        list_of_file = os.listdir(path)
-    except FileNotFoundError:
-        return []
-    all_files = list()
-    for entry in list_of_file:
-        full_path = os.path.join(path, entry)
-        if os.path.isdir(full_path):
-            all_files = all_files + list_all_files(full_path)
-        else:
-            all_files.append(full_path)
-    all_files = [os.path.basename(file) for file in all_files]
-
-    return all_files
+        sha256 = file_hash(file)
+    except (OSError, SuspiciousFileOperation):
+        logger.error("Couldn't read %s to check if it's already imported" % file)
+        return None
+    # compressed pictures are stored under a different hash to the upload they came from
+    entries = MediaFile.objects.filter(Q(sha256=sha256) | Q(source_sha256=sha256))
+    if owners is not None:
+        entries = entries.filter(
+            owner__startswith="%s." % owners.model._meta.label,
+            object_pk__in=owners.values("pk"),
+        )
+    entry = entries.first()
+    if entry:
+        logger.info("This file already exists: " + entry.path)
+        return entry
+    # remembered so the registry can record what the stored, possibly compressed, file was made from
+    if hasattr(file, "instance"):
+        source_hashes = getattr(file.instance, "upload_source_hashes", {})
+        source_hashes[file.field.name] = sha256
+        file.instance.upload_source_hashes = source_hashes
+    return None
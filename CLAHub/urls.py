@@ -13,6 +13,7 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+
 from django.contrib import admin
 from django.urls import path, include
 from django.contrib.staticfiles.urls import static, staticfiles_urlpatterns
@@ -23,6 +24,8 @@ urlpatterns = [
     path("admin/", admin.site.urls),
     path("tools/", views.tools, name="tools"),
     path("tools/import-profiles", views.import_profiles, name="import_profiles"),
+    path("tools/jobs/<int:pk>", views.job, name="job"),
+    path("tools/perf", views.performance, name="perf"),
     path("CE/", include("CE.urls")),
     path("people/", include("people.urls")),
     path("lexicon/", include("lexicon.urls")),
@@ -1,9 +1,11 @@
-from django.shortcuts import render, redirect
+from django.conf import settings
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404, render, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 
-from CLAHub import forms
-from CLAHub.tools import import_profiles_from_csv
+from CLAHub import forms, jobs, perf
+from CLAHub.models import Job
 import logging
 
 logger = logging.getLogger("CLAHub")
@@ -26,40 +28,87 @@ def text_features(request):
 
 @login_required
 def tools(request):
-    context = {"title": "Tools"}
+    context = {"title": "Tools", "jobs": Job.objects.order_by("-pk")[:10]}
     return render(request, "tools.html", context)
 
 
+def import_result_message(result):
+    """Return the message level and text describing the result of a profile import."""
+    if type(result) == int:
+        return messages.SUCCESS, "Import successful, %s records imported" % (result,)
+    elif result == "missing_data_error":
+        return messages.ERROR, "Data is missing, import cancelled"
+    elif result == "village_spelling_error":
+        return (
+            messages.ERROR,
+            "Import cancelled, a village name has been spelt incorrectly",
+        )
+    elif result and result.startswith("missing_file_error"):
+        # get the filename by stripping off the internal error message
+        missing_file = result.removeprefix("missing_file_error")
+        return (
+            messages.ERROR,
+            "Import cancelled, %s not found in imports folder" % (missing_file,),
+        )
+    return messages.ERROR, "Import failed"
+
+
 @login_required
 def import_profiles(request):
-    # todo need to install celery so this can be processed asynchroniously
+    """Queue the uploaded csv to be imported by the job worker."""
     if request.method == "POST":
         form = forms.ProfileUploadForm(request.POST, request.FILES)
         if form.is_valid():
-            _import = import_profiles_from_csv(request.FILES["file"])
-            if type(_import) == int:
-                messages.success(
-                    request, "Import successful, %s records imported" % (_import,)
-                )
-                return redirect("home")
-            elif _import == "missing_data_error":
-                messages.error(request, "Data is missing, import cancelled")
-            elif _import == "village_spelling_error":
-                messages.error(
-                    request,
-                    "Import cancelled, a village name has been spelt incorrectly",
-                )
-            elif _import.startswith("missing_file_error"):
-                # get the filename by stripping off the internal error message
-                missing_file = _import.lstrip("missing_file_error")
-                messages.error(
-                    request,
-                    "Import cancelled, %s not found in imports folder"
-                    % (missing_file,),
-                )
+            try:
+                csv_text = request.FILES["file"].read().decode("utf-8")
+            except UnicodeDecodeError:
+                messages.error(request, "Import failed, the file must be UTF8")
             else:
-                messages.error(request, "Import failed")
+                job = jobs.submit(
+                    "import_profiles", user=request.user.username, csv_text=csv_text
+                )
+                messages.info(request, "Import queued as job %s" % job.pk)
+                return redirect("job", pk=job.pk)
 
     form = forms.ProfileUploadForm()
     context = {"form": form, "title": "Import profiles"}
     return render(request, "import_profiles.html", context)
+
+
+@login_required
+def job(request, pk):
+    """Show the progress of a job, or return it as json with ?format=json."""
+    job = get_object_or_404(Job, pk=pk)
+    if request.GET.get("format") == "json":
+        return JsonResponse(
+            {
+                "id": job.pk,
+                "task": job.task,
+                "status": job.status,
+                "progress": job.progress,
+                "total": job.total,
+                "result": job.result,
+                "error": job.error,
+            }
+        )
+    if job.status == Job.DONE and job.task == "import_profiles":
+        messages.add_message(request, *import_result_message(job.result))
+    context = {"job": job, "title": "Job %s" % job.pk}
+    return render(request, "job.html", context)
+
+
+@login_required
+def performance(request):
+    """Summarise the perf log, the slowest views, the queries repeated in a request and
+    histograms of the timed stages."""
+    records = perf.read_log(settings.PERF_LOG)
+    context = {
+        "title": "Performance",
+        "enabled": settings.CLAHUB_PERF,
+        "requests": len(records),
+        "views": perf.summarise_views(records),
+        "repeated": perf.repeated_queries(records),
+        "repeated_limit": perf.REPEATED_QUERY_LIMIT,
+        "histograms": perf.stage_histograms(records),
+    }
+    return render(request, "perf.html", context)
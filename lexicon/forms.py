@@ -17,7 +17,7 @@ phrase_fields = [
 
 
 def get_model_choices():
-    words = lexicon.utilities.get_words_queryset_from_cache()
+    words = lexicon.utilities.get_lexicon_words_from_cache()
     choices = []
     for w in words:
         if w.type == "word":
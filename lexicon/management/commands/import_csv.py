@@ -1,12 +1,13 @@
-from django.core.management.base import BaseCommand
-from django.db.utils import IntegrityError
+from django.core.management.base import BaseCommand, CommandError
 from django.core.exceptions import ValidationError
+from django.db import transaction
 
 from lexicon import models
 
 import os
 import csv
 import datetime
+import time
 
 conjugation_codes = {
     "past_1s": "1sp",
@@ -39,11 +40,43 @@ conjugation_codes = {
 
 
 class Command(BaseCommand):
-    help = "import lexicon data from csv"
-
-    def import_words(self, write=True):
-        with open(os.path.join("data", "Kovol_lexicon.csv")) as file:
-            data = [row for row in csv.DictReader(file)]
+    help = """import lexicon data from Kovol_verbs.csv, Kovol_lexicon.csv and check_list.csv
+
+    Each file is read once and the rows grouped in memory. Everything is imported in one
+    transaction with the lexicon version bumped once at the end, senses and spelling
+    variations are created in bulk. Use --dry-run to validate the files without saving."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Validate and report on the import, then roll it back",
+        )
+        parser.add_argument(
+            "--directory",
+            default="data",
+            help="The folder containing the csv files, data by default",
+        )
+        parser.add_argument(
+            "--progress",
+            type=int,
+            default=500,
+            help="Report progress every this many rows, 0 for no progress output",
+        )
+
+    def read_csv(self, name):
+        with open(os.path.join(self.directory, name)) as file:
+            return [row for row in csv.DictReader(file)]
+
+    def report(self, label, done, total, start):
+        """Write how many rows are done and the rows per second so far."""
+        if not self.progress_every or (done % self.progress_every and done != total):
+            return
+        rate = done / max(time.perf_counter() - start, 1e-6)
+        self.stdout.write(f"{label}: {done}/{total} rows ({rate:.0f} rows/s)")
+
+    def import_words(self):
+        data = self.read_csv("Kovol_lexicon.csv")
 
         data = [d for d in data if d["ID"]]
         for d in data:
@@ -53,156 +86,145 @@ class Command(BaseCommand):
         words = [w for w in data if " " not in w["Kovol"]]
         words = [w for w in words if w["POS"] != "v"]
 
-        words = sorted(words, key=lambda x: int(x["ID"]))
+        # rows sharing an ID are extra senses of the first row's word
+        rows_by_id = {}
+        for w in sorted(words, key=lambda x: int(x["ID"])):
+            rows_by_id.setdefault(w["ID"], []).append(w)
 
+        word_pks = dict(models.KovolWord.objects.values_list("kgu", "pk"))
+        senses = []
         errors = 0
         rows = 0
-        last_id = "0"
-        for w in words:
-            id = w["ID"]
-
-            if w["Matat"] == "n/a":
-                w["Matat"] = w["Kovol"]
-
-            if w["Matat"]:
-                matat = w["Matat"]
-            else:
-                matat = None
-
+        start = time.perf_counter()
+        for id, id_rows in rows_by_id.items():
+            w = id_rows[0]
+            english = w["English"].split(", ")
+            new_word = models.KovolWord(
+                kgu=w["Kovol"],
+                eng=english[0],
+                tpi=w["Tok Pisin"],
+                comments=self.get_comment(w),
+                matat=self.get_matat(w),
+                created=self.get_date(w),
+                checked=bool(w["Checked"]),
+                modified_by="Importer",
+                pos=self.get_pos(w),
+            )
             try:
-                date = datetime.datetime.strptime(w["Date"], "%d/%m/%y")
-            except ValueError:
-                date = datetime.date.today()
-
-            if w["Checked"]:
-                checked = True
-            else:
-                checked = False
-
-            pos = w["POS"]
-            if pos == "ass actr":
-                pos = "rel"
-            elif pos == "" or pos.lower() == "np":
-                pos = "uk"
+                # kgu is checked for repeats against word_pks instead
+                new_word.full_clean(validate_unique=False)
+            except ValidationError as e:
+                if len(e.error_dict) == 1 and e.error_dict.get("tpi"):
+                    pass
+                else:
+                    print(f"validation error: {e} \nrow={w}\n\n")
+                    errors += 1
 
-            if w["Example"]:
-                comment = f'{w["Definition"]}, Example: {w["Example"]}'
+            if new_word.kgu.lower() in word_pks:
+                print(f"repeated word: ID: {w['ID']} {w['Kovol']}")
             else:
-                comment = w["Definition"]
-
-            english = w["English"].split(", ")
-
-            if id == last_id:
-                try:
-                    new_sense = models.KovolWordSense(
-                        word=models.KovolWord.objects.get(kgu=w["Kovol"]),
-                        sense=w["English"],
-                    )
-                    new_sense.full_clean()
-                    if write:
-                        new_sense.save()
-                except models.KovolWord.DoesNotExist:
+                new_word.save()
+                word_pks[new_word.kgu] = new_word.pk
+                senses += [
+                    models.KovolWordSense(word_id=new_word.pk, sense=sense)
+                    for sense in english[1:]
+                ]
+
+            for w in id_rows[1:]:
+                new_sense = models.KovolWordSense(
+                    word_id=word_pks.get(w["Kovol"].lower()), sense=w["English"]
+                )
+                if new_sense.word_id is None:
                     print(
                         f"An ID number looks like it doesn't match a sense. {id}, {w['Kovol']}"
                     )
+                    continue
+                try:
+                    new_sense.full_clean(exclude=["word"])
+                    senses.append(new_sense)
                 except ValidationError as e:
                     print(e)
-            else:
-                try:
-                    new_word = models.KovolWord(
-                        kgu=w["Kovol"],
-                        eng=english[0],
-                        tpi=w["Tok Pisin"],
-                        comments=comment,
-                        matat=matat,
-                        created=date,
-                        checked=checked,
-                        modified_by="Importer",
-                        pos=pos,
-                    )
 
-                    try:
-                        new_word.full_clean()
-
-                    except ValidationError as e:
-                        if len(e.error_dict) == 1 and e.error_dict.get("tpi"):
-                            pass
-                        else:
-                            print(f"validation error: {e} \nrow={w}\n\n")
-                            errors += 1
-                    if write:
-                        new_word.save()
-
-                    if len(english) > 1 and write:
-                        for sense in english[1:]:
-                            new_sense = models.KovolWordSense(
-                                word=models.KovolWord.objects.get(kgu=w["Kovol"]),
-                                sense=sense,
-                            )
-                            new_sense.save()
-                except IntegrityError:
-                    print(f"repeated word: ID: {w['ID']} {w['Kovol']}")
-
-            last_id = id
-            rows += 1
+            rows += len(id_rows)
+            self.report("words", rows, len(words), start)
+        models.KovolWordSense.objects.bulk_create(senses)
         print(f"{rows} words, {errors} errors")
 
-        for p in phrases:
-            try:
-                date = datetime.datetime.strptime(p["Date"], "%d/%m/%y")
-            except ValueError:
-                date = datetime.date.today()
-
-            if p["Example"]:
-                comment = f'{p["Definition"]}, Example: {p["Example"]}'
-            else:
-                comment = p["Definition"]
-
+        phrase_pks = dict(models.PhraseEntry.objects.values_list("kgu", "pk"))
+        phrase_senses = []
+        start = time.perf_counter()
+        for rows, p in enumerate(phrases, 1):
             new_phrase = models.PhraseEntry(
                 kgu=p["Kovol"],
                 matat=p["Matat"],
                 eng=p["English"],
                 tpi=p["Tok Pisin"],
-                comments=comment,
-                created=date,
+                comments=self.get_comment(p),
+                created=self.get_date(p),
                 modified_by="Importer",
             )
             try:
-                new_phrase.full_clean()
+                new_phrase.full_clean(validate_unique=False)
             except ValidationError as e:
                 if len(e.error_dict) == 1 and e.error_dict.get("linked_word"):
                     pass
                 else:
                     print(f"validation error: {e} \nrow={p}\n\n")
-            if write:
-                try:
-                    new_phrase.save()
-                except IntegrityError:
-                    new_sense = models.PhraseSense(
-                        phrase=models.PhraseEntry.objects.get(kgu=p["Kovol"]),
-                        sense=p["English"],
-                    )
-                    if write:
-                        new_sense.save()
-                    print(f"repeated phrase {p['Kovol']}")
-
-    def import_verbs(self, write=True):
-        with open(os.path.join("data", "Kovol_verbs.csv")) as file:
-            data = [row for row in csv.DictReader(file)]
 
-        data = sorted(data, key=lambda x: x["English"])
-        english_verbs = set([v["English"] for v in data])
-
-        for verb in english_verbs:
-            conjugations = [v for v in data if verb == v["English"]]
+            kgu = p["Kovol"].lower()
+            if kgu in phrase_pks:
+                phrase_senses.append(
+                    models.PhraseSense(phrase_id=phrase_pks[kgu], sense=p["English"])
+                )
+                print(f"repeated phrase {p['Kovol']}")
+            else:
+                new_phrase.save()
+                phrase_pks[new_phrase.kgu] = new_phrase.pk
+            self.report("phrases", rows, len(phrases), start)
+        models.PhraseSense.objects.bulk_create(phrase_senses)
+        models.lexicon_changed()
+
+    def get_date(self, row):
+        try:
+            return datetime.datetime.strptime(row["Date"], "%d/%m/%y")
+        except ValueError:
+            return datetime.date.today()
+
+    def get_comment(self, row):
+        if row["Example"]:
+            return f'{row["Definition"]}, Example: {row["Example"]}'
+        return row["Definition"]
+
+    def get_matat(self, row):
+        if row["Matat"] == "n/a":
+            return row["Kovol"]
+        return row["Matat"] or None
+
+    def get_pos(self, row):
+        pos = row["POS"]
+        if pos == "ass actr":
+            return "rel"
+        elif pos == "" or pos.lower() == "np":
+            return "uk"
+        return pos
+
+    def import_verbs(self):
+        data = self.read_csv("Kovol_verbs.csv")
+
+        # every row is one conjugation, grouped into verbs by their English
+        verbs = {}
+        for row in data:
+            verbs.setdefault(row["English"], []).append(row)
+
+        verb_senses = []
+        verb_variations = []
+        rows = 0
+        start = time.perf_counter()
+        for conjugations in verbs.values():
             conjugation_dict = {}
             variations = []
             for c in conjugations:
-                if c["Checked"]:
-                    checked = True
-                else:
-                    checked = False
-
+                checked = bool(c["Checked"])
                 kgu = c["Kovol"].split(" ")[0]
 
                 english = c["English"].split(", ")
@@ -211,38 +233,26 @@ class Command(BaseCommand):
 
                 if not c["Mode"]:
                     key = f"{c['Tense']}_{c['Person']}"
-                    conjugation_dict[key] = kgu
-                    conjugation_dict[f"{key}_checked"] = checked
-
                 elif c["Mode"] == "imperative":
-                    if c["Person"] == "2s":
-                        key = "sg_imp"
-                        conjugation_dict[key] = kgu
-                        conjugation_dict[f"{key}_checked"] = checked
-
-                    elif c["Person"] == "2p":
-                        key = "pl_imp"
-                        conjugation_dict[key] = kgu
-                        conjugation_dict[f"{key}_checked"] = checked
-
+                    key = {"2s": "sg_imp", "2p": "pl_imp"}.get(c["Person"])
                 elif c["Mode"] == "nominalizer":
                     key = "nominalizer"
-                    conjugation_dict[key] = kgu
-                    conjugation_dict[f"{key}_checked"] = checked
-
                 elif c["Mode"] == "enclitic":
                     if c["Person"]:
                         key = f"enclitic_{c['Person']}"
-                        conjugation_dict[key] = kgu
-                        conjugation_dict[f"{key}_checked"] = checked
                     else:
                         key = "enclitic_same_actor"
-                        conjugation_dict["enclitic_same_actor"] = kgu
-                        conjugation_dict[f"{key}_checked"] = checked
 
                     if len(c["Kovol"].split(" ")) > 1:
                         v = c["Kovol"].split(" ")[1:]
                         variations.append((key, v))
+                else:
+                    key = None
+
+                if key:
+                    conjugation_dict[key] = kgu
+                    conjugation_dict[f"{key}_checked"] = checked
+
             new_verb = models.ImengisVerb(
                 eng=eng,
                 created=datetime.date.today(),
@@ -251,33 +261,44 @@ class Command(BaseCommand):
             )
             new_verb.__dict__.update(conjugation_dict)
             try:
-                new_verb.full_clean()
+                new_verb.full_clean(validate_unique=False)
             except ValidationError as e:
                 if len(e.error_dict) == 1 and e.error_dict.get("tpi"):
                     pass
                 else:
                     print(f"validation error: {e} \nrow={c}\n\n")
-            if write:
-                new_verb.save()
-                if sense:
-                    for s in sense:
-                        models.VerbSense.objects.create(verb=new_verb, sense=s)
-                if variations:
-                    for v in variations:
-                        models.VerbSpellingVariation.objects.create(
-                            verb=new_verb,
-                            spelling_variation=v[1][0],
-                            conjugation=conjugation_codes[v[0]],
-                        )
-
-    def import_check_list(self, write=True):
-        with open(os.path.join("data", "check_list.csv")) as file:
-            data = [row for row in csv.DictReader(file)]
-
+            new_verb.save()
+            verb_senses += [models.VerbSense(verb=new_verb, sense=s) for s in sense]
+            verb_variations += [
+                models.VerbSpellingVariation(
+                    verb=new_verb,
+                    spelling_variation=v[1][0],
+                    conjugation=conjugation_codes[v[0]],
+                )
+                for v in variations
+            ]
+
+            rows += len(conjugations)
+            self.report("verbs", rows, len(data), start)
+        models.VerbSense.objects.bulk_create(verb_senses)
+        models.VerbSpellingVariation.objects.bulk_create(verb_variations)
+        models.lexicon_changed()
+
+    def import_check_list(self):
+        data = self.read_csv("check_list.csv")
+
+        words = models.KovolWord.objects.in_bulk(field_name="kgu")
+        phrases = models.PhraseEntry.objects.in_bulk(field_name="kgu")
+        # the first verb with a conjugation is marked, as when verbs were searched in turn
+        verbs = {}
+        for verb in models.ImengisVerb.objects.all():
+            for conjugation in verb.get_conjugations():
+                verbs.setdefault(conjugation, verb)
+
+        marked = {models.KovolWord: {}, models.PhraseEntry: {}, models.ImengisVerb: {}}
         unmatched = []
-        for d in data:
-            found = False
-
+        start = time.perf_counter()
+        for rows, d in enumerate(data, 1):
             if d["Stanley spelling"]:
                 stanley = f"Stanley: {d['Stanley spelling']} "
             else:
@@ -296,46 +317,55 @@ class Command(BaseCommand):
             review_comments = stanley + hansen + stous
             orth = d["Orthography"]
 
-            try:
-                word = models.KovolWord.objects.get(kgu=orth)
-                word.review = 1
-                word.review_comments = review_comments
-                word.review_time = datetime.date.today()
-                word.review_user = "importer"
-                word.save()
-            except models.KovolWord.DoesNotExist:
-                try:
-                    phrase = models.PhraseEntry.objects.get(kgu=orth)
-                    phrase.review = 1
-                    phrase.review_comments = review_comments
-                    phrase.review_time = datetime.date.today()
-                    phrase.review_user = "importer"
-                    phrase.save()
-                except models.PhraseEntry.DoesNotExist:
-
-                    for verb in models.ImengisVerb.objects.all():
-                        conjugations = verb.get_conjugations()
-
-                        if orth in conjugations:
-                            verb.review = 1
-                            verb.review_comments = review_comments
-                            verb.review_time = datetime.date.today()
-                            verb.review_user = "importer"
-                            verb.save()
-                            found = True
-                            break
-                    if not found:
-                        unmatched.append(d)
-                        print(f"didn't find {orth}")
-
-        with open(os.path.join("data", "umnatched.csv"), "w") as file:
-            fieldnames = list(unmatched[0].keys())
-            writer = csv.DictWriter(file, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(unmatched)
+            entry = words.get(orth) or phrases.get(orth) or verbs.get(orth)
+            if entry is None:
+                unmatched.append(d)
+                print(f"didn't find {orth}")
+            else:
+                entry.review = 1
+                entry.review_comments = review_comments
+                entry.review_time = datetime.date.today()
+                entry.review_user = "importer"
+                marked[type(entry)][entry.pk] = entry
+            self.report("check list", rows, len(data), start)
+
+        for model, entries in marked.items():
+            model.objects.bulk_update(
+                entries.values(),
+                ["review", "review_comments", "review_time", "review_user"],
+            )
+        models.lexicon_changed()
+
+        if unmatched and not self.dry_run:
+            with open(os.path.join(self.directory, "umnatched.csv"), "w") as file:
+                fieldnames = list(unmatched[0].keys())
+                writer = csv.DictWriter(file, fieldnames=fieldnames)
+                writer.writeheader()
+                writer.writerows(unmatched)
 
     def handle(self, *args, **options):
+        self.directory = options["directory"]
+        self.dry_run = options["dry_run"]
+        self.progress_every = options["progress"]
+        if self.progress_every < 0:
+            raise CommandError("--progress must be 0 or a positive number of rows")
         self.stdout.write("Importing")
-        self.import_verbs(write=True)
-        self.import_words(write=True)
-        self.import_check_list()
+        start = time.perf_counter()
+        # the batch wraps the transaction so the version is bumped and the cache reset
+        # after the import is committed, or a request could cache the old lexicon under
+        # the new version
+        with models.lexicon_batch():
+            with transaction.atomic():
+                self.import_verbs()
+                self.import_words()
+                self.import_check_list()
+                if self.dry_run:
+                    transaction.set_rollback(True)
+                    models.discard_lexicon_changes()
+        seconds = time.perf_counter() - start
+        if self.dry_run:
+            self.stdout.write(
+                self.style.SUCCESS(f"Dry run finished in {seconds:.1f}s, nothing saved")
+            )
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Import finished in {seconds:.1f}s"))
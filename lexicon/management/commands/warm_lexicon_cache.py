@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from lexicon import utilities
+
+
+class Command(BaseCommand):
+    help = """Build the cached lexicon, letters and spelling index for each dialect, so the lexicon pages
+    and spell check don't have to after a restart or a change to the lexicon."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dialect",
+            choices=utilities.DIALECTS,
+            action="append",
+            help="Only warm this dialect, can be given more than once",
+        )
+
+    def handle(self, *args, **options):
+        dialects = options["dialect"] or utilities.DIALECTS
+        utilities.warm_lexicon_cache(dialects)
+        self.stdout.write(
+            self.style.SUCCESS("Lexicon cache warmed for %s" % ", ".join(dialects))
+        )
@@ -1,17 +1,22 @@
 from django.db import models
+from django.db.models import F
 from django.urls import reverse
 from django.core.validators import RegexValidator
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
-from django.core.cache import cache
 
 
 import re
 import logging
+import threading
+from contextlib import contextmanager
 from decimal import Decimal
 
 logger = logging.getLogger("debug")
 
+# tracks the lexicon_batch blocks running in this thread
+_batch = threading.local()
+
 
 kovol_text_validator = RegexValidator(
     regex="^[ieauowtyplkhgdsbnm]+$",
@@ -53,6 +58,58 @@ class LexiconMetaData(models.Model):
         default=0.0,
     )
 
+    @classmethod
+    def bump_version(cls):
+        """Add 0.001 to the version in a single UPDATE so concurrent saves can't
+        overwrite each other's increment."""
+        cls.objects.get_or_create(pk=1)
+        cls.objects.filter(pk=1).update(version=F("version") + Decimal("0.001"))
+
+
+def in_lexicon_batch():
+    return getattr(_batch, "depth", 0) > 0
+
+
+@contextmanager
+def lexicon_batch():
+    """Group lexicon changes so the version is bumped and the cache reset once.
+
+    Saves and deletes inside the block only note that the lexicon changed, the
+    version and cache are updated when the outermost block exits. Use it around
+    bulk operations such as imports, outside any transaction.atomic block so the
+    version is only bumped once the changes are committed."""
+    depth = getattr(_batch, "depth", 0)
+    if not depth:
+        _batch.changed = False
+    _batch.depth = depth + 1
+    try:
+        yield
+    finally:
+        _batch.depth = depth
+        if not depth and _batch.changed:
+            from lexicon.utilities import invalidate_lexicon_cache
+
+            LexiconMetaData.bump_version()
+            invalidate_lexicon_cache()
+
+
+def discard_lexicon_changes():
+    """Forget the changes recorded in the running lexicon_batch, when they've been
+    rolled back, so the batch leaves the version and cache alone."""
+    _batch.changed = False
+
+
+def lexicon_changed():
+    """Record a change made without saving a model, such as bulk_create or update,
+    which don't send the signals that reset the cache."""
+    if in_lexicon_batch():
+        _batch.changed = True
+    else:
+        from lexicon.utilities import invalidate_lexicon_cache
+
+        LexiconMetaData.bump_version()
+        invalidate_lexicon_cache()
+
 
 class LexiconEntry(models.Model):
     "A base class other models can inherit from."
@@ -100,13 +157,6 @@ class LexiconEntry(models.Model):
     def save(self, *args, **kwargs):
         self.eng = self.eng.lower()
         self.tpi = self.tpi.lower()
-        try:
-            version_obj = LexiconMetaData.objects.get(pk=1)
-        except LexiconMetaData.DoesNotExist:
-            LexiconMetaData.objects.create()
-            version_obj = LexiconMetaData.objects.get(pk=1)
-        version_obj.version += Decimal("0.001")
-        version_obj.save()
         return super(LexiconEntry, self).save(*args, **kwargs)
 
     def __str__(self):
@@ -490,18 +540,28 @@ class LexiconVerbEntry(LexiconEntry):
         else:
             return [getattr(self, t) for t in self.verb_text_fields if getattr(self, t)]
 
-    def identify_conjugation(self, text):
-        """Given a string identify which conjugation it is."""
+    def get_conjugation_index(self):
+        """Return a dict of {conjugation text: field name}.
+
+        If two fields share a spelling the first in verb_text_fields is used."""
+        conjugation_index = {}
         for t in self.verb_text_fields:
             conjugation = getattr(self, t)
-            if conjugation == text:
-                return {
-                    "conjugation": t,
-                    "value": text,
-                    "checked": getattr(self, f"{t}_checked"),
-                    "verb": self,
-                }
-        return None
+            if conjugation:
+                conjugation_index.setdefault(conjugation, t)
+        return conjugation_index
+
+    def identify_conjugation(self, text):
+        """Given a string identify which conjugation it is."""
+        t = self.get_conjugation_index().get(text)
+        if t is None:
+            return None
+        return {
+            "conjugation": t,
+            "value": text,
+            "checked": getattr(self, f"{t}_checked"),
+            "verb": self,
+        }
 
 
 #
@@ -703,11 +763,20 @@ class KovolWordSense(models.Model):
         return reverse("lexicon:word-detail", args=[self.word.pk])
 
 
-@receiver(post_save, sender=None)
-def clear_cache(**kwargs):
-    """Clear the cache whenever an entry saves"""
-    logger.info("cache reset")
-    cache.clear()
+@receiver([post_save, post_delete], sender=None)
+def clear_cache(sender, **kwargs):
+    """Bump the lexicon version and invalidate the cache whenever a lexicon model,
+    including spelling variations and ignore words, is saved or deleted.
+
+    Saves elsewhere in the project leave the cache alone."""
+    if sender._meta.app_label != "lexicon":
+        return
+    if sender._meta.model_name == "lexiconmetadata":
+        return
+    if not in_lexicon_batch():
+        logger.info("lexicon cache reset")
+    # a batch resets once when it ends
+    lexicon_changed()
 
 
 class IgnoreWord(models.Model):
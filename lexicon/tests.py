@@ -1,3 +1,471 @@
-# from django.test import TestCase
+import io
+import json
+import os
+import shutil
+import tempfile
+from decimal import Decimal
+from unittest import mock
+from zipfile import ZipFile
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.http import FileResponse
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from CE.models import CultureEvent
+from lexicon import models, utilities
+
+
+class LexiconIndexTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.word = models.KovolWord(kgu="hobot", eng="house", tpi="haus", checked=True)
+        self.word.save()
+        models.KovolWordSpellingVariation(
+            word=self.word, spelling_variation="hobet"
+        ).save()
+        self.verb = models.ImengisVerb(
+            eng="go",
+            tpi="go",
+            future_1s="yamin",
+            future_1s_checked=True,
+            past_1s="yagim",
+            past_1s_checked=False,
+        )
+        self.verb.save()
+        models.VerbSpellingVariation(
+            verb=self.verb, spelling_variation="yamen", conjugation="1sf"
+        ).save()
+
+    def test_headwords_and_variations_indexed(self):
+        index = utilities.get_lexicon_index()
+        self.assertEqual(index["hobot"].pk, self.word.pk)
+        self.assertEqual(index["hobot"].type, "word")
+        self.assertTrue(index["hobot"].checked)
+        self.assertEqual(index["hobet"].url, self.word.get_absolute_url())
+
+    def test_conjugations_indexed_with_checked_flag(self):
+        index = utilities.get_lexicon_index()
+        self.assertEqual(index["yamin"].conjugation, "future_1s")
+        self.assertTrue(index["yamin"].checked)
+        self.assertEqual(index["yagim"].conjugation, "past_1s")
+        self.assertFalse(index["yagim"].checked)
+
+    def test_verb_spelling_variation_counts_as_checked(self):
+        index = utilities.get_lexicon_index()
+        self.assertIsNone(index["yamen"].conjugation)
+        self.assertTrue(index["yamen"].checked)
+        self.assertNotIn("gamo", index)
+
+    def test_words_preferred_over_verbs(self):
+        models.KovolWord(kgu="yagim", eng="tree", tpi="diwai").save()
+        index = utilities.get_lexicon_index()
+        self.assertEqual(index["yagim"].type, "word")
+        self.assertFalse(index["yagim"].checked)
+
+    def test_identify_conjugation(self):
+        self.assertEqual(
+            self.verb.identify_conjugation("yagim")["conjugation"], "past_1s"
+        )
+        self.assertIsNone(self.verb.identify_conjugation("yamen"))
+
+
+class GetDbModelsTest(TestCase):
+    def add_entries(self, start, end):
+        for i in range(start, end):
+            word = models.KovolWord(
+                kgu=f"hobot{i}", matat=f"hobet{i}", eng="house", tpi="haus"
+            )
+            word.save()
+            models.KovolWordSpellingVariation(
+                word=word, spelling_variation=f"hobat{i}"
+            ).save()
+            verb = models.ImengisVerb(eng="go", tpi="go", future_1s=f"yamin{i}")
+            verb.save()
+            models.VerbSpellingVariation(
+                verb=verb, spelling_variation=f"yamen{i}", conjugation="1sf"
+            ).save()
+            models.MatatVerb(
+                eng="go", tpi="go", future_1s=f"yamun{i}", imengis_verb=verb
+            ).save()
+
+    def count_queries(self, matat_filter):
+        with CaptureQueriesContext(connection) as context:
+            utilities.get_db_models(matat_filter)
+        return len(context.captured_queries)
+
+    def test_query_count_doesnt_grow_with_lexicon(self):
+        for matat_filter in [False, True]:
+            self.add_entries(0, 2)
+            small = self.count_queries(matat_filter)
+            self.add_entries(2, 20)
+            self.assertEqual(self.count_queries(matat_filter), small)
+            models.KovolWord.objects.all().delete()
+            models.ImengisVerb.objects.all().delete()
+
+    def test_variations_attached(self):
+        self.add_entries(0, 2)
+        lexicon = utilities.get_db_models(matat_filter=False)
+        word = [w for w in lexicon if w.type == "word"][0]
+        self.assertEqual(word.variations, ["hobat0"])
+        verb = [v for v in lexicon if v.type == "verb"][0]
+        self.assertEqual(verb.conjugations, ["yamin0", "yamen0"])
+
+    def test_matat_filter(self):
+        self.add_entries(0, 1)
+        lexicon = utilities.get_db_models(matat_filter=True)
+        word = [w for w in lexicon if w.type == "word"][0]
+        self.assertEqual(word.kgu, "hobet0")
+        verb = [v for v in lexicon if v.type == "verb"][0]
+        self.assertEqual(verb.pk, models.ImengisVerb.objects.get().pk)
+        self.assertEqual(verb.conjugations, ["yamun0", "yamen0"])
+
+
+class LexiconCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.word = models.KovolWord(kgu="hobot", eng="house", tpi="haus")
+        self.word.save()
+
+    def test_lexicon_cached(self):
+        utilities.get_lexicon_index()
+        with self.assertNumQueries(0):
+            self.assertIn("hobot", utilities.get_lexicon_index())
+
+    def test_lexicon_save_and_delete_invalidate(self):
+        utilities.get_lexicon_index()
+        variation = models.KovolWordSpellingVariation(
+            word=self.word, spelling_variation="hobet"
+        )
+        variation.save()
+        self.assertIn("hobet", utilities.get_lexicon_index())
+        variation.delete()
+        self.assertNotIn("hobet", utilities.get_lexicon_index())
+
+    def test_other_saves_leave_cache(self):
+        cache.set("unrelated", "kept")
+        utilities.get_lexicon_index()
+        version = utilities.get_cache_version()
+        CultureEvent(title="Fishing").save()
+        self.assertEqual(utilities.get_cache_version(), version)
+        self.assertEqual(cache.get("unrelated"), "kept")
+        models.KovolWord(kgu="yagim", eng="tree", tpi="diwai").save()
+        self.assertNotEqual(utilities.get_cache_version(), version)
+        self.assertEqual(cache.get("unrelated"), "kept")
+
+
+class SharedCacheTest(TestCase):
+    """The lexicon in a file based cache, as shared by several workers."""
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        settings = override_settings(
+            CACHES={
+                "default": {
+                    "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                    "LOCATION": self.cache_dir,
+                }
+            }
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.word = models.KovolWord(kgu="hobot", eng="house", tpi="haus")
+        self.word.save()
+
+    def test_new_worker_reads_shared_cache(self):
+        utilities.get_lexicon_index()
+        # a worker that hasn't read the lexicon yet
+        utilities._local_cache.clear()
+        with self.assertNumQueries(0):
+            self.assertIn("hobot", utilities.get_lexicon_index())
+
+    def test_version_change_reaches_every_worker(self):
+        utilities.get_lexicon_index()
+        # another worker saves a change and bumps the shared cache version
+        models.KovolWord.objects.filter(pk=self.word.pk).update(kgu="hobet")
+        cache.incr(utilities.CACHE_VERSION_KEY)
+        index = utilities.get_lexicon_index()
+        self.assertIn("hobet", index)
+        self.assertNotIn("hobot", index)
+
+
+class LexiconMainViewTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        for kgu, eng in [("hobot", "house"), ("hagu", "yam"), ("yagim", "tree")]:
+            models.KovolWord(kgu=kgu, eng=eng, tpi="tok").save()
+
+    def test_initial_letters(self):
+        lexicon = utilities.get_lexicon_entries()
+        self.assertEqual(list(lexicon), ["h", "y"])
+        self.assertEqual([w.kgu for w in lexicon["h"]], ["hagu", "hobot"])
+        self.assertEqual([w.kgu for w in lexicon["y"]], ["yagim"])
+
+    def test_initial_letters_cached(self):
+        utilities.get_lexicon_entries()
+        with self.assertNumQueries(0):
+            utilities.get_lexicon_entries()
+
+    def test_whole_lexicon(self):
+        response = self.client.get(reverse("lexicon:main"))
+        self.assertContains(response, "hobot")
+        self.assertContains(response, "yagim")
+
+    def test_single_letter(self):
+        response = self.client.get(reverse("lexicon:main"), {"letter": "y"})
+        self.assertContains(response, "yagim")
+        self.assertNotContains(response, "hobot")
+        self.assertContains(response, 'href="?letter=h"')
+        response = self.client.get(reverse("lexicon:main"), {"letter": "h"})
+        self.assertContains(response, "hobot")
+        self.assertNotContains(response, ">yagim")
+
+
+class ExportTest(TestCase):
+    def setUp(self):
+        export_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, export_dir)
+        patcher = mock.patch.object(utilities, "EXPORT_DIR", export_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        models.KovolWord(kgu="hobot", eng="house", tpi="haus", checked=True).save()
+
+    def download(self, url_name):
+        response = self.client.get(reverse(url_name))
+        return response, b"".join(response.streaming_content)
+
+    def test_dic_built_once_per_version(self):
+        response, content = self.download("lexicon:dic_download")
+        self.assertNotIsInstance(response, FileResponse)
+        self.assertEqual(content, b"1\nhobot")
+        self.assertEqual(len(os.listdir(utilities.EXPORT_DIR)), 1)
+
+        response, content = self.download("lexicon:dic_download")
+        self.assertIsInstance(response, FileResponse)
+        self.assertEqual(content, b"1\nhobot")
+        self.assertIn("filename=lexicon.dic", response["Content-Disposition"])
+
+    def test_new_version_rebuilds(self):
+        self.download("lexicon:dic_download")
+        models.KovolWord(kgu="yagim", eng="tree", tpi="diwai", checked=True).save()
+        response, content = self.download("lexicon:dic_download")
+        self.assertEqual(content, b"2\nhobot\nyagim")
+        # the export for the old version is removed
+        self.assertEqual(len(os.listdir(utilities.EXPORT_DIR)), 1)
+
+    def test_json(self):
+        response, content = self.download("lexicon:json_download")
+        self.assertEqual([w["kgu"] for w in json.loads(content)], ["hobot"])
+
+    def test_oxt(self):
+        version = utilities.get_lexicon_version()
+        response, content = self.download("lexicon:oxt_download")
+        self.assertIn(
+            f"kovol_spellcheck_{version}.oxt", response["Content-Disposition"]
+        )
+        with ZipFile(io.BytesIO(content)) as oxt:
+            self.assertEqual(oxt.read("dictionaries/kgu_PG.dic"), b"1\nhobot")
+            self.assertIn(str(version), oxt.read("description.xml").decode())
+            self.assertIn("META-INF/manifest.xml", oxt.namelist())
+            self.assertNotIn("description_template.xml", oxt.namelist())
+
+
+class LexiconStatsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        word = models.KovolWord(kgu="hobot", eng="house", tpi="haus", pos="n")
+        word.save()
+        models.KovolWordSpellingVariation(word=word, spelling_variation="hobet").save()
+        models.KovolWord(kgu="yagim", eng="tree", tpi="diwai", checked=True).save()
+        verb = models.ImengisVerb(
+            eng="go",
+            tpi="go",
+            future_1s="yamun",
+            future_2s="yamen",
+            future_1s_checked=True,
+        )
+        verb.save()
+        models.VerbSpellingVariation(verb=verb, spelling_variation="yamon").save()
+        models.PhraseEntry(
+            kgu="hobot hagu", eng="my house", tpi="haus bilong mi"
+        ).save()
+
+    def test_counts_match_word_list(self):
+        stats = utilities.get_lexicon_stats()
+        self.assertEqual(
+            stats["total_words"], len(utilities.get_word_list(checked=False))
+        )
+        self.assertEqual(
+            stats["checked_words"], len(utilities.get_word_list(checked=True))
+        )
+        self.assertEqual(stats["total_words"], 6)
+        self.assertEqual(stats["checked_words"], 3)
+
+    def test_pos_counter(self):
+        stats = utilities.get_lexicon_stats()
+        self.assertEqual(stats["pos_counter"], {"n": 1, None: 1, "v": 1, "phr": 1})
+
+    def test_export_page(self):
+        response = self.client.get(reverse("lexicon:export"))
+        self.assertContains(response, "Total words: 6")
+        self.assertContains(response, "Checked words: 3")
+        with self.assertNumQueries(1):
+            # only the lexicon version is read while the stats are cached
+            self.client.get(reverse("lexicon:export"))
+
+
+class LexiconVersionTest(TestCase):
+    def add_word(self, kgu):
+        models.KovolWord(kgu=kgu, eng="house", tpi="haus").save()
+
+    def test_save_bumps_version(self):
+        self.add_word("hobot")
+        self.assertEqual(utilities.get_lexicon_version(), Decimal("0.001"))
+        self.add_word("hobet")
+        self.assertEqual(utilities.get_lexicon_version(), Decimal("0.002"))
+
+    def test_batch_bumps_version_once(self):
+        self.add_word("hobot")
+        cache_version = utilities.get_cache_version()
+        with models.lexicon_batch():
+            self.add_word("hobet")
+            with models.lexicon_batch():
+                self.add_word("hobit")
+            self.add_word("hobat")
+            self.assertEqual(utilities.get_lexicon_version(), Decimal("0.001"))
+            self.assertEqual(utilities.get_cache_version(), cache_version)
+        self.assertEqual(utilities.get_lexicon_version(), Decimal("0.002"))
+        self.assertEqual(utilities.get_cache_version(), cache_version + 1)
+
+    def test_batch_without_changes(self):
+        self.add_word("hobot")
+        with models.lexicon_batch():
+            pass
+        self.assertEqual(utilities.get_lexicon_version(), Decimal("0.001"))
+
+
+class ImportCsvTest(TestCase):
+    files = {
+        "Kovol_lexicon.csv": [
+            "ID,Kovol,Matat,Date,Checked,POS,Example,Definition,English,Tok Pisin",
+            '1,hobot,n/a,01/02/21,y,n,,,"house, home",haus',
+            "1,hobot,,,,n,,,building,haus",
+            "2,yagim,,,,n,,,tree,diwai",
+            "3,hobot hagu,,,,,,,my house,haus bilong mi",
+        ],
+        "Kovol_verbs.csv": [
+            "English,Checked,Kovol,Mode,Tense,Person,Author",
+            "go,y,yamun,,future,1s,Importer",
+            "go,,yamen,,future,2s,Importer",
+            "go,,yaminon yaminen,enclitic,,1s,Importer",
+        ],
+        "check_list.csv": [
+            "Stanley spelling,Hansen spelling,Stous spelling,Orthography",
+            "hobet,,,hobot",
+            ",yamin,,yamen",
+        ],
+    }
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        for name, lines in self.files.items():
+            with open(os.path.join(self.directory, name), "w") as file:
+                file.write("\n".join(lines))
+
+    def import_csv(self, *args, progress=1):
+        stdout = io.StringIO()
+        call_command(
+            "import_csv",
+            *args,
+            directory=self.directory,
+            progress=progress,
+            stdout=stdout,
+        )
+        return stdout.getvalue()
+
+    def test_import(self):
+        self.import_csv()
+        word = models.KovolWord.objects.get(kgu="hobot")
+        self.assertEqual(word.matat, "hobot")
+        self.assertEqual(
+            sorted(word.senses.values_list("sense", flat=True)), ["building", "home"]
+        )
+        self.assertEqual(word.review, "1")
+        self.assertEqual(word.review_comments, "Stanley: hobet ")
+        self.assertTrue(models.KovolWord.objects.filter(kgu="yagim").exists())
+        self.assertTrue(models.PhraseEntry.objects.filter(kgu="hobot hagu").exists())
+
+        verb = models.ImengisVerb.objects.get()
+        self.assertEqual(verb.future_1s, "yamun")
+        self.assertTrue(verb.future_1s_checked)
+        self.assertEqual(verb.enclitic_1s, "yaminon")
+        self.assertEqual(verb.review, "1")
+        self.assertEqual(
+            list(
+                verb.verbspellingvariation_set.values_list(
+                    "spelling_variation", flat=True
+                )
+            ),
+            ["yaminen"],
+        )
+        # the whole import is one change to the lexicon
+        self.assertEqual(utilities.get_lexicon_version(), Decimal("0.001"))
+
+    def test_version_bumped_after_commit(self):
+        # the test's own transaction is open throughout, the import's must be closed
+        test_blocks = len(connection.atomic_blocks)
+        blocks = []
+        bump_version = models.LexiconMetaData.bump_version
+        with mock.patch.object(
+            models.LexiconMetaData,
+            "bump_version",
+            side_effect=lambda: blocks.append(len(connection.atomic_blocks))
+            or bump_version(),
+        ):
+            self.import_csv()
+        self.assertEqual(blocks, [test_blocks])
+
+    def test_dry_run(self):
+        self.import_csv("--dry-run")
+        self.assertFalse(models.KovolWord.objects.exists())
+        self.assertFalse(models.ImengisVerb.objects.exists())
+        self.assertFalse(models.LexiconMetaData.objects.exists())
+
+    def test_progress(self):
+        self.assertIn("verbs: 3/3 rows", self.import_csv("--dry-run"))
+        output = self.import_csv("--dry-run", progress=0)
+        self.assertNotIn("rows", output)
+        self.assertIn("Dry run finished", output)
+        with self.assertRaises(CommandError):
+            self.import_csv(progress=-1)
+
+
+class DialectCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        models.KovolWord(kgu="hobot", eng="house", tpi="haus", matat="hobet").save()
+        models.KovolWord(kgu="yagim", eng="tree", tpi="diwai").save()
+
+    def test_dialects_cached_separately(self):
+        matat = utilities.get_lexicon_entries(utilities.MATAT)
+        imengis = utilities.get_lexicon_entries(utilities.IMENGIS)
+        self.assertEqual([w.kgu for w in matat["h"]], ["hobet"])
+        self.assertNotIn("y", matat)
+        self.assertEqual([w.kgu for w in imengis["h"]], ["hobot"])
+        self.assertIn("hobet", utilities.get_lexicon_index(utilities.MATAT))
+        self.assertNotIn("hobet", utilities.get_lexicon_index(utilities.IMENGIS))
+
+    def test_views_served_from_warm_cache(self):
+        call_command("warm_lexicon_cache", stdout=io.StringIO())
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("lexicon:matat"))
+        self.assertContains(response, "hobet")
+        self.assertNotContains(response, "yagim")
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("lexicon:main"))
+        self.assertContains(response, "yagim")
@@ -1,21 +1,177 @@
 from django.core.cache import cache
+from django.db.models import Count, Q
 from lexicon import models
+from CLAHub import perf
 
+import hashlib
+import io
 import os
-from zipfile import ZipFile
+import tempfile
+import time
+from collections import Counter, deque, namedtuple
+from decimal import Decimal
+from glob import glob
+from zipfile import ZipFile, ZIP_DEFLATED
 
+CACHE_VERSION_KEY = "lexicon:cache_version"
+# the dialects the lexicon is cached for, each has its own lexicon, letters and index
+IMENGIS = "imengis"
+MATAT = "matat"
+DIALECTS = (IMENGIS, MATAT)
+# exports are built once for each lexicon version and kept here
+EXPORT_DIR = os.path.join("data", "exports")
+OXT_EXTENSION_DIR = os.path.join("lexicon", "oxt_extension")
 
-def get_lexicon_words_from_cache(matat_filter=False):
-    lexicon_words = cache.get("lexicon_words")
+# A single spelling found in the lexicon, as used by the text spell-highlighter.
+# conjugation is the verb field the spelling matched, None for words and
+# spelling variations.
+LexiconIndexEntry = namedtuple(
+    "LexiconIndexEntry", ["type", "pk", "url", "conjugation", "checked"]
+)
 
-    if lexicon_words:
-        return lexicon_words
 
-    elif not lexicon_words:
-        lexicon_entries = get_db_models(matat_filter)
-        cache.set("lexicon", lexicon_entries)
-        cache.set("lexicon_words", [w for w in lexicon_entries if w.type != "phrase"])
-        return cache.get("lexicon_words")
+def get_cache_version():
+    """Return the version the lexicon's cache keys are stored under.
+
+    Bumped by invalidate_lexicon_cache whenever a lexicon model changes, which
+    leaves everything else in the cache alone."""
+    version = cache.get(CACHE_VERSION_KEY)
+    if version is None:
+        # start from the time so keys from before the version was lost aren't reused
+        cache.add(CACHE_VERSION_KEY, time.time_ns(), None)
+        version = cache.get(CACHE_VERSION_KEY)
+    return version
+
+
+def invalidate_lexicon_cache():
+    try:
+        cache.incr(CACHE_VERSION_KEY)
+    except ValueError:
+        cache.set(CACHE_VERSION_KEY, time.time_ns(), None)
+
+
+# The last value read from the shared cache for each name, as {name: (version, value)}.
+# With a shared cache backend every get unpickles the whole lexicon, so each worker
+# keeps the current version in memory and only reads the cache again once the
+# version has moved on.
+_local_cache = {}
+
+
+def cache_get(name, version=None):
+    """Get a lexicon item from the cache under the current cache version."""
+    version = version or get_cache_version()
+    local = _local_cache.get(name)
+    if local is not None and local[0] == version:
+        perf.record_cache(name, hit=True)
+        return local[1]
+    value = cache.get(f"lexicon:{name}", version=version)
+    if value is not None:
+        _local_cache[name] = (version, value)
+    perf.record_cache(name, hit=value is not None)
+    return value
+
+
+def cache_set(name, value, version=None):
+    """Set a lexicon item in the cache under the current cache version."""
+    version = version or get_cache_version()
+    cache.set(f"lexicon:{name}", value, version=version)
+    _local_cache[name] = (version, value)
+
+
+@perf.timed("lexicon_fetch")
+def get_lexicon_from_cache(dialect=IMENGIS):
+    """Return a dialect's words, verbs and phrases in alphabetical order."""
+    version = get_cache_version()
+    lexicon = cache_get(f"{dialect}:lexicon", version)
+    if lexicon is None:
+        lexicon = get_db_models(matat_filter=dialect == MATAT)
+        cache_set(f"{dialect}:lexicon", lexicon, version)
+    return lexicon
+
+
+def get_lexicon_words_from_cache(dialect=IMENGIS):
+    """Return a dialect's words and verbs in alphabetical order.
+
+    Only the full lexicon is stored in the cache, the words are filtered from it."""
+    return [w for w in get_lexicon_from_cache(dialect) if w.type != "phrase"]
+
+
+def get_lexicon_entries(dialect=IMENGIS):
+    """Returns a dialect's entries in {'letter': [objects]} format.
+
+    The grouped entries are cached alongside the lexicon (words, verbs and
+    phrases) they are built from."""
+    version = get_cache_version()
+    lexicon = cache_get(f"{dialect}:letters", version)
+    if lexicon is None:
+        lexicon = get_initial_letters(get_lexicon_from_cache(dialect))
+        cache_set(f"{dialect}:letters", lexicon, version)
+    return lexicon
+
+
+def get_initial_letters(words):
+    """Return a dict of initial letters as keys and the lexicon entries as
+    values."""
+    lexicon = {}
+    for w in words:
+        lexicon.setdefault(str(w)[0], []).append(w)
+    return dict(sorted(lexicon.items()))
+
+
+@perf.timed("lexicon_index")
+def get_lexicon_index(dialect=IMENGIS):
+    """Return a dict mapping every spelling in a dialect to a LexiconIndexEntry.
+
+    The index is built from the cached lexicon and cached alongside it, so it is
+    rebuilt once each time the lexicon changes rather than on every lookup."""
+    version = get_cache_version()
+    lexicon_index = cache_get(f"{dialect}:index", version)
+    if lexicon_index is None:
+        lexicon_index = build_lexicon_index(get_lexicon_words_from_cache(dialect))
+        cache_set(f"{dialect}:index", lexicon_index, version)
+    return lexicon_index
+
+
+def warm_lexicon_cache(dialects=DIALECTS):
+    """Build the cached lexicon, letters and spelling index of each dialect, so
+    the first request after a change doesn't have to."""
+    for dialect in dialects:
+        get_lexicon_entries(dialect)
+        get_lexicon_index(dialect)
+
+
+def build_lexicon_index(lexicon_words):
+    """Build a {spelling: LexiconIndexEntry} dict from words and verbs.
+
+    Headwords, spelling variations and verb conjugations are all included. Where a
+    spelling belongs to more than one entry words win over verbs, then the first
+    entry in alphabetical order wins, matching the order the spell checker has
+    always used."""
+    lexicon_index = {}
+    for w in lexicon_words:
+        if w.type != "word":
+            continue
+        entry = LexiconIndexEntry("word", w.pk, w.get_absolute_url(), None, w.checked)
+        for spelling in [w.kgu] + w.variations:
+            lexicon_index.setdefault(spelling, entry)
+
+    for v in lexicon_words:
+        if v.type != "verb":
+            continue
+        url = v.get_absolute_url()
+        for spelling, conjugation in v.get_conjugation_index().items():
+            lexicon_index.setdefault(
+                spelling,
+                LexiconIndexEntry(
+                    "verb", v.pk, url, conjugation, getattr(v, f"{conjugation}_checked")
+                ),
+            )
+        # anything left over is a spelling variation, which counts as checked
+        for spelling in v.conjugations:
+            lexicon_index.setdefault(
+                spelling, LexiconIndexEntry("verb", v.pk, url, None, True)
+            )
+    return lexicon_index
 
 
 def get_db_models(matat_filter):
@@ -25,28 +181,34 @@ def get_db_models(matat_filter):
     """
     if matat_filter:
         words = models.KovolWord.objects.exclude(matat__isnull=True)
-        verbs = models.MatatVerb.objects.all()
+        verbs = models.MatatVerb.objects.select_related("imengis_verb")
         phrases = models.PhraseEntry.objects.exclude(matat__isnull=True)
     else:
         words = models.KovolWord.objects.all()
         verbs = models.ImengisVerb.objects.all()
         phrases = models.PhraseEntry.objects.all()
 
+    # spelling variations are fetched in one query each and grouped in Python
+    word_variations = group_spelling_variations(
+        models.KovolWordSpellingVariation, "word_id"
+    )
+    verb_variations = group_spelling_variations(models.VerbSpellingVariation, "verb_id")
+
+    words = list(words)
+    verbs = list(verbs)
+    phrases = list(phrases)
+
     for w in words:
         w.type = "word"
         # add spelling variations to list for spell checking
-        w.variations = [
-            word.spelling_variation
-            for word in models.KovolWordSpellingVariation.objects.filter(word=w)
-        ]
+        w.variations = word_variations.get(w.pk, [])
 
     for v in verbs:
         v.type = "verb"
-        # add conjugations and spelling variations for spell checking
-        v.conjugations = v.get_conjugations()
-        variations = models.VerbSpellingVariation.objects.filter(verb=v)
-        if variations:
-            v.conjugations += [v.spelling_variation for v in variations]
+        # add conjugations and spelling variations for spell checking. Matat verbs
+        # share the variations of their Imengis verb
+        v.variations = verb_variations.get(getattr(v, "imengis_verb_id", v.pk), [])
+        v.conjugations = v.get_conjugations() + v.variations
     for p in phrases:
         p.type = "phrase"
 
@@ -54,20 +216,25 @@ def get_db_models(matat_filter):
         for w in words:
             w.kgu = w.matat
         for v in verbs:
-            v.pk = v.imengis_verb.pk
+            v.pk = v.imengis_verb_id
         for p in phrases:
             p.kgu = p.matat
 
-    words_queryset = sorted(
-        [w for w in words] + [v for v in verbs], key=lambda x: str(x)
-    )
-    cache.set("words_queryset", words_queryset)
-
     lexicon = [w for w in words] + [v for v in verbs] + [p for p in phrases]
 
     return sorted(lexicon, key=lambda x: str(x))
 
 
+def group_spelling_variations(model, entry_field):
+    """Return {entry pk: [spelling variations]} for a spelling variation model."""
+    variations = {}
+    for pk, spelling in model.objects.order_by("pk").values_list(
+        entry_field, "spelling_variation"
+    ):
+        variations.setdefault(pk, []).append(spelling)
+    return variations
+
+
 def get_word_list(checked=True):
     """Get all words from the lexicon.
     Returns a list in alphabetical order."""
@@ -81,62 +248,177 @@ def get_word_list(checked=True):
                     continue
             words.append(w.kgu)
             # automatically append spelling variations
-            spelling_variations = models.KovolWordSpellingVariation.objects.filter(
-                word=w
-            )
-            if spelling_variations:
-                for s in spelling_variations:
-                    words.append(s.spelling_variation)
+            words += w.variations
         elif w.type == "verb":
             words += w.get_conjugations(checked)
-            spelling_variations = models.VerbSpellingVariation.objects.filter(verb=w)
-            if spelling_variations:
-                for s in spelling_variations:
-                    words.append(s.spelling_variation)
+            words += w.variations
     return [w for w in words if w]
 
 
-def write_dic_file():
-    """Write the .dic file used in Hunspell."""
+def get_lexicon_stats():
+    """Return the number of words and checked words in the lexicon and a Counter
+    of parts of speech.
+
+    The word counts match the length of get_word_list, but are counted by the
+    database. The stats are cached until the lexicon changes."""
+    version = get_cache_version()
+    stats = cache_get("stats", version)
+    if stats is not None:
+        return stats
+
+    word_counts = models.KovolWord.objects.filter(kgu__gt="").aggregate(
+        total=Count("pk"), checked=Count("pk", filter=Q(checked=True))
+    )
+    word_variation_counts = models.KovolWordSpellingVariation.objects.filter(
+        spelling_variation__gt=""
+    ).aggregate(total=Count("pk"), checked=Count("pk", filter=Q(word__checked=True)))
+    # one count per conjugation, of the verbs that have it and have it checked
+    verb_counts = models.ImengisVerb.objects.aggregate(
+        **{
+            f"{t}_count": Count("pk", filter=Q(**{f"{t}__gt": ""}))
+            for t in models.LexiconVerbEntry.verb_text_fields
+        },
+        **{
+            f"{t}_checked_count": Count(
+                "pk", filter=Q(**{f"{t}__gt": "", f"{t}_checked": True})
+            )
+            for t in models.LexiconVerbEntry.verb_text_fields
+        },
+    )
+    verb_variation_count = models.VerbSpellingVariation.objects.filter(
+        spelling_variation__gt=""
+    ).count()
+
+    pos_counter = Counter()
+    for model in [models.KovolWord, models.ImengisVerb, models.PhraseEntry]:
+        pos_counts = model.objects.order_by().values_list("pos").annotate(Count("pk"))
+        for pos, count in pos_counts:
+            pos_counter[pos] += count
+
+    total_conjugations = sum(
+        verb_counts[f"{t}_count"] for t in models.LexiconVerbEntry.verb_text_fields
+    )
+    checked_conjugations = sum(
+        verb_counts[f"{t}_checked_count"]
+        for t in models.LexiconVerbEntry.verb_text_fields
+    )
+    stats = {
+        "total_words": word_counts["total"]
+        + word_variation_counts["total"]
+        + total_conjugations
+        + verb_variation_count,
+        "checked_words": word_counts["checked"]
+        + word_variation_counts["checked"]
+        + checked_conjugations
+        + verb_variation_count,
+        "pos_counter": pos_counter,
+    }
+    cache_set("stats", stats, version)
+    return stats
+
+
+def dic_file_chunks():
+    """Yield the .dic file used in Hunspell, the number of words then one per line."""
     words = get_word_list(checked=True)
-    # write a new .dic file in
-    dic_file = os.path.join("lexicon", "oxt_extension", "dictionaries", "kgu_PG.dic")
-    with open(dic_file, "w") as file:
-        file.write(str(len(words)))
-        file.writelines([f"\n{w}" for w in words])
+    yield str(len(words))
+    for w in words:
+        yield f"\n{w}"
 
 
-def update_oxt_version():
-    """Update the spell check version number to match CLAHub."""
+def get_lexicon_version():
+    """Return the lexicon version number, creating the meta data if needed."""
     try:
-        version = models.LexiconMetaData.objects.get(pk=1).version
+        return models.LexiconMetaData.objects.get(pk=1).version
     except models.LexiconMetaData.DoesNotExist:
         models.LexiconMetaData.objects.create()
-        version = models.LexiconMetaData.objects.get(pk=1).version
+        return models.LexiconMetaData.objects.get(pk=1).version
 
-    with open("lexicon/oxt_extension/description_template.xml", "r") as file:
-        contents = file.read()
-    with open("lexicon/oxt_extension/description.xml", "w") as file:
-        file.write(contents.replace("$VERSION", str(version)))
-    return version
+
+def oxt_package_chunks(version):
+    """Zip together the hunspell spellcheck as a .oxt file.
+
+    The .dic file and description.xml are generated for the lexicon version, the
+    rest of the extension is copied from lexicon/oxt_extension."""
+    dic_path = find_export("lexicon.dic", version) or build_export(
+        "lexicon.dic", version, dic_file_chunks()
+    )
+    with open(os.path.join(OXT_EXTENSION_DIR, "description_template.xml")) as file:
+        description = file.read().replace("$VERSION", str(version))
+    # replaced by the generated files
+    skip = ["description.xml", "description_template.xml", "dictionaries/kgu_PG.dic"]
+
+    package = io.BytesIO()
+    with ZipFile(package, "w", ZIP_DEFLATED) as myzip:
+        for root, dirs, files in os.walk(OXT_EXTENSION_DIR):
+            for f in sorted(files):
+                path = os.path.join(root, f)
+                arcname = os.path.relpath(path, OXT_EXTENSION_DIR)
+                if arcname not in skip:
+                    myzip.write(path, arcname=arcname)
+        myzip.writestr("description.xml", description)
+        myzip.write(dic_path, arcname="dictionaries/kgu_PG.dic")
+    yield package.getvalue()
+
+
+def find_export(name, version):
+    """Return the path of the export called name built for a lexicon version.
+
+    Returns None if it hasn't been built yet."""
+    stem, ext = os.path.splitext(name)
+    paths = glob(os.path.join(EXPORT_DIR, f"{stem}_{version}_*{ext}"))
+    return paths[0] if paths else None
+
+
+def stream_export(name, version, chunks, buffer_size=64 * 1024):
+    """Save chunks as the export called name for a lexicon version, yielding them
+    in blocks of about buffer_size bytes as they are written.
+
+    The export is written to a temporary file, then renamed to include the hash of
+    its content once complete, so a half written export is never served and two
+    users building the same export at once don't get in each other's way. Exports
+    from older versions are removed."""
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    stem, ext = os.path.splitext(name)
+    sha256 = hashlib.sha256()
+    file = tempfile.NamedTemporaryFile(dir=EXPORT_DIR, suffix=".part", delete=False)
+    try:
+        with file:
+            block = []
+            size = 0
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode()
+                block.append(chunk)
+                size += len(chunk)
+                if size >= buffer_size:
+                    block = b"".join(block)
+                    file.write(block)
+                    sha256.update(block)
+                    yield block
+                    block = []
+                    size = 0
+            block = b"".join(block)
+            file.write(block)
+            sha256.update(block)
+            yield block
+
+        path = os.path.join(
+            EXPORT_DIR, f"{stem}_{version}_{sha256.hexdigest()[:16]}{ext}"
+        )
+        os.replace(file.name, path)
+        for old in glob(os.path.join(EXPORT_DIR, f"{stem}_*{ext}")):
+            if Decimal(old.rsplit("_", 2)[-2]) < Decimal(version):
+                try:
+                    os.remove(old)
+                except FileNotFoundError:
+                    # already removed by another build
+                    pass
+    finally:
+        if os.path.exists(file.name):
+            os.remove(file.name)
 
 
-def write_oxt_package():
-    """Zip together the hunspell spellcheck as a .oxt file."""
-    write_dic_file()
-    version = update_oxt_version()
-    # zip the relevent files together
-    zip_path = os.path.join("data", f"kovol_spellcheck_{version}.oxt")
-    contents_path = os.path.join("lexicon", "oxt_extension")
-    contents = []
-    [contents.append(os.path.join(contents_path, f)) for f in os.listdir(contents_path)]
-    [
-        contents.append(os.path.join(contents_path, "dictionaries", f))
-        for f in os.listdir(os.path.join(contents_path, "dictionaries"))
-    ]
-    contents.append(os.path.join(contents_path, "META-INF", "manifest.xml"))
-
-    with ZipFile(zip_path, "w") as myzip:
-        for c in contents:
-            myzip.write(c, arcname=c.lstrip(contents_path))
-    return zip_path
+def build_export(name, version, chunks):
+    """Save chunks as the export called name and return its path."""
+    deque(stream_export(name, version, chunks), maxlen=0)
+    return find_export(name, version)
@@ -1,65 +1,49 @@
 import json
+import mimetypes
 import os
 import logging
-from collections import Counter
 
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.forms.models import model_to_dict
-from django.http import FileResponse
+from django.http import FileResponse, StreamingHttpResponse
 from django.shortcuts import render
 from django.urls import reverse_lazy
 from django.views import View
 from django.views.generic import DetailView
 from django.views.generic.edit import CreateView, DeleteView, UpdateView
 from django.views.generic.list import ListView
-from django.core.cache import cache
 
 from lexicon import models
 from lexicon import forms
 from lexicon import utilities
 
-
 logger = logging.getLogger("debug")
 
 
-def get_lexicon_entries(matat_filter=False):
-    """Returns all entries in {'letter': [objects]} format.
-
-    Also sets the cache items lexicon (contains words, verbs and phrases) and
-    lexicon words (contains words and verbs)."""
-
-    utilities.get_lexicon_words_from_cache()
-    return get_initial_letters(cache.get("lexicon"))
-
-
-def get_initial_letters(words):
-    """Return a dict of initial letters as keys and the lexicon entries as
-    values."""
-    letters = set([str(w)[0] for w in words])
-    lexicon = {letter: [w for w in words if str(w)[0] == letter] for letter in letters}
-    return dict(sorted(lexicon.items()))
+class LexiconView(View):
+    """The main display for the lexicon, listing all entries.
 
+    Adding ?letter= to the url lists only the entries starting with that letter."""
 
-class LexiconView(View):
-    """The main display for the lexicon, listing all entries."""
+    dialect = utilities.IMENGIS
 
     def get(self, request):
-        lexicon = get_lexicon_entries()
+        lexicon = utilities.get_lexicon_entries(self.dialect)
+        letter = request.GET.get("letter", "")
         context = {
-            "lexicon": lexicon,
+            "lexicon": {letter: lexicon.get(letter, [])} if letter else lexicon,
+            "letters": lexicon.keys(),
+            "letter": letter,
+            "dialect": self.dialect,
+            "cache_version": utilities.get_cache_version(),
         }
         return render(request, "lexicon/main_view.html", context=context)
 
 
-class MatatView(View):
+class MatatView(LexiconView):
     """The same as the main display, but filtered for matat data."""
 
-    def get(self, request):
-        lexicon = get_lexicon_entries(matat_filter=True)
-        context = {
-            "lexicon": lexicon,
-        }
-        return render(request, "lexicon/main_view.html", context=context)
+    dialect = utilities.MATAT
 
 
 class ReviewList(ListView):
@@ -103,13 +87,12 @@ class ReviewLiteracyView(ReviewList):
 
 class ExportView(View):
     def get(self, request):
+        stats = utilities.get_lexicon_stats()
         context = {
-            "version": models.LexiconMetaData.objects.get(pk=1).version,
-            "total_words": len(utilities.get_word_list(checked=False)),
-            "checked_words": len(utilities.get_word_list(checked=True)),
-            "checked_counter": Counter(
-                [w.pos for w in utilities.get_db_models(matat_filter=False)]
-            ),
+            "version": utilities.get_lexicon_version(),
+            "total_words": stats["total_words"],
+            "checked_words": stats["checked_words"],
+            "checked_counter": stats["pos_counter"],
         }
         return render(request, "./lexicon/export.html", context=context)
 
@@ -195,31 +178,53 @@ class CreatePhraseVariationView(LoginRequiredMixin, CreateView):
         return super().form_valid(form)
 
 
-def serve_file(file):
+def serve_file(file, filename=None):
     response = FileResponse(open(file, "rb"))
-    response["Content-Disposition"] = f"attachment; filename={os.path.basename(file)}"
+    filename = filename or os.path.basename(file)
+    response["Content-Disposition"] = f"attachment; filename={filename}"
     return response
 
 
-def download_dic(*args):
-    words = utilities.get_word_list(checked=True)
+def serve_export(name, version, chunks, filename=None):
+    """Serve the export called name for a lexicon version.
+
+    Exports are built once per version. The first download streams chunks while
+    they are saved, later downloads are served from the saved file."""
+    filename = filename or name
+    path = utilities.find_export(name, version)
+    if path:
+        return serve_file(path, filename)
+    response = StreamingHttpResponse(
+        utilities.stream_export(name, version, chunks),
+        content_type=mimetypes.guess_type(name)[0] or "application/octet-stream",
+    )
+    response["Content-Disposition"] = f"attachment; filename={filename}"
+    return response
 
-    dic_file = os.path.join("data", "lexicon.dic")
-    with open(dic_file, "w") as file:
-        file.write(str(len(words)))
-        file.writelines([f"\n{w}" for w in words])
-    return serve_file(dic_file)
 
+def json_chunks():
+    """Yield the whole lexicon as a JSON list, one entry at a time."""
+    yield "["
+    for i, w in enumerate(utilities.get_db_models(matat_filter=False)):
+        yield (", " if i else "") + json.dumps(model_to_dict(w))
+    yield "]"
 
-def download_json(*args):
-    word_objs = utilities.get_db_models(matat_filter=False)
-    json_data = [model_to_dict(w) for w in word_objs]
 
-    json_file = os.path.join("data", "lexicon.json")
-    with open(json_file, "w") as file:
-        json.dump(json_data, file)
-    return serve_file(json_file)
+def download_dic(*args):
+    version = utilities.get_lexicon_version()
+    return serve_export("lexicon.dic", version, utilities.dic_file_chunks())
+
+
+def download_json(*args):
+    version = utilities.get_lexicon_version()
+    return serve_export("lexicon.json", version, json_chunks())
 
 
 def download_oxt(*args):
-    return serve_file(utilities.write_oxt_package())
+    version = utilities.get_lexicon_version()
+    return serve_export(
+        "kovol_spellcheck.oxt",
+        version,
+        utilities.oxt_package_chunks(version),
+        filename=f"kovol_spellcheck_{version}.oxt",
+    )
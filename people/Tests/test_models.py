@@ -1,4 +1,6 @@
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
 from people import models
 
@@ -78,3 +80,68 @@ class PeopleModelTest(TestCase):
         person.save()
         self.assertIn('<a href="2"', person.family, 'family hyperlinks aren\'t working (smallest first)')
         self.assertIn('<a href="22"', person.family, 'family hyperlinks aren\'t working (smallest first)')
+
+    def test_relatives_recorded(self):
+        person2 = models.Person(name='Gerdine', village=self.village,
+                                family_plain_text='Husband : 1, Son: 5')
+        person2.save()
+        self.assertEqual([p.pk for p in person2.relatives.all()], [1])
+
+        person2.family_plain_text = ''
+        person2.save()
+        self.assertEqual(person2.family, '')
+        self.assertFalse(person2.relatives.exists())
+
+    def test_rename_updates_referencing_family(self):
+        person2 = models.Person(name='Gerdine', village=self.village,
+                                family_plain_text='Husband : 1')
+        person2.save()
+        person3 = models.Person(name='Bob', village=self.village)
+        person3.save()
+        last_modified = models.Person.objects.get(pk=2).last_modified
+
+        person1 = models.Person.objects.get(pk=1)
+        person1.name = 'Steven'
+        person1.save()
+        person2 = models.Person.objects.get(pk=2)
+        self.assertEqual(person2.family, 'Husband :<a href="1"> Steven</a>')
+        self.assertEqual(person2.last_modified, last_modified, 'referencing profile was resaved')
+
+    def test_rename_relinks_in_bulk(self):
+        def rename(name):
+            person1 = models.Person.objects.get(pk=1)
+            person1.name = name
+            with CaptureQueriesContext(connection) as queries:
+                person1.save()
+            return len(queries)
+
+        models.Person(name='Gerdine', village=self.village, family_plain_text='Husband : 1').save()
+        one_profile = rename('Steven')
+        for i in range(5):
+            models.Person(name='Child %d' % i, village=self.village, family_plain_text='Father : 1, Mother : 2').save()
+        # the names are fetched once and the family fields written in one update, however many profiles refer
+        self.assertEqual(rename('Stephen'), one_profile)
+        self.assertEqual(models.Person.objects.get(pk=7).family,
+                         'Father :<a href="1"> Stephen</a>, Mother :<a href="2"> Gerdine</a>')
+
+    def test_unchanged_name_doesnt_rewrite_family(self):
+        person2 = models.Person(name='Gerdine', village=self.village,
+                                family_plain_text='Husband : 1')
+        person2.save()
+        person1 = models.Person.objects.get(pk=1)
+        person1.clan = 'Clan'
+        # the save and checking the (empty) relatives, nothing for person2
+        with self.assertNumQueries(2):
+            person1.save()
+
+    def test_family_hyperlinks_one_query(self):
+        for i in range(60):
+            models.Person(name='Person %d' % i, village=self.village).save()
+        person = models.Person.objects.get(pk=2)
+        person.family_plain_text = 'Children 5, 55, 2 and 99'
+        # the profiles, the save and the relatives
+        with self.assertNumQueries(4):
+            person.save()
+        self.assertEqual(person.family, 'Children<a href="5"> Person 3</a>,<a href="55"> Person 53</a>,'
+                                        '<a href="2"> Person 0</a> and 99')
+        self.assertEqual({p.pk for p in person.relatives.all()}, {2, 5, 55})
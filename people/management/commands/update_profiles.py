@@ -8,14 +8,14 @@ logger = logging.getLogger('root')
 
 
 class Command(BaseCommand):
-    help = '''If a profile\'s name is changed that change won't be reflected in the family field that refers to that 
-    record. The solution is to schedule CLAHub to trigger the save function for all profiles periodically.
-     Trigger via crontab using: source venv/bin/activate && python manage.py update_profiles'''
+    help = '''Renaming a profile rewrites the family field of the profiles that refer to it, so this doesn\'t need
+    scheduling. Run it to rebuild every family field and the record of which profiles refer to which, e.g. after
+    importing data. Pictures aren't touched. Trigger via: source venv/bin/activate && python manage.py update_profiles'''
 
     def handle(self, **options):
-        """Updates the profiles by running the save command. This will update hyperlinks in the family field
-        to reflect name changes"""
-        for profile in Person.objects.all():
-            profile.save()
+        """Rebuild the hyperlinks in the family field of every profile"""
+        profiles = list(Person.objects.all())
+        for profile, relatives in zip(profiles, Person.relink_family(profiles)):
+            profile.relatives.set(relatives)
         self.stdout.write(self.style.SUCCESS('All profiles updated'))
         logger.info('All Person profiles updated via management command')
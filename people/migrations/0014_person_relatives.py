@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:10
+
+import re
+
+from django.db import migrations, models
+
+
+def fill_relatives(apps, schema_editor):
+    # record the profiles each family field already links to
+    Person = apps.get_model('people', 'Person')
+    pks = set(Person.objects.values_list('pk', flat=True))
+    for person in Person.objects.exclude(family_plain_text=''):
+        integers = {int(i) for i in re.findall(r' \d+', person.family_plain_text)}
+        person.relatives.set(integers & pks)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('people', '0013_alter_person_village'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='person',
+            name='relatives',
+            field=models.ManyToManyField(blank=True, editable=False, related_name='referenced_by', to='people.person'),
+        ),
+        migrations.RunPython(fill_relatives, migrations.RunPython.noop),
+    ]
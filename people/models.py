@@ -1,13 +1,8 @@
-import re
-
-import bleach
-from django.core.exceptions import ObjectDoesNotExist
 from django.db import models
 from django.utils.timezone import now
 
 from CLAHub import tools
-
-integer_regex = re.compile(' \d+')
+from people import utilities
 
 
 class Village(models.Model):
@@ -21,6 +16,7 @@ class Person(models.Model):
     def __init__(self, *args, **kwargs):
         super(Person, self).__init__(*args, **kwargs)
         self.original_picture = self.picture
+        self.original_name = self.name
 
     education_level = [
         ('1', 'None'),
@@ -52,34 +48,59 @@ class Person(models.Model):
     last_modified = models.DateTimeField(auto_now=True)
     last_modified_by = models.CharField(max_length=20)
     thumbnail = models.ImageField(upload_to=thumbnail_folder, blank=True)
+    # the profiles linked to from family, kept up to date on save so renaming a person only rewrites the family
+    # of the profiles that refer to them
+    relatives = models.ManyToManyField('self', symmetrical=False, related_name='referenced_by', blank=True,
+                                       editable=False)
+
+    # the picture and thumbnail sizes
+    picture_sizes = [(1200, 1200), (300, 300)]
+    # set by the batch importer when it has already compressed the picture and thumbnail
+    picture_compressed = False
 
     def save(self):
-        # don't re-upload the same image
+        # don't re-upload the same image, another profile's copy of it doesn't count
         if self.picture:
-            if tools.check_already_imported(self.picture):
+            if tools.check_already_imported(self.picture, Person.objects.filter(pk=self.pk)):
                 self.picture = self.original_picture
-            else:
-                thumbnail = self.picture  # do this if changing picture
-                self.picture = tools.compress_picture(self.picture, (1200, 1200))
-                # save an even smaller thumbnail
-                self.thumbnail = tools.compress_picture(thumbnail, (300, 300))
-
-        # search the family field for integers that indicate the user intends to add a hyperlink
-        if self.family_plain_text:
-            integers = re.findall(integer_regex, self.family_plain_text)
-            integers.sort(reverse=True)  # start with the biggest number so 5 doesn't replace a single 5 in 55
-
-            self.family = bleach.clean(self.family_plain_text)
-            for match in integers:
-                try:
-                    name = Person.objects.get(pk=match.lstrip()).name
-                    # replace ' ##' with a hyperlink. Using lstrip() to remove the space precents being matched twice
-                    self.family = self.family.replace(match, '<a href="{i}"> {display}</a>'.format(i=match.lstrip(),
-                                                                                                   display=name))
-                except ObjectDoesNotExist:
-                    pass
-
+                if self.picture_compressed:
+                    # the thumbnail was made from the same duplicate picture
+                    self.thumbnail = None
+            elif not self.picture_compressed:
+                # the picture is decoded once to make both sizes, the thumbnail is even smaller
+                pictures = tools.compress_picture_sizes(self.picture, self.picture_sizes)
+                self.picture, self.thumbnail = pictures or (None, None)
+
+        relatives = self.process_family()
         super(Person, self).save()
+        self.relatives.set(relatives)
+        if self.name != self.original_name:
+            self.update_referencing_family()
+        self.original_name = self.name
+
+    def process_family(self, names=None):
+        """Set family to the plain text with hyperlinks added and return the pks of the profiles linked to. names
+        is {pk: name} from utilities.referenced_names, when linking many profiles at once."""
+        # search the family field for integers that indicate the user intends to add a hyperlink
+        self.family, relatives = utilities.link_person_references(self.family_plain_text,
+                                                                  utilities.family_reference_regex,
+                                                                  '<a href="{pk}"> {name}</a>', names)
+        return relatives
+
+    @staticmethod
+    def relink_family(profiles):
+        """Rewrite the family of profiles with one query for every name they refer to and one bulk_update. Only
+        the family field is written, so pictures and last_modified are untouched. Returns the pks each profile
+        links to."""
+        names = utilities.referenced_names([profile.family_plain_text for profile in profiles],
+                                           utilities.family_reference_regex)
+        relatives = [profile.process_family(names) for profile in profiles]
+        Person.objects.bulk_update(profiles, ['family'])
+        return relatives
+
+    def update_referencing_family(self):
+        """Rewrite the family of the profiles that link to this one, after a rename."""
+        Person.relink_family(list(self.referenced_by.all()))
 
     def clear_picture(self):
         self.picture = None
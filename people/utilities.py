@@ -0,0 +1,43 @@
+import re
+
+import bleach
+from django.utils.html import escape
+
+import people.models
+
+# person references are profile pks typed into a text field, family uses ' ##' and speaker just '##'
+family_reference_regex = re.compile(r' (\d+)')
+speaker_reference_regex = re.compile(r'(\d+)')
+
+
+def referenced_names(texts, reference_regex):
+    """Return {pk: name} for every profile referenced in texts, fetched in one query."""
+    pks = {int(pk) for text in texts for pk in reference_regex.findall(text)}
+    if not pks:
+        return {}
+    return dict(people.models.Person.objects.filter(pk__in=pks).values_list('pk', 'name'))
+
+
+def link_person_references(text, reference_regex, link_format, names=None):
+    """Clean text and replace the person references matched by reference_regex with hyperlinks to the profiles.
+
+    link_format is formatted with the pk and name of the profile, the whole regex match is replaced. All the
+    referenced profiles are fetched in one query and the text is rewritten in one pass, so 5 can't be replaced
+    inside 55. When linking many texts pass in names from referenced_names, so nothing is fetched. References to
+    profiles that don't exist are left as they are. Returns the html and the set of pks linked to."""
+    text = bleach.clean(text)
+    if names is None:
+        names = referenced_names([text], reference_regex)
+    if not names:
+        return text, set()
+
+    linked = set()
+
+    def link(match):
+        pk = int(match.group(1))
+        if pk not in names:
+            return match.group(0)
+        linked.add(pk)
+        return link_format.format(pk=pk, name=escape(names[pk]))
+
+    return reference_regex.sub(link, text), linked